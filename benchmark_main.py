@@ -0,0 +1,667 @@
+import argparse
+import gzip
+import io
+import json
+import os
+import platform
+import random
+import re
+import string
+import subprocess
+import time
+import tracemalloc
+import warnings
+from functools import partial
+import numpy as np
+import pandas as pd
+from fastapi.testclient import TestClient
+from main import (
+    REGEX_BACKENDS,
+    SPELL_ENGINE,
+    TAG_ENGINE,
+    SentenceTagger,
+    check_tagger_model,
+    ModelUnavailable,
+    STRING_ENGINES,
+    ReadOptions,
+    read_csv_frame,
+    stream_duplicate_rows,
+    pa,
+    app,
+    compile_pipeline,
+    run_pipeline,
+    remove_spaces,
+    remove_nulls,
+    replace_chars,
+    remove_chars,
+    to_lower,
+    to_upper,
+    to_title,
+    remove_duplicate_rows,
+    remove_near_duplicate_rows,
+    remove_duplicate_columns,
+    remove_empty_rows,
+    remove_empty_columns,
+    remove_negative_values,
+    arrange_column_ascending,
+    arrange_column_descending,
+    remove_out_of_range_values,
+    clean_numeric_values,
+    remove_punctuation,
+    remove_numerical_characters,
+    remove_alphabetical_characters,
+    remove_non_alphanumeric,
+    remove_emojis,
+    remove_html_tags,
+    remove_urls,
+    check_spelling,
+    tag_parts_of_speech,
+    replace_long_vowel,
+    normalize_indic,
+    remove_rare_words,
+    LONG_VOWELS,
+    EMOJI_RANGES,
+    NORMALIZATION_FORMS,
+)
+
+
+WORDS = ["data", "Cleaning", "pipeline", "CSV", "column", "value", "test", "fast"]
+
+
+#build a text column with spaces, punctuation, HTML and URLs to clean
+def make_text_column(rows: int, seed: int = 0):
+    rng = random.Random(seed)
+    values = []
+    for _ in range(rows):
+        words = rng.choices(WORDS, k=rng.randint(3, 10))
+        if rng.random() < 0.3:
+            words.append("<b>bold</b>")
+        if rng.random() < 0.2:
+            words.append("http://example.com/page")
+        values.append("  ".join(words) + " .  ")
+    return pd.Series(values, dtype=object)
+
+
+def _timed(func, *args):
+    start = time.perf_counter()
+    result = func(*args)
+    return time.perf_counter() - start, result
+
+
+#sequential per-operation calls against one compiled, fused pipeline
+def bench_fused_pipeline(rows: int):
+    column = make_text_column(rows)
+    sequential = [
+        (remove_spaces, ()),
+        (replace_chars, (["a", "e"], "_")),
+        (remove_chars, (["<", ">"],)),
+        (to_lower, ()),
+        (remove_punctuation, ()),
+        (remove_html_tags, ()),
+        (remove_urls, ()),
+    ]
+    operations = [
+        ('remove_spaces', {'column_name': 'text'}),
+        ('replace_chars', {'column_name': 'text', 'chars_to_be_replaced': ["a", "e"], 'char_to_replace': "_"}),
+        ('remove_chars', {'column_name': 'text', 'chars_to_be_removed': ["<", ">"]}),
+        ('to_lower', {'column_name': 'text'}),
+        ('remove_punctuation', {'column_name': 'text'}),
+        ('remove_html_tags', {'column_name': 'text'}),
+        ('remove_urls', {'column_name': 'text'}),
+    ]
+
+    def run_sequential(df):
+        for func, args in sequential:
+            df = func(df, 'text', *args)
+        return df
+
+    def run_fused(df):
+        return run_pipeline(df, compile_pipeline(operations))
+
+    old_time, old = _timed(run_sequential, pd.DataFrame({'text': column}))
+    new_time, new = _timed(run_fused, pd.DataFrame({'text': column}))
+    assert old['text'].equals(new['text'])
+    print(f"fused pipeline, {rows} rows: sequential {old_time:.2f}s, fused {new_time:.2f}s, "
+          f"speedup {old_time / new_time:.1f}x")
+
+
+#the per-character apply() filters these functions used to be
+OLD_CHARACTER_FILTERS = {
+    remove_punctuation: lambda x: ''.join([c for c in x if c not in string.punctuation]),
+    remove_numerical_characters: lambda x: ''.join([c for c in x if not c.isdigit()]),
+    remove_alphabetical_characters: lambda x: ''.join([c for c in x if not c.isalpha()]),
+    remove_non_alphanumeric: lambda x: ''.join(c for c in x if c.isalnum()),
+}
+
+
+#the same emoji rules as one precompiled regex, for comparison: emoji,
+#joiners, and characters followed by the emoji variation selector or keycap
+EMOJI_REGEX = re.compile(
+    '[' + ''.join(f"{chr(start)}-{chr(end)}" for start, end in EMOJI_RANGES) + '\u200d\ufe0e\ufe0f\u20e3]'
+    '|.(?=[\ufe0f\u20e3])'
+)
+
+
+def bench_character_filters(rows: int):
+    column = make_text_column(rows) + " 42 ½ é" + pd.Series([" 👍🏽", " 👨\u200d👩\u200d👧", " #️⃣ 🇮🇳", ""] * (rows // 4 + 1))[:rows].to_numpy()
+    for func, old_filter in OLD_CHARACTER_FILTERS.items():
+        func(pd.DataFrame({'text': column.head(10)}), 'text')  # build the class mask
+        old_time, old = _timed(column.apply, old_filter)
+        new_time, new = _timed(func, pd.DataFrame({'text': column}), 'text')
+        assert old.equals(new['text'])
+        print(f"{func.__name__}, {rows} rows: apply {old_time:.2f}s, vectorised {new_time:.2f}s, "
+              f"speedup {old_time / new_time:.1f}x")
+    remove_emojis(pd.DataFrame({'text': column.head(10)}), 'text')
+    regex_time, regex = _timed(partial(column.str.replace, regex=True), EMOJI_REGEX, '')
+    new_time, new = _timed(remove_emojis, pd.DataFrame({'text': column}), 'text')
+    assert regex.equals(new['text'])
+    print(f"remove_emojis, {rows} rows: regex {regex_time:.2f}s, vectorised {new_time:.2f}s {rows / new_time:,.0f} rows/s, "
+          f"speedup {regex_time / new_time:.1f}x")
+
+
+#the old replace_chars: one full column pass per character
+def _replace_one_by_one(column: pd.Series, targets: list, replacement: str):
+    for target in targets:
+        column = column.str.replace(target, replacement)
+    return column
+
+
+def bench_replace_chars(rows: int):
+    column = make_text_column(rows)
+    single = list(string.ascii_letters[:40] + string.punctuation[:20])
+    multi = [chr(0x100 + 2 * i) + chr(0x101 + 2 * i) for i in range(50)] + ["data", "CSV"]
+    for name, targets in (("single characters", single), ("multi-character strings", multi)):
+        old_time, old = _timed(_replace_one_by_one, column, targets, "#")
+        new_time, new = _timed(replace_chars, pd.DataFrame({'text': column}), 'text', targets, "#")
+        assert old.equals(new['text'])
+        print(f"replace_chars, {len(targets)} {name}, {rows} rows: one by one {old_time:.2f}s, "
+              f"single pass {new_time:.2f}s, speedup {old_time / new_time:.1f}x")
+
+
+#what remove_spaces, remove_html_tags and remove_urls used to do
+OLD_REGEX_OPERATIONS = {
+    remove_spaces: lambda column: column.str.replace(r'\s+', ' ', regex=True)
+        .str.replace(r'(\s+)\.', '.', regex=True).str.replace(r'\s+$', '', regex=True),
+    remove_html_tags: lambda column: column.apply(lambda x: re.sub(r'<.*?>', '', x)),
+    remove_urls: lambda column: column.apply(lambda x: re.sub(r'http\S+|www\S+', '', x)),
+}
+
+
+#each regex operation on its own, old against every available backend
+def bench_regex_operations(rows: int):
+    column = make_text_column(rows)
+    backends = [backend for backend in REGEX_BACKENDS if backend != 'pyarrow' or pa is not None]
+    for func, old_operation in OLD_REGEX_OPERATIONS.items():
+        old_time, old = _timed(old_operation, column)
+        timings = []
+        for backend in backends:
+            func(pd.DataFrame({'text': column.head(10)}), 'text', backend)  # build the RE2 sources
+            new_time, new = _timed(func, pd.DataFrame({'text': column}), 'text', backend)
+            assert old.equals(new['text'])
+            timings.append(f"{backend} {new_time:.2f}s ({old_time / new_time:.1f}x)")
+        print(f"{func.__name__}, {rows} rows: before {old_time:.2f}s, " + ", ".join(timings))
+
+
+#cleaning three columns took three uploads of the same file before column_name
+#took a list; now the file is parsed once and the columns run side by side
+def bench_multi_column(rows: int):
+    content = make_dataset(rows).to_csv(index=False).encode()
+    client = TestClient(app)
+    columns = UPLOAD_COLUMNS['upload_columns']
+
+    def upload(column_name):
+        response = client.post(
+            "/upload/", params=UPLOAD_PARAMS['upload'], files={"file": ("data.csv", content)},
+            data={"column_name": column_name},
+        )
+        assert response.status_code == 200, response.text
+        return response
+
+    one_by_one_time, _ = _timed(lambda: [upload(column) for column in columns])
+    together_time, _ = _timed(upload, columns)
+    print(f"{len(columns)} columns, {rows} rows: one upload per column {one_by_one_time:.2f}s, "
+          f"one upload {together_time:.2f}s, speedup {one_by_one_time / together_time:.1f}x")
+
+
+#reading and every text operation with text held as Python strings and as
+#Arrow strings. the size is what the frame's text columns take in memory;
+#Arrow allocates outside tracemalloc, so there is no peak to compare
+def bench_string_engines(rows: int):
+    engines = [engine for engine in STRING_ENGINES if engine != 'pyarrow' or pa is not None]
+    content = make_dataset(rows).to_csv(index=False).encode()
+    frames = {}
+    for engine in engines:
+        seconds, frames[engine] = _timed(read_csv_frame, io.BytesIO(content), ReadOptions(string_engine=engine))
+        size = frames[engine][['text', 'sparse', 'hindi']].memory_usage(deep=True, index=False).sum()
+        print(f"read_csv {engine}, {rows} rows: {seconds:.2f}s, text columns {size / 2**20:.0f} MB")
+    for func, column_name, args in SUITE_FUNCTIONS:
+        if column_name not in ('text', 'sparse', 'hindi') or func is check_spelling:
+            continue
+        timings = {}
+        results = []
+        for engine, df in frames.items():
+            _run_function(func, column_name, args, df.head(100).copy())  # builds the tables
+            timings[engine], result = _timed(_run_function, func, column_name, args, df.copy())
+            results.append(result[column_name])
+            timings[engine] = (timings[engine], result[column_name].memory_usage(deep=True, index=False))
+        assert all(result.astype(object).equals(results[0].astype(object)) for result in results)
+        base_time = timings['object'][0]
+        print(f"{func.__name__}, {rows} rows: " + ", ".join(
+            f"{engine} {seconds:.2f}s {rows / seconds:,.0f} rows/s {size / 2**20:.0f} MB ({base_time / seconds:.1f}x)"
+            for engine, (seconds, size) in timings.items()
+        ))
+
+
+#every long vowel shortened the old way, one str.replace per letter,
+#against normalize_indic's single translate pass
+def bench_indic_normalization(rows: int):
+    df = make_dataset(rows)[['hindi']]
+
+    def one_by_one(df):
+        for letter in LONG_VOWELS:
+            df['hindi'] = df['hindi'].str.replace(re.escape(letter), LONG_VOWELS[letter])
+        return df
+
+    old_time, old = _timed(one_by_one, df.copy())
+    new_time, new = _timed(normalize_indic, df.copy(), 'hindi')
+    assert old.equals(new)
+    print(f"normalize_indic, {len(LONG_VOWELS)} long vowels, {rows} rows: one by one {old_time:.2f}s, "
+          f"single pass {new_time:.2f}s {rows / new_time:,.0f} rows/s, speedup {old_time / new_time:.1f}x")
+    for form in NORMALIZATION_FORMS:
+        seconds, _ = _timed(normalize_indic, df.copy(), 'hindi', 'devanagari', form, True)
+        print(f"normalize_indic with {form} and nukta folding, {rows} rows: {seconds:.2f}s {rows / seconds:,.0f} rows/s")
+
+
+#a text column whose words follow a Zipf distribution over a vocabulary of
+#dictionary words and misspellings of them
+def make_zipf_column(rows: int, vocabulary: int = 5000, seed: int = 0):
+    rng = np.random.default_rng(seed)
+    words = sorted(SPELL_ENGINE.checker.word_frequency.keys())
+    words = [word for word in words if len(word) > 3][:vocabulary]
+    words = [word[:1] + word[2:] if i % 3 == 0 else word for i, word in enumerate(words)]
+    ranks = rng.zipf(1.3, size=rows * 8)
+    tokens = np.array(words, dtype=object)[(ranks - 1) % len(words)]
+    return pd.Series([' '.join(tokens[i:i + 8]) for i in range(0, len(tokens), 8)], dtype=object)
+
+
+#the old check_spelling called correction() once per token of every row
+def bench_check_spelling(rows: int):
+    column = make_zipf_column(rows)
+    tokens = int(column.str.split().str.len().sum())
+    SPELL_ENGINE.clear_cache()
+    start_calls = SPELL_ENGINE.correction_calls
+    first_time, _ = _timed(check_spelling, pd.DataFrame({'text': column}), 'text')
+    first_calls = SPELL_ENGINE.correction_calls - start_calls
+    second_time, _ = _timed(check_spelling, pd.DataFrame({'text': column}), 'text')
+    second_calls = SPELL_ENGINE.correction_calls - start_calls - first_calls
+    print(f"check_spelling, {rows} rows: {tokens} correction() calls before, "
+          f"{first_calls} now ({first_time:.2f}s); warm cache {second_calls} calls ({second_time:.2f}s)")
+
+
+#a tagger built for the request and called on every row against the engine's
+#batches, first with a cold cache and then with a warm one
+def bench_pos_tagging(rows: int):
+    try:
+        check_tagger_model(TAG_ENGINE.model_dir)
+    except ModelUnavailable as error:
+        print(f"tag_parts_of_speech skipped: {error}")
+        return
+    column = make_text_column(rows)
+
+    def per_row(df):
+        tagger = SentenceTagger(TAG_ENGINE.model_dir)
+        df['text_pos'] = df['text'].map(lambda x: tagger.tag([x])[x][0])
+        return df
+
+    old_time, _ = _timed(per_row, pd.DataFrame({'text': column}))
+    TAG_ENGINE.clear_cache()
+    TAG_ENGINE.tag_texts(["warm up the workers"] * 2 * TAG_ENGINE.batch_size)
+    cold_time, _ = _timed(tag_parts_of_speech, pd.DataFrame({'text': column}), 'text')
+    warm_time, _ = _timed(tag_parts_of_speech, pd.DataFrame({'text': column}), 'text')
+    chunk_time, _ = _timed(tag_parts_of_speech, pd.DataFrame({'text': column}), 'text', True)
+    print(f"tag_parts_of_speech, {rows} rows, {TAG_ENGINE.workers} workers: per row {old_time:.2f}s "
+          f"{rows / old_time:,.0f} rows/s, batched {cold_time:.2f}s {rows / cold_time:,.0f} rows/s, "
+          f"warm cache {warm_time:.2f}s {rows / warm_time:,.0f} rows/s, with chunks {chunk_time:.2f}s {rows / chunk_time:,.0f} rows/s")
+    TAG_ENGINE.close()
+
+
+#the old remove_negative_values went through apply and object values, and
+#the range check was a second pass over the same column
+def bench_numeric_values(rows: int):
+    column = pd.Series(np.random.default_rng(0).integers(-1000, 1000, rows))
+
+    def separately(df):
+        df['number'] = df['number'].apply(lambda x: x if x >= 0 else None)
+        df.loc[(df['number'] < 0) | (df['number'] > 500), 'number'] = None
+        return df
+
+    old_time, old = _timed(separately, pd.DataFrame({'number': column}))
+    new_time, new = _timed(clean_numeric_values, pd.DataFrame({'number': column}), 'number', True, 0, 500)
+    small_time, small = _timed(
+        clean_numeric_values, pd.DataFrame({'number': column}), 'number', True, 0, 500, None, None, True)
+    print(f"remove_negative_values + remove_out_of_range_values, {rows} rows: separately {old_time:.2f}s, "
+          f"one pass {new_time:.2f}s {rows / new_time:,.0f} rows/s, speedup {old_time / new_time:.1f}x; "
+          f"downcast to {small['number'].dtype} {small_time:.2f}s, "
+          f"{new['number'].nbytes / 2**20:.1f} MB -> {small['number'].nbytes / 2**20:.1f} MB")
+
+
+#what stream_duplicate_rows used to do: a set of every distinct row as a tuple
+def _old_stream_duplicate_rows(chunks):
+    seen = set()
+    for chunk in chunks:
+        rows = chunk.astype(object).where(chunk.notna(), None)
+        keep = []
+        for row in rows.itertuples(index=False, name=None):
+            keep.append(row not in seen)
+            seen.add(row)
+        yield chunk[keep]
+
+
+#chunked duplicate removal with the set of row tuples against the set of
+#row hashes, with the memory each keeps across chunks
+def bench_duplicate_rows(rows: int, chunk_size: int = 100_000):
+    df = make_dataset(rows)
+    df['id'] %= rows // 2
+    chunks = [df.iloc[start:start + chunk_size] for start in range(0, rows, chunk_size)]
+    timings = []
+    for name, stream in (('before', _old_stream_duplicate_rows), ('hashes', stream_duplicate_rows),
+                         ('exact', partial(stream_duplicate_rows, exact=True))):
+        seconds, peak = measure(lambda: chunks, lambda chunks: sum(map(len, stream(iter(chunks)))))
+        timings.append(f"{name} {seconds:.2f}s peak {peak / 2**20:.0f} MB")
+    print(f"stream_duplicate_rows, {rows} rows: " + ", ".join(timings))
+
+
+#rows in each synthetic dataset, by the name used on the command line
+SIZES = {'10k': 10_000, '100k': 100_000, '1m': 1_000_000, '10m': 10_000_000}
+
+#generated datasets are cached here and results are saved here, one file per commit
+RESULTS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), '.benchmarks')
+DATA_DIR = os.path.join(RESULTS_DIR, 'data')
+
+DEVANAGARI_WORDS = ["भारत", "पानी", "किताब", "दूध", "मौसम", "सीखना", "कौन", "आसमान", "पीला", "रेलगाड़ी", "बैठो", "फूल"]
+
+
+#rows are drawn from pools of distinct values so even 10M rows build quickly.
+#columns: text to clean, signed numbers, text that is 90% null, Hindi text
+def make_dataset(rows: int, seed: int = 0):
+    rng = np.random.default_rng(seed)
+    text_pool = make_text_column(10_000, seed).to_numpy()
+    hindi_pool = np.array(
+        [' '.join(rng.choice(DEVANAGARI_WORDS, size=rng.integers(2, 9))) for _ in range(10_000)], dtype=object
+    )
+    return pd.DataFrame({
+        'id': np.arange(rows),
+        'text': text_pool[rng.integers(0, len(text_pool), rows)],
+        'number': rng.normal(0, 100, rows).round(2),
+        'sparse': np.where(rng.random(rows) < 0.9, None, text_pool[rng.integers(0, len(text_pool), rows)]),
+        'hindi': hindi_pool[rng.integers(0, len(hindi_pool), rows)],
+    })
+
+
+def dataset_path(size: str, compression: str = None):
+    path = os.path.join(DATA_DIR, f"{size}.csv")
+    if not os.path.exists(path):
+        os.makedirs(DATA_DIR, exist_ok=True)
+        make_dataset(SIZES[size]).to_csv(path, index=False)
+    if compression is None:
+        return path
+    compressed_path = f"{path}.{compression}"
+    if not os.path.exists(compressed_path):
+        with open(path, 'rb') as file:
+            content = file.read()
+        with open(compressed_path, 'wb') as file:
+            file.write(gzip.compress(content) if compression == 'gz' else pa.compress(content, 'zstd', asbytes=True))
+    return compressed_path
+
+
+#every preprocessing function with the column and arguments it is timed on;
+#frame-wide functions have no column
+SUITE_FUNCTIONS = [
+    (remove_spaces, 'text', ()),
+    (remove_nulls, 'sparse', ()),
+    (replace_chars, 'text', (["a", "e", "ing"], "_")),
+    (remove_chars, 'text', (["<", ">"],)),
+    (to_lower, 'text', ()),
+    (to_upper, 'text', ()),
+    (to_title, 'text', ()),
+    (remove_duplicate_rows, None, ()),
+    (remove_near_duplicate_rows, 'text', ()),
+    (remove_duplicate_columns, None, ()),
+    (remove_empty_rows, None, ()),
+    (remove_empty_columns, None, ()),
+    (remove_negative_values, 'number', ()),
+    (arrange_column_ascending, 'number', ()),
+    (arrange_column_descending, 'number', ()),
+    (remove_out_of_range_values, 'number', (-50, 50)),
+    (clean_numeric_values, 'number', (True, None, 50, None, None, True)),
+    (remove_punctuation, 'text', ()),
+    (remove_numerical_characters, 'text', ()),
+    (remove_alphabetical_characters, 'text', ()),
+    (remove_non_alphanumeric, 'text', ()),
+    (remove_emojis, 'text', ()),
+    (remove_html_tags, 'text', ()),
+    (remove_urls, 'text', ()),
+    (check_spelling, 'text', ()),
+    (replace_long_vowel, 'hindi', ('ा',)),
+    (normalize_indic, 'hindi', ()),
+    (remove_rare_words, 'text', ()),
+]
+
+#the end-to-end requests, all cleaning text and downloading CSV, with the
+#columns each one names
+UPLOAD_PARAMS = {
+    'upload': {
+        'to_remove_spaces': True, 'to_lowercase': True, 'to_remove_punctuation': True,
+        'to_remove_html_tags': True, 'to_remove_urls': True, 'output_format': 'csv',
+    },
+}
+UPLOAD_PARAMS['upload_chunked'] = dict(UPLOAD_PARAMS['upload'], chunk_size=100_000)
+UPLOAD_PARAMS['upload_columns'] = UPLOAD_PARAMS['upload']
+UPLOAD_COLUMNS = {'upload': ['text'], 'upload_chunked': ['text'], 'upload_columns': ['text', 'sparse', 'hindi']}
+
+
+#parsing the file on its own with each ingestion option, as (ReadOptions
+#arguments, compression of the file). the dtypes are the ones the columns
+#are inferred as, so only the inference is saved
+INGEST_OPTIONS = {
+    'read_c': ({'engine': 'c'}, None),
+    'read_c_dtypes': ({'engine': 'c', 'dtype': {'id': 'int64', 'text': 'object', 'number': 'float64'}}, None),
+    'read_c_usecols': ({'engine': 'c', 'usecols': ['text']}, None),
+    'read_pyarrow': ({'engine': 'pyarrow'}, None),
+    'read_pyarrow_strings': ({'engine': 'pyarrow', 'string_engine': 'pyarrow'}, None),
+    'read_pyarrow_usecols': ({'engine': 'pyarrow', 'usecols': ['text']}, None),
+    'read_c_gzip': ({'engine': 'c'}, 'gz'),
+    'read_pyarrow_gzip': ({'engine': 'pyarrow'}, 'gz'),
+    'read_c_zstd': ({'engine': 'c'}, 'zst'),
+    'read_pyarrow_zstd': ({'engine': 'pyarrow'}, 'zst'),
+}
+
+
+#setup() builds fresh input outside the timing, then call(input) is timed.
+#the peak is what call allocates on top of its input, measured in a second
+#run under tracemalloc so the tracing does not slow down the timed one
+def measure(setup, call, memory: bool = True):
+    data = setup()
+    start = time.perf_counter()
+    call(data)
+    seconds = time.perf_counter() - start
+    peak = None
+    if memory:
+        data = setup()
+        tracemalloc.start()
+        try:
+            call(data)
+            peak = tracemalloc.get_traced_memory()[1]
+        finally:
+            tracemalloc.stop()
+    return seconds, peak
+
+
+def _result(name: str, rows: int, seconds: float, peak, size_bytes: int = None):
+    result = {
+        'name': name,
+        'rows': rows,
+        'seconds': round(seconds, 4),
+        'rows_per_second': round(rows / seconds),
+        'peak_mb': None if peak is None else round(peak / 2**20, 1),
+    }
+    if size_bytes is not None:
+        result['mb_per_second'] = round(size_bytes / 2**20 / seconds, 1)
+    return result
+
+
+def _run_function(func, column_name, args, df):
+    #keep pandas' warnings about the original inplace calls out of the report
+    with warnings.catch_warnings():
+        warnings.simplefilter("ignore")
+        return func(df) if column_name is None else func(df, column_name, *args)
+
+
+#a small run first builds the lazily made tables and starts the spelling
+#workers. every timed run starts from a cold spelling cache, so
+#check_spelling is timed on the full work rather than on what an earlier
+#size left behind
+def bench_functions(df: pd.DataFrame, memory: bool = True, only: list = None):
+    results = []
+    for func, column_name, args in SUITE_FUNCTIONS:
+        if only and func.__name__ not in only:
+            continue
+        _run_function(func, column_name, args, df.head(100).copy())
+
+        def setup():
+            SPELL_ENGINE.clear_cache()
+            return df.copy()
+
+        seconds, peak = measure(setup, partial(_run_function, func, column_name, args), memory)
+        results.append(_result(func.__name__, len(df), seconds, peak))
+        print_result(results[-1])
+    return results
+
+
+def bench_upload(path: str, rows: int, memory: bool = True, only: list = None):
+    client = TestClient(app)
+    with open(path, 'rb') as file:
+        content = file.read()
+    results = []
+    for name, params in UPLOAD_PARAMS.items():
+        if only and name not in only:
+            continue
+
+        def call(_):
+            response = client.post(
+                "/upload/", params=params, files={"file": ("data.csv", content)},
+                data={"column_name": UPLOAD_COLUMNS[name]},
+            )
+            assert response.status_code == 200, response.text
+
+        seconds, peak = measure(SPELL_ENGINE.clear_cache, call, memory)
+        results.append(_result(name, rows, seconds, peak, len(content)))
+        print_result(results[-1])
+    return results
+
+
+#the MB/s are of the file as uploaded, compressed or not. Arrow allocates
+#outside tracemalloc, so the pyarrow peaks only cover the Python objects made
+def bench_ingestion(size: str, rows: int, memory: bool = True, only: list = None):
+    results = []
+    for name, (options, compression) in INGEST_OPTIONS.items():
+        if (only and name not in only) or (pa is None and ('pyarrow' in name or compression == 'zst')):
+            continue
+        with open(dataset_path(size, compression), 'rb') as file:
+            content = file.read()
+        options = ReadOptions(**options)
+        seconds, peak = measure(lambda: io.BytesIO(content), partial(read_csv_frame, options=options), memory)
+        results.append(_result(name, rows, seconds, peak, len(content)))
+        print_result(results[-1])
+    return results
+
+
+def print_result(result: dict, previous: dict = None):
+    line = (f"{result['name']:<32} {result['rows']:>10} rows {result['seconds']:9.3f}s "
+            f"{result['rows_per_second']:>12,} rows/s")
+    if 'mb_per_second' in result:
+        line += f" {result['mb_per_second']:>7.1f} MB/s"
+    if result['peak_mb'] is not None:
+        line += f"  peak {result['peak_mb']:>8.1f} MB"
+    if previous is not None:
+        line += f"  time x{result['seconds'] / previous['seconds']:.2f}"
+        if result['peak_mb'] is not None and previous['peak_mb']:
+            line += f" memory x{result['peak_mb'] / previous['peak_mb']:.2f}"
+    print(line)
+
+
+def run_suite(sizes: list[str], memory: bool = True, only: list = None):
+    results = []
+    for size in sizes:
+        path = dataset_path(size)
+        df = pd.read_csv(path)
+        print(f"-- {size}: {len(df)} rows, {os.path.getsize(path) / 2**20:.0f} MB of CSV")
+        results += bench_ingestion(size, len(df), memory, only)
+        results += bench_functions(df, memory, only)
+        results += bench_upload(path, len(df), memory, only)
+    return results
+
+
+def _commit():
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True, check=True
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return "local"
+
+
+def save_results(results: list, label: str):
+    os.makedirs(RESULTS_DIR, exist_ok=True)
+    path = os.path.join(RESULTS_DIR, f"{label}.json")
+    with open(path, 'w') as file:
+        json.dump({
+            'label': label,
+            'created': time.strftime('%Y-%m-%dT%H:%M:%S'),
+            'python': platform.python_version(),
+            'pandas': pd.__version__,
+            'results': results,
+        }, file, indent=2)
+    return path
+
+
+#ratios against a saved run; above 1 is slower or bigger than before
+def compare_results(results: list, label: str):
+    with open(os.path.join(RESULTS_DIR, f"{label}.json")) as file:
+        previous = {(r['name'], r['rows']): r for r in json.load(file)['results']}
+    print(f"-- against {label}")
+    for result in results:
+        key = (result['name'], result['rows'])
+        if key in previous:
+            print_result(result, previous[key])
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--sizes", nargs="+", choices=list(SIZES), default=["10k", "100k"])
+    parser.add_argument("--only", nargs="+", help="function or upload names to run")
+    parser.add_argument("--no-memory", action="store_true", help="skip the tracemalloc runs")
+    parser.add_argument("--label", default=None, help="name of the saved results, defaults to the commit")
+    parser.add_argument("--compare", default=None, help="label of earlier results to compare against")
+    parser.add_argument("--before-after", action="store_true", help="compare against the old implementations instead")
+    parser.add_argument("--rows", type=int, default=1_000_000)
+    parser.add_argument("--spelling-rows", type=int, default=100_000)
+    parser.add_argument("--tagging-rows", type=int, default=100_000)
+    args = parser.parse_args()
+    if args.before_after:
+        bench_fused_pipeline(args.rows)
+        bench_regex_operations(args.rows)
+        bench_character_filters(args.rows)
+        bench_replace_chars(args.rows)
+        bench_check_spelling(args.spelling_rows)
+        bench_pos_tagging(args.tagging_rows)
+        bench_duplicate_rows(args.rows)
+        bench_multi_column(args.rows)
+        bench_string_engines(args.rows)
+        bench_indic_normalization(args.rows)
+        bench_numeric_values(args.rows)
+    else:
+        results = run_suite(args.sizes, not args.no_memory, args.only)
+        print(f"saved to {save_results(results, args.label or _commit())}")
+        if args.compare:
+            compare_results(results, args.compare)
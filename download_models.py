@@ -0,0 +1,16 @@
+import argparse
+import nltk
+from main import POS_MODEL_DIR, check_tagger_model
+
+
+#fetches the tagger model into POS_MODEL_DIR, or the folder given, once before
+#the server starts, since the server itself never downloads anything
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--model-dir", default=POS_MODEL_DIR, help="folder to put the model in")
+    args = parser.parse_args()
+
+    if not nltk.download("averaged_perceptron_tagger_eng", download_dir=args.model_dir, raise_on_error=True):
+        raise SystemExit("the tagger model could not be downloaded")
+    check_tagger_model(args.model_dir)
+    print(f"tagger model saved in {args.model_dir}")
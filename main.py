@@ -1,13 +1,52 @@
-from fastapi import FastAPI, File, UploadFile, Query, Form
-from fastapi.responses import HTMLResponse
-from typing import List, Optional, Union, Annotated
-from pydantic import BaseModel, Field
+from fastapi import FastAPI, File, UploadFile, Query, Form, HTTPException
+from fastapi.responses import FileResponse, HTMLResponse, JSONResponse, PlainTextResponse, Response, StreamingResponse
+from typing import List, Optional, Union, Annotated, Literal
+from pydantic import BaseModel, Field, ValidationError, field_validator, model_validator
 from spellchecker import SpellChecker
+from dataclasses import asdict, dataclass, field, replace
+from functools import partial, lru_cache
+from collections import Counter, OrderedDict
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
 import pandas as pd
+import numpy as np
+import asyncio
+import bisect
+import contextlib
+import cProfile
+import hashlib
+import inspect
+import itertools
+import json
+import operator
+import tempfile
+import threading
+import time
+import tracemalloc
+import unicodedata
 import string
+import sys
 import csv
+import gzip
 import io
+import os
 import re
+import shutil
+import uuid
+import zlib
+
+try:
+    import pyarrow as pa
+    import pyarrow.compute as pc
+    import pyarrow.parquet as pq
+except ImportError:
+    pa = None
+
+try:
+    import nltk
+    from nltk.tag.perceptron import PerceptronTagger
+    from nltk.tokenize import TreebankWordTokenizer
+except ImportError:
+    nltk = None
 
 
 app = FastAPI()
@@ -40,13 +79,8 @@ class UploadRequest(BaseModel):
 
 
 #remove multiple spaces and unnecessary spaces
-def remove_spaces(df: pd.DataFrame = None, column_name: str = None):
-    #removing multiple spaces in a string
-    df[column_name] = df[column_name].str.replace(r'\s+', ' ', regex = True)
-    #removing single space before a full stop
-    df[column_name] = df[column_name].str.replace(r'(\s+)\.', '.', regex = True)
-    #removing mulltiple spaces at the end of the string
-    df[column_name] = df[column_name].str.replace(r'\s+$', '', regex = True)
+def remove_spaces(df: pd.DataFrame = None, column_name: str = None, regex_backend: str = None):
+    df[column_name] = run_text_steps(df[column_name], _whitespace_steps(regex_backend))
     return df
 
 
@@ -63,13 +97,8 @@ def replace_chars(
         chars_to_be_replaced: Annotated[list[str] | None, Query()] = None,
         char_to_replace: str = None
 ):
-    print("df:", df)
-    print("column_name:", column_name)
-    print("chars_to_be_replaced:", chars_to_be_replaced)
-    print("char_to_replace:", char_to_replace)
-
-    for char in chars_to_be_replaced:
-        df[column_name] = df[column_name].str.replace(char, char_to_replace)
+    steps = _merge_text_steps(_replacement_steps(chars_to_be_replaced, char_to_replace))
+    df[column_name] = run_text_steps(df[column_name], steps)
     return df
 
 
@@ -79,33 +108,47 @@ def remove_chars(
         column_name: str = None,
         chars_to_be_removed: Annotated[list[str] | None, Query()] = None
 ):
-    for char in chars_to_be_removed:
-        df[column_name] = df[column_name].str.replace(char, '')
+    steps = _merge_text_steps(_replacement_steps(chars_to_be_removed, ''))
+    df[column_name] = run_text_steps(df[column_name], steps)
     return df
 
 
 #change the text to lowercase
 def to_lower(df: pd.DataFrame = None, column_name: str = None):
-    df[column_name] = df[column_name].str.lower()
+    df[column_name] = run_text_steps(df[column_name], [('method', 'lower')])
     return df
 
 
 #change the text to uppercase
 def to_upper(df: pd.DataFrame = None, column_name: str = None):
-    df[column_name] = df[column_name].str.upper()
+    df[column_name] = run_text_steps(df[column_name], [('method', 'upper')])
     return df
 
 
 #change the text to title format
 def to_title(df: pd.DataFrame = None, column_name: str = None):
-    df[column_name] = df[column_name].str.title()
+    df[column_name] = run_text_steps(df[column_name], [('method', 'title')])
     return df
 
 
-#remove duplicate rows
-def remove_duplicate_rows(df: pd.DataFrame = None):
-    df.drop_duplicates(inplace=True)
-    return df
+#remove duplicate rows, comparing the subset columns only when given. rows
+#are compared by their 64-bit hashes; exact compares the rows that share a
+#hash so a hash collision can never drop a row
+def remove_duplicate_rows(df: pd.DataFrame = None, subset: list[str] = None, exact: bool = False):
+    hashes = pd.Series(row_hashes(df, subset))
+    duplicated = hashes.duplicated().to_numpy()
+    if exact and duplicated.any():
+        shared = hashes.duplicated(keep=False).to_numpy()
+        duplicated[shared] = _key_frame(df.take(np.flatnonzero(shared)), subset).duplicated().to_numpy()
+    return df.take(np.flatnonzero(~duplicated))
+
+
+#remove rows whose column_name text is a near duplicate of an earlier row's,
+#or with flag keep them and mark them in a column_name_near_duplicate column
+def remove_near_duplicate_rows(df: pd.DataFrame = None, column_name: str = None, threshold: float = 0.8,
+                               flag: bool = False, shingle_size: int = 5, signature_size: int = 128):
+    with NearDuplicateIndex(threshold, shingle_size, signature_size) as index:
+        return _near_duplicates(df, column_name, index, flag, last=True)
 
 
 #remove duplicate coloumns
@@ -128,99 +171,3306 @@ def remove_empty_columns(df: pd.DataFrame = None):
 
 #remove negative values
 def remove_negative_values(df: pd.DataFrame = None, column_name: str = None):
-    df[column_name] = df[column_name].apply(lambda x: x if x >= 0 else None)
-    return df
+    return apply_numeric_rules(df, column_name, [('remove', 0, None)])
+
+
+#sort whole rows by one or more columns. stable keeps rows with equal keys in
+#their original order, na_position puts missing values 'first' or 'last'
+def sort_rows(df: pd.DataFrame = None, by: str | list[str] = None, ascending: bool | list[bool] = True,
+              na_position: str = 'last', stable: bool = True):
+    by = [by] if isinstance(by, str) else list(by)
+    ascending = _sort_directions(ascending, by)
+    return df.sort_values(by, ascending=ascending, na_position=na_position,
+                          kind='stable' if stable else 'quicksort', ignore_index=True)
+
+
+def _sort_directions(ascending: bool | list[bool], by: list[str]):
+    if isinstance(ascending, bool):
+        return [ascending] * len(by)
+    if len(ascending) != len(by):
+        raise ValueError(f"ascending has {len(ascending)} values for {len(by)} sort columns")
+    return list(ascending)
 
 
 #sort in ascending order of coloumn name
-def arrange_column_ascending(df: pd.DataFrame = None, column_name: str = None):
-    df[column_name] = df[column_name].sort_values(ascending = True)
-    return df
+def arrange_column_ascending(df: pd.DataFrame = None, column_name: str | list[str] = None,
+                             na_position: str = 'last', stable: bool = True):
+    return sort_rows(df, column_name, True, na_position, stable)
 
 
 #sort in decending order of coloumn name
-def arrange_column_descending(df: pd.DataFrame = None, column_name: str = None):
-    df[column_name] = df[column_name].sort_values(ascending = False)
-    return df
+def arrange_column_descending(df: pd.DataFrame = None, column_name: str | list[str] = None,
+                              na_position: str = 'last', stable: bool = True):
+    return sort_rows(df, column_name, False, na_position, stable)
 
 
 #remove out of range values
 def remove_out_of_range_values(df: pd.DataFrame = None, column_name: str = None, min_value: float = None, max_value: float = None):
-    df.loc[(df[column_name] < min_value) | (df[column_name] > max_value), column_name] = None
+    return apply_numeric_rules(df, column_name, _numeric_rules(min_value=min_value, max_value=max_value))
+
+
+#numeric rules are plain tuples like the text steps, either bound can be None:
+#  ('remove', low, high) values outside [low, high] become missing
+#  ('clip', low, high) values outside [low, high] are set to the bound
+#  ('downcast',) floats become float32 and integers the smallest integer type
+def _numeric_rules(remove_negative: bool = False, min_value: float = None, max_value: float = None,
+                   clip_min: float = None, clip_max: float = None, downcast: bool = False):
+    rules = []
+    if remove_negative:
+        rules.append(('remove', 0, None))
+    if min_value is not None or max_value is not None:
+        rules.append(('remove', min_value, max_value))
+    if clip_min is not None or clip_max is not None:
+        rules.append(('clip', clip_min, clip_max))
+    if downcast:
+        rules.append(('downcast',))
+    return rules
+
+
+def _check_numeric_rule(rule: tuple):
+    if rule[0] == 'downcast':
+        return
+    low, high = rule[1:]
+    for bound in (low, high):
+        if bound is not None and (isinstance(bound, bool) or not isinstance(bound, (int, float))):
+            raise TypeError(f"bounds of numeric values must be numbers, not {bound!r}")
+    if low is not None and high is not None and low > high:
+        raise ValueError(f"the lower bound {low} is above the upper bound {high}")
+
+
+def _outside(values: pd.Series, low: float, high: float):
+    if low is None:
+        return values > high
+    if high is None:
+        return values < low
+    return (values < low) | (values > high)
+
+
+#the range every value is in once the rules have run, None on an open side
+def _rule_bounds(rules: list[tuple]):
+    lows = [rule[1] for rule in rules if rule[0] != 'downcast' and rule[1] is not None]
+    highs = [rule[2] for rule in rules if rule[0] != 'downcast' and rule[2] is not None]
+    return max(lows, default=None), min(highs, default=None)
+
+
+#the smallest integer type that holds the range, None if the range is open
+def _integer_type(low: float, high: float):
+    if low is None or high is None:
+        return None
+    for dtype in (np.int8, np.int16, np.int32, np.int64):
+        if np.iinfo(dtype).min <= low and high <= np.iinfo(dtype).max:
+            return dtype
+    return None
+
+
+def _downcast(values: pd.Series, integer_type=None, streamed: bool = False):
+    if pd.api.types.is_float_dtype(values.dtype):
+        return values.astype('Float32' if isinstance(values.dtype, pd.api.extensions.ExtensionDtype) else np.float32)
+    if not pd.api.types.is_integer_dtype(values.dtype):
+        return values
+    if not streamed:
+        return pd.to_numeric(values, downcast='integer')
+    if integer_type is None:
+        return values
+    if isinstance(values.dtype, pd.api.extensions.ExtensionDtype):
+        return values.astype(pd.api.types.pandas_dtype(integer_type.__name__.capitalize()))
+    return values.astype(integer_type)
+
+
+#runs all the numeric rules on a column in one go: the values to remove are
+#collected into a single mask and set missing with one Series.mask, NaN in
+#numpy columns and <NA> in nullable ones. integer columns that lose values
+#while being downcast turn nullable rather than float, so they stay integers.
+#a streamed chunk cannot see the values of later chunks, so there integers
+#are only downcast to the type the rules' own bounds need
+def apply_numeric_rules(df: pd.DataFrame, column_name: str, rules: list[tuple], streamed: bool = False):
+    values = df[column_name]
+    removed = None
+    for rule in rules:
+        if rule[0] == 'remove':
+            outside = _outside(values, rule[1], rule[2])
+            removed = outside if removed is None else removed | outside
+        elif rule[0] == 'clip':
+            values = values.clip(rule[1], rule[2])
+    downcast = ('downcast',) in rules
+    if removed is not None:
+        if downcast and pd.api.types.is_integer_dtype(values.dtype) and removed.any():
+            values = values.astype(pd.Int64Dtype())
+        values = values.mask(removed)
+    if downcast:
+        values = _downcast(values, _integer_type(*_rule_bounds(rules)), streamed)
+    df[column_name] = values
     return df
 
 
+def stream_numeric_rules(chunks, column_name: str, rules: list[tuple]):
+    for chunk in chunks:
+        yield apply_numeric_rules(chunk, column_name, rules, streamed=True)
+
+
+#removes negative and out of range values, clips the rest and downcasts the
+#column, all in a single pass
+def clean_numeric_values(df: pd.DataFrame, column_name: str, remove_negative: bool = False,
+                         min_value: float = None, max_value: float = None,
+                         clip_min: float = None, clip_max: float = None, downcast: bool = False):
+    rules = _numeric_rules(remove_negative, min_value, max_value, clip_min, clip_max, downcast)
+    return apply_numeric_rules(df, column_name, rules)
+
+
+#emoji code points (Unicode 15.1): the pictograph blocks, including regional
+#indicators for flags and the skin tone modifiers, every other character shown
+#as emoji by default, the emoji among the symbols and dingbats, and the tags of
+#subdivision flags. the other symbols, like ✓, ★ and □, are text and stay
+EMOJI_RANGES = [
+    (0x231A, 0x231B), (0x2328, 0x2328), (0x23CF, 0x23CF), (0x23E9, 0x23F3), (0x23F8, 0x23FA),
+    (0x25FD, 0x25FE), (0x2600, 0x2604), (0x260E, 0x260E), (0x2611, 0x2611), (0x2614, 0x2615),
+    (0x2618, 0x2618), (0x261D, 0x261D), (0x2620, 0x2620), (0x2622, 0x2623), (0x2626, 0x2626),
+    (0x262A, 0x262A), (0x262E, 0x262F), (0x2638, 0x263A), (0x2640, 0x2640), (0x2642, 0x2642),
+    (0x2648, 0x2653), (0x265F, 0x2660), (0x2663, 0x2663), (0x2665, 0x2666), (0x2668, 0x2668),
+    (0x267B, 0x267B), (0x267E, 0x267F), (0x2692, 0x2697), (0x2699, 0x2699), (0x269B, 0x269C),
+    (0x26A0, 0x26A1), (0x26A7, 0x26A7), (0x26AA, 0x26AB), (0x26B0, 0x26B1), (0x26BD, 0x26BE),
+    (0x26C4, 0x26C5), (0x26C8, 0x26C8), (0x26CE, 0x26CF), (0x26D1, 0x26D1), (0x26D3, 0x26D4),
+    (0x26E9, 0x26EA), (0x26F0, 0x26F5), (0x26F7, 0x26FA), (0x26FD, 0x26FD), (0x2702, 0x2702),
+    (0x2705, 0x2705), (0x2708, 0x270D), (0x270F, 0x270F), (0x2712, 0x2712), (0x2714, 0x2714),
+    (0x2716, 0x2716), (0x271D, 0x271D), (0x2721, 0x2721), (0x2728, 0x2728), (0x2733, 0x2734),
+    (0x2744, 0x2744), (0x2747, 0x2747), (0x274C, 0x274C), (0x274E, 0x274E), (0x2753, 0x2755),
+    (0x2757, 0x2757), (0x2763, 0x2764), (0x2795, 0x2797), (0x27A1, 0x27A1), (0x27B0, 0x27B0),
+    (0x27BF, 0x27BF), (0x2934, 0x2935), (0x2B05, 0x2B07), (0x2B1B, 0x2B1C), (0x2B50, 0x2B50),
+    (0x2B55, 0x2B55), (0x3030, 0x3030), (0x303D, 0x303D), (0x3297, 0x3297), (0x3299, 0x3299),
+    (0x1F000, 0x1FAFF), (0xE0001, 0xE0001), (0xE0020, 0xE007F),
+]
+_EMOJI_STARTS = [start for start, _ in EMOJI_RANGES]
+
+
+def _is_emoji(c: str):
+    position = bisect.bisect_right(_EMOJI_STARTS, ord(c)) - 1
+    return position >= 0 and ord(c) <= EMOJI_RANGES[position][1]
+
+
+#the characters each character-class filter deletes
+CHARACTER_CLASSES = {
+    'punctuation': lambda c: c in string.punctuation,
+    'digit': str.isdigit,
+    'alpha': str.isalpha,
+    'non_alphanumeric': lambda c: not c.isalnum(),
+    'emoji': _is_emoji,
+}
+
+#emoji sequences: a character followed by the emoji variation selector or the
+#keycap mark is shown as emoji, like #️⃣ or ❤️. the zero width joiner of
+#sequences like 👨‍👩‍👧 and the text variation selector go with a deleted
+#neighbour, and are left alone elsewhere, as Indic scripts use the joiner
+_EMOJI_MARKS = (0xFE0F, 0x20E3)
+_EMOJI_JOINERS = (0x200D, 0xFE0E)
+
+#code points converted at once by delete_characters, bounds its scratch memory
+DELETE_BLOCK_CHARS = 1 << 22
+
+
+#one flag per code point, built once from the str predicate so the Unicode
+#semantics of isdigit/isalpha/isalnum are kept exactly
+@lru_cache(maxsize=None)
+def _class_mask(name: str):
+    predicate = CHARACTER_CLASSES[name]
+    size = sys.maxunicode + 1
+    return np.fromiter((predicate(chr(c)) for c in range(size)), dtype=bool, count=size)
+
+
+@lru_cache(maxsize=64)
+def _deletion_mask(classes: tuple, chars: str):
+    mask = np.zeros(sys.maxunicode + 1, dtype=bool)
+    for name in classes:
+        mask |= _class_mask(name)
+    mask[[ord(c) for c in chars]] = True
+    return mask
+
+
+#the same set as an RE2 character class for pyarrow's regex kernels, which
+#cannot represent surrogates
+@lru_cache(maxsize=64)
+def _deletion_pattern(classes: tuple, chars: str):
+    mask = _deletion_mask(classes, chars).copy()
+    mask[0xD800:0xE000] = False
+    negate = mask.sum() > mask.size // 2
+    if negate:
+        mask = ~mask
+        mask[0xD800:0xE000] = False
+    edges = np.flatnonzero(np.diff(np.concatenate(([False], mask, [False])).astype(np.int8)))
+    ranges = ''.join(
+        f"\\x{{{start:X}}}" if start == end - 1 else f"\\x{{{start:X}}}-\\x{{{end - 1:X}}}"
+        for start, end in zip(edges[::2], edges[1::2])
+    )
+    return f"[{'^' if negate else ''}{ranges}]+"
+
+
+def _is_arrow_string(series: pd.Series):
+    return isinstance(series.dtype, pd.ArrowDtype) or getattr(series.dtype, 'storage', None) == 'pyarrow'
+
+
+#RE2 gets slower the more ranges a class has; past this length (letters and
+#non-alphanumerics have hundreds of ranges) the mask is faster even with the
+#round trip out of Arrow
+RE2_MAX_CLASS_LENGTH = 4096
+
+
+#deletes every character of the given classes (plus chars) from the column.
+#arrow-backed columns use pyarrow's regex kernel for small classes; the rest
+#are done in blocks as arrays of code points filtered through the class
+#mask, so no Python code runs per character. nulls pass through and other
+#non-string values become NaN, as with the .str accessor
+def delete_characters(series: pd.Series, classes: tuple, chars: str = ''):
+    series.str  # raises for non-text columns, like the .str methods
+    if _is_arrow_string(series):
+        pattern = _deletion_pattern(classes, chars)
+        if len(pattern) <= RE2_MAX_CLASS_LENGTH and 'emoji' not in classes:
+            return series.str.replace(pattern, '', regex=True)
+        return delete_characters(series.astype(object), classes, chars).astype(series.dtype)
+
+    return _recode(series, _deletion_mask(classes, chars), sequences='emoji' in classes)
+
+
+#widens the deleted code points of a block to whole emoji sequences. starts
+#flags the first code point of every value, which has no neighbour before it
+def _emoji_sequences(codes: np.ndarray, hits: np.ndarray, starts: np.ndarray):
+    marks = np.isin(codes, _EMOJI_MARKS)
+    hits |= marks
+    hits[:-1] |= marks[1:] & ~starts[1:]
+    joiners = np.isin(codes, _EMOJI_JOINERS)
+    neighbours = np.zeros_like(hits)
+    neighbours[1:] |= hits[:-1] & ~starts[1:]
+    neighbours[:-1] |= hits[1:] & ~starts[1:]
+    hits |= joiners & neighbours
+    return hits
+
+
+#the column's code points in blocks, dropping those where mask is set and
+#mapping the rest through lookup when it is given. sequences also drops the
+#rest of every emoji sequence
+def _recode(series: pd.Series, mask: np.ndarray, lookup: np.ndarray = None, sequences: bool = False):
+    values, is_text = _text_values(series)
+    texts = values[is_text]
+    offsets = np.concatenate(([0], np.cumsum(np.fromiter(map(len, texts), dtype=np.int64, count=len(texts)))))
+    bounds = np.unique(np.concatenate((
+        [0], np.searchsorted(offsets, np.arange(DELETE_BLOCK_CHARS, offsets[-1], DELETE_BLOCK_CHARS)), [len(texts)]
+    )))
+    cleaned = []
+    for start, end in zip(bounds[:-1].tolist(), bounds[1:].tolist()):
+        codes = np.frombuffer(''.join(texts[start:end]).encode('utf-32-le', 'surrogatepass'), dtype=np.uint32)
+        hits = mask[codes]
+        block_offsets = offsets[start:end + 1] - offsets[start]
+        if sequences:
+            starts = np.zeros(len(codes), dtype=bool)
+            starts[block_offsets[:-1][block_offsets[:-1] < len(codes)]] = True
+            hits = _emoji_sequences(codes, hits, starts)
+        deleted = np.flatnonzero(hits)
+        if len(deleted) == 0 and lookup is None:
+            cleaned.extend(texts[start:end])
+            continue
+        kept = (block_offsets - np.searchsorted(deleted, block_offsets)).tolist()
+        codes = codes[~hits] if len(deleted) else codes
+        joined = (codes if lookup is None else lookup[codes]).tobytes().decode('utf-32-le', 'surrogatepass')
+        cleaned.extend([joined[a:b] for a, b in zip(kept, kept[1:])])
+    return _with_texts(series, values, is_text, cleaned)
+
+
+#a translate table whose values are single characters or empty, as the code
+#points to drop and a lookup from every code point to its replacement
+@lru_cache(maxsize=64)
+def _character_map(items: tuple):
+    mask = np.zeros(sys.maxunicode + 1, dtype=bool)
+    lookup = np.arange(sys.maxunicode + 1, dtype=np.uint32)
+    for code, replacement in items:
+        if replacement:
+            lookup[code] = ord(replacement)
+        else:
+            mask[code] = True
+    return mask, lookup
+
+
+#translates every value of the column by a character map, all values at once
+#as arrays of code points. nulls pass through and other non-string values
+#become NaN, as with the .str accessor
+def map_characters(series: pd.Series, items: tuple):
+    series.str  # raises for non-text columns, like the .str methods
+    if _is_arrow_string(series):
+        return map_characters(series.astype(object), items).astype(series.dtype)
+    return _recode(series, *_character_map(items))
+
+
+#a chunk whose values are all missing is read as floats, which the .str
+#methods refuse. it has no text to change, so text operations pass it through
+def _no_text(series: pd.Series):
+    return series.dtype.kind == 'f' and not series.notna().any()
+
+
+def _text_values(series: pd.Series):
+    values = series.to_numpy(dtype=object)
+    is_text = np.fromiter(map(isinstance, values, itertools.repeat(str)), dtype=bool, count=len(values))
+    return values, is_text
+
+
+#puts the processed strings back, keeping nulls and turning anything else
+#that was not a string into NaN
+def _with_texts(series: pd.Series, values: np.ndarray, is_text: np.ndarray, texts):
+    result = np.where(pd.isna(values), values, np.nan)
+    result[is_text] = texts
+    return pd.Series(result, index=series.index, name=series.name, dtype=object)
+
+
+#every pattern the regex cleaning operations use, compiled once at import
+PATTERNS = {
+    'html_tag': re.compile(r'<.*?>'),
+    'url': re.compile(r'http\S+|www\S+'),
+    'whitespace': re.compile(r'\s+'),
+    'space_before_stop': re.compile(r'\s+\.'),
+    'trailing_whitespace': re.compile(r'\s+$'),
+}
+
+#'re' runs the compiled patterns, 'pyarrow' runs them through Arrow's RE2
+#kernel over the whole column
+REGEX_BACKENDS = ('re', 'pyarrow')
+REGEX_BACKEND = os.environ.get("REGEX_BACKEND", "re")
+
+
+def _regex_backend(backend: str = None):
+    backend = backend or REGEX_BACKEND
+    if backend not in REGEX_BACKENDS:
+        raise ValueError(f"unknown regex backend {backend!r}")
+    if backend == 'pyarrow' and pa is None:
+        raise ImportError("the pyarrow regex backend needs pyarrow installed")
+    return backend
+
+
+#RE2's \s and \S only cover ASCII, so the RE2 spelling of a pattern lists
+#every character Python's \s matches
+@lru_cache(maxsize=None)
+def _re2_source(name: str):
+    space = ''.join(f"\\x{{{c:X}}}" for c in range(sys.maxunicode + 1) if chr(c).isspace())
+    return PATTERNS[name].pattern.replace(r'\S', f"[^{space}]").replace(r'\s', f"[{space}]")
+
+
+#replaces every match of a registered pattern in the column. nulls pass
+#through and other non-string values become NaN, as with the .str accessor
+def replace_pattern(series: pd.Series, name: str, repl: str, backend: str = None):
+    if _regex_backend(backend) == 're':
+        return series.str.replace(PATTERNS[name], repl, regex=True)
+    series.str  # raises for non-text columns, like the .str methods
+    if _is_arrow_string(series):
+        return series.str.replace(_re2_source(name), repl, regex=True)
+    values, is_text = _text_values(series)
+    replaced = pc.replace_substring_regex(pa.array(values[is_text], type=pa.string()), _re2_source(name), repl)
+    return _with_texts(series, values, is_text, replaced.to_numpy(zero_copy_only=False))
+
+
+#with re this is _collapse_whitespace, a single pass without any regex. the
+#Arrow kernels run the three substitutions remove_spaces always made
+def _whitespace_steps(backend: str = None):
+    backend = _regex_backend(backend)
+    if backend == 're':
+        return [('call', _collapse_whitespace)]
+    return [
+        ('pattern', 'whitespace', ' ', backend),
+        ('pattern', 'space_before_stop', '.', backend),
+        ('pattern', 'trailing_whitespace', '', backend),
+    ]
+
+
+def _pattern_steps(name: str, repl: str, backend: str = None):
+    return [('pattern', name, repl, _regex_backend(backend))]
+
+
 #remove punctuations
 def remove_punctuation(df: pd.DataFrame = None, column_name: str = None):
-    df[column_name] = df[column_name].apply(lambda x: ''.join([c for c in x if c not in string.punctuation]))
+    df[column_name] = delete_characters(df[column_name], ('punctuation',))
     return df
 
 
 #remove numerical charecters
 def remove_numerical_characters(df: pd.DataFrame = None, column_name: str = None):
-    df[column_name] = df[column_name].apply(lambda x: ''.join([c for c in x if not c.isdigit()]))
+    df[column_name] = delete_characters(df[column_name], ('digit',))
     return df
 
 
 #remove alphabetical charecters
 def remove_alphabetical_characters(df: pd.DataFrame = None, column_name: str = None):
-    df[column_name] = df[column_name].apply(lambda x: ''.join([c for c in x if not c.isalpha()]))
+    df[column_name] = delete_characters(df[column_name], ('alpha',))
     return df
 
 
 #removing non-alphanumeric characters
 def remove_non_alphanumeric(df: pd.DataFrame, column_name: str):
-    df[column_name] = df[column_name].apply(lambda x: ''.join(c for c in x if c.isalnum()))
+    df[column_name] = delete_characters(df[column_name], ('non_alphanumeric',))
+    return df
+
+
+#removing emojis, with their skin tones, joiners and variation selectors
+def remove_emojis(df: pd.DataFrame = None, column_name: str = None):
+    df[column_name] = delete_characters(df[column_name], ('emoji',))
     return df
 
 
 #remove HTML tags
-def remove_html_tags(df: pd.DataFrame, column_name: str):
-    df[column_name] = df[column_name].apply(lambda x: re.sub(r'<.*?>', '', x))
+def remove_html_tags(df: pd.DataFrame, column_name: str, regex_backend: str = None):
+    df[column_name] = replace_pattern(df[column_name], 'html_tag', '', regex_backend)
     return df
 
 
 #remove URL's
-def remove_urls(df: pd.DataFrame, column_name: str):
-    df[column_name] = df[column_name].apply(lambda x: re.sub(r'http\S+|www\S+', '', x))
+def remove_urls(df: pd.DataFrame, column_name: str, regex_backend: str = None):
+    df[column_name] = replace_pattern(df[column_name], 'url', '', regex_backend)
     return df
 
 
+_WORKER_CHECKER = None
+
+
+#runs once in every spelling worker process so the dictionary is loaded a
+#single time per worker instead of once per shard
+def _load_spell_worker():
+    global _WORKER_CHECKER
+    _WORKER_CHECKER = SpellChecker()
+
+
+def _correct_in_worker(words: list[str]):
+    return {word: _WORKER_CHECKER.correction(word) or word for word in words}
+
+
+#loads the spelling dictionary once per process and remembers the corrections
+#of recently seen unknown words, so each distinct word is corrected only once.
+#with workers set, unknown words are sharded across a process pool
+class SpellEngine:
+    def __init__(self, cache_size: int = 100_000, workers: int = 0, shard_size: int = 256):
+        self.cache_size = cache_size
+        self.workers = workers
+        self.shard_size = shard_size
+        self.correction_calls = 0
+        self._checker = None
+        self._pool = None
+        self._cache = OrderedDict()
+        self._lock = threading.Lock()
+
+    @property
+    def checker(self):
+        if self._checker is None:
+            with self._lock:
+                if self._checker is None:
+                    self._checker = SpellChecker()
+        return self._checker
+
+    @property
+    def pool(self):
+        if self._pool is None:
+            with self._lock:
+                if self._pool is None:
+                    self._pool = ProcessPoolExecutor(max_workers=self.workers, initializer=_load_spell_worker)
+        return self._pool
+
+    #maps every word to its correction; words in the dictionary are returned
+    #as they are without generating any edit-distance candidates
+    def correct_words(self, words):
+        corrections, unknown = self._lookup(words)
+        shards = self._shards(unknown)
+        if shards:
+            found = {}
+            for part in self.pool.map(_correct_in_worker, shards):
+                found.update(part)
+        else:
+            found = self._correct(unknown)
+        return self._remember(corrections, found)
+
+    def clear_cache(self):
+        with self._lock:
+            self._cache.clear()
+
+    def close(self):
+        if self._pool is not None:
+            self._pool.shutdown()
+            self._pool = None
+
+    def _lookup(self, words):
+        corrections = {}
+        missing = []
+        with self._lock:
+            for word in words:
+                if word in self._cache:
+                    self._cache.move_to_end(word)
+                    corrections[word] = self._cache[word]
+                else:
+                    missing.append(word)
+
+        known = self.checker.known(missing)
+        unknown = []
+        for word in missing:
+            if word.lower() in known:
+                corrections[word] = word
+            else:
+                unknown.append(word)
+        return corrections, unknown
+
+    #only worth paying for the pool when there are at least two shards of work
+    def _shards(self, words: list[str]):
+        if self.workers < 1 or len(words) < 2 * self.shard_size:
+            return []
+        self.correction_calls += len(words)
+        count = min(self.workers * 4, len(words) // self.shard_size)
+        return [words[i::count] for i in range(count)]
+
+    def _remember(self, corrections: dict, found: dict):
+        corrections.update(found)
+        with self._lock:
+            self._cache.update(found)
+            while len(self._cache) > self.cache_size:
+                self._cache.popitem(last=False)
+        return corrections
+
+    #words without any candidate are kept as they are
+    def _correct(self, words: list[str]):
+        self.correction_calls += len(words)
+        return {word: self.checker.correction(word) or word for word in words}
+
+
+SPELL_ENGINE = SpellEngine(workers=int(os.environ.get("SPELL_WORKERS", os.cpu_count() or 1)))
+
+
+def _join_corrections(words: pd.Series, corrections: dict):
+    return words.map(
+        lambda x: ' '.join([corrections[word] for word in x]) if isinstance(x, list) else x
+    )
+
+
 #checking pellings and correcting them
 def check_spelling(df: pd.DataFrame, column_name: str):
-    spell = SpellChecker()
-    df[column_name] = df[column_name].apply(lambda x: ' '.join(spell.correction(word) for word in x.split()))
+    if _no_text(df[column_name]):
+        return df
+    words = df[column_name].str.split()
+    corrections = SPELL_ENGINE.correct_words(pd.unique(words.explode().dropna()))
+    df[column_name] = _join_corrections(words, corrections)
+    return df
+
+
+
+#the tagger model is read from disk and never downloaded, so uploads work
+#offline; fetch it once with
+#  python download_models.py
+POS_MODEL_DIR = os.environ.get("POS_MODEL_DIR", os.path.join(os.path.dirname(os.path.abspath(__file__)), "models"))
+
+#noun phrases, prepositions and verb groups over the Penn Treebank tags
+CHUNK_GRAMMAR = r"""
+NP: {<DT|PRP\$|CD>*<JJ.*>*<NN.*|PRP>+}
+PP: {<IN|TO>}
+VP: {<MD>?<VB.*>+<RB.*>?}
+"""
+
+
+def _tagger_path(model_dir: str):
+    return os.path.join(model_dir, "taggers", "averaged_perceptron_tagger_eng")
+
+
+#the server can't tag until it is set up, which is not the request's fault
+class ModelUnavailable(RuntimeError):
+    pass
+
+
+def check_tagger_model(model_dir: str):
+    if nltk is None:
+        raise ModelUnavailable("tagging parts of speech needs nltk installed on the server")
+    if not os.path.isdir(_tagger_path(model_dir)):
+        raise ModelUnavailable("the tagger model is not installed on the server, fetch it with python download_models.py")
+
+
+#the tokenizer, tagger and chunker a process loads once and then reuses for
+#every batch it is given
+class SentenceTagger:
+    def __init__(self, model_dir: str):
+        check_tagger_model(model_dir)
+        self.tokenizer = TreebankWordTokenizer()
+        self.tagger = PerceptronTagger(load=False)
+        self.tagger.load_from_json(lang="eng", loc=_tagger_path(model_dir))
+        self.parser = nltk.RegexpParser(CHUNK_GRAMMAR)
+
+    #each text becomes "word/TAG ..." and, with chunks, "[NP word ...] word ..."
+    def tag(self, texts: list[str], chunks: bool = False):
+        tagged = {}
+        for text in texts:
+            tokens = self.tagger.tag(self.tokenizer.tokenize(text))
+            pos = ' '.join(f"{word}/{tag}" for word, tag in tokens)
+            tagged[text] = (pos, self._chunk(tokens) if chunks else None)
+        return tagged
+
+    def _chunk(self, tokens: list[tuple[str, str]]):
+        if not tokens:
+            return ''
+        parts = []
+        for node in self.parser.parse(tokens):
+            if isinstance(node, nltk.Tree):
+                parts.append(f"[{node.label()} {' '.join(word for word, _ in node.leaves())}]")
+            else:
+                parts.append(node[0])
+        return ' '.join(parts)
+
+
+_WORKER_TAGGER = None
+
+
+#runs once in every tagging worker process so the model is loaded a single
+#time per worker instead of once per batch
+def _load_tag_worker(model_dir: str):
+    global _WORKER_TAGGER
+    _WORKER_TAGGER = SentenceTagger(model_dir)
+
+
+def _tag_in_worker(texts: list[str], chunks: bool):
+    return _WORKER_TAGGER.tag(texts, chunks)
+
+
+#loads the tagging model once per process and remembers the tags of recently
+#seen texts, so each distinct text is tagged only once. with workers set,
+#untagged texts are sent to a process pool in batches
+class TagEngine:
+    def __init__(self, model_dir: str, cache_size: int = 100_000, workers: int = 0, batch_size: int = 512):
+        self.model_dir = model_dir
+        self.cache_size = cache_size
+        self.workers = workers
+        self.batch_size = batch_size
+        self.tagged_texts = 0
+        self._tagger = None
+        self._pool = None
+        self._cache = OrderedDict()
+        self._lock = threading.Lock()
+
+    @property
+    def tagger(self):
+        if self._tagger is None:
+            with self._lock:
+                if self._tagger is None:
+                    self._tagger = SentenceTagger(self.model_dir)
+        return self._tagger
+
+    @property
+    def pool(self):
+        if self._pool is None:
+            with self._lock:
+                if self._pool is None:
+                    self._pool = ProcessPoolExecutor(
+                        max_workers=self.workers, initializer=_load_tag_worker, initargs=(self.model_dir,))
+        return self._pool
+
+    #maps every text to its (tags, chunks) pair, chunks is None without chunking
+    def tag_texts(self, texts, chunks: bool = False):
+        tagged, missing = self._lookup(texts, chunks)
+        batches = self._batches(missing)
+        if batches:
+            found = {}
+            for part in self.pool.map(_tag_in_worker, batches, itertools.repeat(chunks)):
+                found.update(part)
+        else:
+            found = self.tagger.tag(missing, chunks)
+        self.tagged_texts += len(missing)
+        return self._remember(tagged, found, chunks)
+
+    def clear_cache(self):
+        with self._lock:
+            self._cache.clear()
+
+    def close(self):
+        if self._pool is not None:
+            self._pool.shutdown()
+            self._pool = None
+
+    #texts tagged with chunks also answer requests without them
+    def _lookup(self, texts, chunks: bool):
+        tagged = {}
+        missing = []
+        with self._lock:
+            for text in texts:
+                for key in ((True, text),) if chunks else ((False, text), (True, text)):
+                    if key in self._cache:
+                        self._cache.move_to_end(key)
+                        tagged[text] = self._cache[key]
+                        break
+                else:
+                    missing.append(text)
+        return tagged, missing
+
+    #only worth paying for the pool when there are at least two batches of work
+    def _batches(self, texts: list[str]):
+        if self.workers < 1 or len(texts) < 2 * self.batch_size:
+            return []
+        return [texts[i:i + self.batch_size] for i in range(0, len(texts), self.batch_size)]
+
+    def _remember(self, tagged: dict, found: dict, chunks: bool):
+        tagged.update(found)
+        with self._lock:
+            self._cache.update(((chunks, text), value) for text, value in found.items())
+            while len(self._cache) > self.cache_size:
+                self._cache.popitem(last=False)
+        return tagged
+
+
+TAG_ENGINE = TagEngine(POS_MODEL_DIR, workers=int(os.environ.get("TAG_WORKERS", os.cpu_count() or 1)))
+
+
+#tags every word of a text column into a new {column}_pos column and, with
+#chunks, groups the words into phrases in a {column}_chunks column. the text
+#itself is left as it is
+def tag_parts_of_speech(df: pd.DataFrame, column_name: str, chunks: bool = False):
+    texts = df[column_name]
+    unique = [text for text in pd.unique(texts.dropna()) if isinstance(text, str)]
+    tagged = TAG_ENGINE.tag_texts(unique, chunks)
+    df[f"{column_name}_pos"] = texts.map({text: pos for text, (pos, _) in tagged.items()})
+    if chunks:
+        df[f"{column_name}_chunks"] = texts.map({text: chunked for text, (_, chunked) in tagged.items()})
     return df
 
 
+#checks the model is there when the pipeline is compiled rather than when it runs
+def _tagging_stage(column_name: str, chunks: bool):
+    check_tagger_model(TAG_ENGINE.model_dir)
+    return _frame_stage(tag_parts_of_speech, column_name, chunks)
+
+
+LONG_VOWELS = {
+    'ा': '',  # 'aa' sound
+    'ी': 'ि',  # 'ii' sound
+    'ू': 'ु',  # 'uu' sound
+    'ॅ': 'े',  # 'ei' sound
+    'े': 'े',  # 'ee' sound
+    'ै': 'े',  # 'ai' sound
+    'ो': 'ो',  # 'oo' sound
+    'ौ': 'ो',  # 'au' sound
+}
+
+
+#one long vowel through the same character map normalize_indic uses, so
+#shortening several letters in a row is still one pass
 def replace_long_vowel(df: pd.DataFrame, column_name: str, letter: str):
-    replacements = {
-        'ा': '',  # 'aa' sound
-        'ी': 'ि',  # 'ii' sound
-        'ू': 'ु',  # 'uu' sound
-        'ॅ': 'े',  # 'ei' sound
-        'े': 'े',  # 'ee' sound
-        'ै': 'े',  # 'ai' sound
-        'ो': 'ो',  # 'oo' sound
-        'ौ': 'ो',  # 'au' sound
+    df[column_name] = run_text_steps(df[column_name], _long_vowel_steps(letter))
+    return df
+
+
+def _long_vowel_steps(letter: str):
+    if letter not in LONG_VOWELS:
+        return []
+    return [('map', ((ord(letter), LONG_VOWELS[letter]),))]
+
+
+#the Indic blocks share one layout, each script's signs sit at the same
+#offsets from the start of its block as in Devanagari
+INDIC_SCRIPTS = {
+    'devanagari': 0x0900,
+    'bengali': 0x0980,
+    'gurmukhi': 0x0A00,
+    'gujarati': 0x0A80,
+    'oriya': 0x0B00,
+    'tamil': 0x0B80,
+    'telugu': 0x0C00,
+    'kannada': 0x0C80,
+    'malayalam': 0x0D00,
+}
+NORMALIZATION_FORMS = ('NFC', 'NFKC')
+_NUKTA_OFFSET = 0x3C
+
+
+def _assigned(char: str):
+    return unicodedata.category(char) != 'Cn'
+
+
+#every long vowel of the script shortened in one table, by shifting the
+#Devanagari map into the script's block where both signs exist. fold_nukta
+#also maps the letters with a nukta to their base letters and drops the nukta
+@lru_cache(maxsize=None)
+def indic_table(script: str, fold_nukta: bool = False):
+    start = INDIC_SCRIPTS[script]
+    shift = lambda text: ''.join(chr(ord(c) - INDIC_SCRIPTS['devanagari'] + start) for c in text)
+    table = {}
+    for long, short in LONG_VOWELS.items():
+        source, target = shift(long), shift(short)
+        if _assigned(source) and all(map(_assigned, target)):
+            table[ord(source)] = target
+    nukta = chr(start + _NUKTA_OFFSET)
+    if fold_nukta and _assigned(nukta):
+        for code in range(start, start + 0x80):
+            decomposition = unicodedata.decomposition(chr(code)).split()
+            if len(decomposition) == 2 and chr(int(decomposition[1], 16)) == nukta:
+                table[code] = chr(int(decomposition[0], 16))
+        table[ord(nukta)] = ''
+    return table
+
+
+def _indic_steps(script: str = 'devanagari', form: str = None, fold_nukta: bool = False):
+    if script not in INDIC_SCRIPTS:
+        raise ValueError(f"unknown script {script!r}, expected one of {', '.join(INDIC_SCRIPTS)}")
+    if form is not None and form not in NORMALIZATION_FORMS:
+        raise ValueError(f"unknown normalization form {form!r}, expected NFC or NFKC")
+    steps = [('normalize', form)] if form else []
+    return steps + [('map', tuple(sorted(indic_table(script, fold_nukta).items())))]
+
+
+#shorten every long vowel of the script in one pass, after an optional
+#Unicode normalization
+def normalize_indic(df: pd.DataFrame, column_name: str, script: str = 'devanagari', form: str = None,
+                    fold_nukta: bool = False):
+    df[column_name] = run_text_steps(df[column_name], _indic_steps(script, form, fold_nukta))
+    return df
+
+
+#remove the words of column_name that occur fewer than min_count times in the
+#whole column. the kept words are joined by single spaces. with vocabulary,
+#the counts are saved under that name and later uploads naming it reuse them
+def remove_rare_words(df: pd.DataFrame, column_name: str, min_count: int = 2, approximate: bool = False,
+                      vocabulary: str = None):
+    counts = VOCABULARIES.get(vocabulary, approximate) if vocabulary is not None else None
+    if counts is None:
+        counts = CountMinSketch() if approximate else Vocabulary()
+        counts.update(df[column_name])
+        if vocabulary is not None:
+            VOCABULARIES.put(vocabulary, counts)
+    df[column_name] = drop_rare_words(df[column_name], counts, min_count)
+    return df
+
+
+#remove_spaces in one go: str.split() breaks on the same characters as \s, so
+#joining the pieces collapses every run to a single space and drops the end
+def _collapse_whitespace(value: str):
+    collapsed = ' '.join(value.split())
+    if collapsed and value[:1].isspace():
+        collapsed = ' ' + collapsed
+    return collapsed.replace(' .', '.')
+
+
+def _replace_all(value: str, targets: tuple, replacement: str):
+    for target in targets:
+        value = value.replace(target, replacement)
+    return value
+
+
+#a stage of a compiled pipeline. "text" stages carry per-value steps that run
+#fused in a single pass over column_name, "frame" stages call func(df, *args).
+#frame stages that need the whole dataset set stream(chunks, *args), which is
+#used instead of func when the upload is processed in chunks. column_name is
+#set on every stage that only reads and writes that one column, and "columns"
+#stages hold such stages for several columns in branches, run side by side.
+#name is the operation, or the operations joined by '+' when several were fused
+@dataclass
+class Stage:
+    kind: str
+    column_name: str | None = None
+    steps: list = field(default_factory=list)
+    func: object = None
+    args: tuple = ()
+    stream: object = None
+    name: str | None = None
+    branches: dict = field(default_factory=dict)
+
+
+#text steps are plain tuples so a plan stays picklable:
+#  ('translate', table) ('sub', pattern, repl) ('replace', targets, repl)
+#  ('method', name) ('call', func) ('fillna', value) ('delete', classes, chars)
+#  ('pattern', name, repl, backend) ('normalize', form) ('map', ((code, char), ...))
+#'delete', 'map' and 'pattern' on the pyarrow backend run column-wide, the rest per value
+#replacing the targets one after another gives the same result as a single
+#alternation when no two targets share a character and the replacement holds
+#none of them: occurrences cannot overlap and no replacement can create or
+#join up a new one. an empty replacement can join neighbours, so it only
+#qualifies for a single target
+def _can_alternate(targets: tuple, replacement: str):
+    if '' in targets or (replacement == '' and len(targets) > 1):
+        return False
+    seen = set(replacement)
+    for target in targets:
+        if seen & set(target):
+            return False
+        seen |= set(target)
+    return True
+
+
+def _alternation_step(targets: tuple, replacement: str):
+    if len(targets) > 1 and _can_alternate(targets, replacement):
+        pattern = re.compile('|'.join(map(re.escape, sorted(targets, key=len, reverse=True))))
+        return ('sub', pattern, replacement.replace('\\', '\\\\'))
+    return ('replace', targets, replacement)
+
+
+#single characters become translate tables, which compose exactly however
+#they interact; runs of longer strings become one alternation regex when that
+#is equivalent and chained str.replace calls within the same pass otherwise
+def _replacement_steps(targets: list[str], replacement: str):
+    if replacement is None:
+        raise TypeError("repl must be a string or callable")
+    steps = []
+    for target in targets:
+        if len(target) == 1:
+            steps.append(('translate', {ord(target): replacement}))
+        elif steps and steps[-1][0] == 'replace':
+            steps[-1] = ('replace', steps[-1][1] + (target,), replacement)
+        else:
+            steps.append(('replace', (target,), replacement))
+    return [_alternation_step(*step[1:]) if step[0] == 'replace' else step for step in steps]
+
+
+#applying first then second is the same as applying the composed table once
+def _compose_tables(first: dict, second: dict):
+    table = {
+        key: value.translate(second) if value else value
+        for key, value in first.items()
     }
+    for key, value in second.items():
+        table.setdefault(key, value)
+    return table
+
+
+def _deleted_chars(step: tuple):
+    if step[0] == 'translate' and not any(step[1].values()):
+        return ''.join(map(chr, step[1]))
+    return None
+
+
+#emoji deletion also takes the joiners next to what it deletes, so other
+#deletions are kept apart from it: a joiner between a letter and a digit
+#must not go because the digit is deleted in the same pass
+def _deletes_emoji(step: tuple):
+    return step[0] == 'delete' and 'emoji' in step[1]
+
+
+#neighbouring translate tables are composed and neighbouring deletions share
+#one mask, including translate tables that only delete characters
+def _merge_text_steps(steps: list):
+    merged = []
+    for step in steps:
+        previous = merged[-1] if merged else None
+        if previous is None:
+            merged.append(step)
+        elif step[0] == 'translate' and previous[0] == 'translate':
+            merged[-1] = ('translate', _compose_tables(previous[1], step[1]))
+        elif step[0] == 'map' and previous[0] == 'map':
+            merged[-1] = ('map', _compose_maps(previous[1], step[1]))
+        elif _deletes_emoji(step) or _deletes_emoji(previous):
+            merged.append(step)
+        elif step[0] == 'delete' and previous[0] == 'delete':
+            merged[-1] = ('delete', tuple(sorted(set(previous[1] + step[1]))), ''.join(sorted(set(previous[2] + step[2]))))
+        elif step[0] == 'delete' and _deleted_chars(previous) is not None:
+            merged[-1] = ('delete', step[1], ''.join(sorted(set(step[2] + _deleted_chars(previous)))))
+        elif previous[0] == 'delete' and _deleted_chars(step) is not None:
+            merged[-1] = ('delete', previous[1], ''.join(sorted(set(previous[2] + _deleted_chars(step)))))
+        else:
+            merged.append(step)
+    return merged
+
+
+#one character map doing what first and then second did
+def _compose_maps(first: tuple, second: tuple):
+    later = dict(second)
+    composed = {code: later.get(ord(char), char) if char else '' for code, char in first}
+    for code, char in second:
+        composed.setdefault(code, char)
+    return tuple(sorted(composed.items()))
+
+
+def _text_stage(column_name: str, *steps):
+    return [Stage('text', column_name, list(steps))]
+
+
+def _frame_stage(func, *args):
+    return [Stage('frame', func=func, args=args)]
+
+
+def _global_stage(func, stream, *args):
+    return [Stage('frame', func=func, args=args, stream=stream)]
+
+
+#checks the parameters when the pipeline is compiled rather than when it runs
+def _near_duplicate_stage(column_name: str, threshold: float, flag: bool, shingle_size: int, signature_size: int):
+    _near_duplicate_bands(threshold, shingle_size, signature_size)
+    return _global_stage(
+        remove_near_duplicate_rows, stream_near_duplicate_rows, column_name, threshold, flag, shingle_size, signature_size)
+
+
+#the sort arguments too, as a bad one would otherwise only fail on the data
+def _sort_stage(by: str | list[str], ascending: bool | list[bool], na_position: str, stable: bool):
+    columns = [by] if isinstance(by, str) else by
+    if not isinstance(columns, list) or not columns or not all(isinstance(column, str) for column in columns):
+        raise ValueError("sort columns must be a column name or a list of them")
+    directions = ascending if isinstance(ascending, list) else [ascending]
+    if not all(isinstance(direction, bool) for direction in directions):
+        raise ValueError("ascending must be true, false or a list of them")
+    _sort_directions(ascending, columns)
+    if na_position not in ('first', 'last'):
+        raise ValueError("na_position must be 'first' or 'last'")
+    if not isinstance(stable, bool):
+        raise ValueError("stable must be true or false")
+    return _global_stage(sort_rows, stream_sorted_rows, by, ascending, na_position, stable)
+
+
+def _rare_word_stage(column_name: str, min_count: int, approximate: bool, vocabulary: str):
+    if min_count < 1:
+        raise ValueError("min_count must be at least 1")
+    _check_vocabulary_name(vocabulary)
+    return _global_stage(remove_rare_words, stream_rare_words, column_name, min_count, approximate, vocabulary)
+
+
+#checks the bounds when the pipeline is compiled. without downcasting the
+#rules only touch column_name and run on that column alone; downcasting has to
+#know whether it runs on chunks, so it is a whole-frame stage
+def _numeric_stage(column_name: str, *rules):
+    for rule in rules:
+        _check_numeric_rule(rule)
+    if not rules:
+        return []
+    if ('downcast',) in rules:
+        return _global_stage(apply_numeric_rules, stream_numeric_rules, column_name, list(rules))
+    return _column_stage(apply_numeric_rules, column_name, list(rules))
+
+
+#a frame stage that only touches column_name, so it can run on that column alone
+def _column_stage(func, column_name: str, *args):
+    return [Stage('frame', column_name, func=func, args=(column_name, *args))]
+
+
+#every operation the pipeline knows about, in terms of the stages it compiles to
+OPERATIONS = {
+    'remove_spaces': lambda column_name, regex_backend=None: _text_stage(
+        column_name, *_whitespace_steps(regex_backend)),
+    'remove_nulls': lambda column_name: _text_stage(column_name, ('fillna', '')),
+    'replace_chars': lambda column_name, chars_to_be_replaced, char_to_replace: _text_stage(
+        column_name, *_replacement_steps(chars_to_be_replaced, char_to_replace)),
+    'remove_chars': lambda column_name, chars_to_be_removed: _text_stage(
+        column_name, *_replacement_steps(chars_to_be_removed, '')),
+    'to_lower': lambda column_name: _text_stage(column_name, ('method', 'lower')),
+    'to_upper': lambda column_name: _text_stage(column_name, ('method', 'upper')),
+    'to_title': lambda column_name: _text_stage(column_name, ('method', 'title')),
+    'remove_duplicate_rows': lambda subset=None, exact=False: _global_stage(
+        remove_duplicate_rows, stream_duplicate_rows, subset, exact),
+    'remove_near_duplicate_rows': lambda column_name, threshold=0.8, flag=False, shingle_size=5, signature_size=128: (
+        _near_duplicate_stage(column_name, threshold, flag, shingle_size, signature_size)),
+    'remove_duplicate_columns': lambda: _frame_stage(remove_duplicate_columns),
+    'remove_empty_rows': lambda: _frame_stage(remove_empty_rows),
+    'remove_empty_columns': lambda: _global_stage(remove_empty_columns, stream_empty_columns),
+    'remove_negative_values': lambda column_name: _numeric_stage(column_name, ('remove', 0, None)),
+    'clip_values': lambda column_name, min_value=None, max_value=None: _numeric_stage(
+        column_name, *_numeric_rules(clip_min=min_value, clip_max=max_value)),
+    'downcast_values': lambda column_name: _numeric_stage(column_name, ('downcast',)),
+    'clean_numeric_values': lambda column_name, remove_negative=False, min_value=None, max_value=None, clip_min=None, clip_max=None, downcast=False: (
+        _numeric_stage(column_name, *_numeric_rules(remove_negative, min_value, max_value, clip_min, clip_max, downcast))),
+    'arrange_column_ascending': lambda column_name, na_position='last', stable=True: _sort_stage(
+        column_name, True, na_position, stable),
+    'arrange_column_descending': lambda column_name, na_position='last', stable=True: _sort_stage(
+        column_name, False, na_position, stable),
+    'sort_rows': lambda by, ascending=True, na_position='last', stable=True: _sort_stage(
+        by, ascending, na_position, stable),
+    'remove_punctuation': lambda column_name: _text_stage(column_name, ('delete', ('punctuation',), '')),
+    'remove_numerical_characters': lambda column_name: _text_stage(column_name, ('delete', ('digit',), '')),
+    'remove_alphabetical_characters': lambda column_name: _text_stage(column_name, ('delete', ('alpha',), '')),
+    'remove_non_alphanumeric': lambda column_name: _text_stage(column_name, ('delete', ('non_alphanumeric',), '')),
+    'remove_emojis': lambda column_name: _text_stage(column_name, ('delete', ('emoji',), '')),
+    'remove_html_tags': lambda column_name, regex_backend=None: _text_stage(
+        column_name, *_pattern_steps('html_tag', '', regex_backend)),
+    'remove_urls': lambda column_name, regex_backend=None: _text_stage(
+        column_name, *_pattern_steps('url', '', regex_backend)),
+    'check_spelling': lambda column_name: _column_stage(check_spelling, column_name),
+    'tag_parts_of_speech': lambda column_name, chunks=False: _tagging_stage(column_name, chunks),
+    'remove_out_of_range_values': lambda column_name, min_value, max_value: _numeric_stage(
+        column_name, *_numeric_rules(min_value=min_value, max_value=max_value)),
+    'replace_long_vowel': lambda column_name, letter: _text_stage(column_name, *_long_vowel_steps(letter)),
+    'remove_rare_words': lambda column_name, min_count=2, approximate=False, vocabulary=None: _rare_word_stage(
+        column_name, min_count, approximate, vocabulary),
+    'normalize_indic': lambda column_name, script='devanagari', form=None, fold_nukta=False: _text_stage(
+        column_name, *_indic_steps(script, form, fold_nukta)),
+}
+
+
+#turns an ordered list of (operation, kwargs) into a plan where neighbouring
+#text steps on the same column share one pass and translate tables are merged,
+#and neighbouring numeric rules on the same column share one mask.
+#stages on different columns do not affect each other, so a run of them
+#between whole-frame stages is regrouped by column into one "columns" stage
+def compile_pipeline(operations: list[tuple[str, dict]]):
+    stages = []
+    for name, kwargs in operations:
+        for stage in OPERATIONS[name](**kwargs):
+            stage.name = name
+            stages.append(stage)
+
+    plan = []
+    for column_local, run in itertools.groupby(stages, key=lambda stage: stage.column_name is not None):
+        branches = {}
+        for stage in run:
+            branches.setdefault(stage.column_name, []).append(stage)
+        if not column_local or len(branches) == 1:
+            plan += _fuse_stages([stage for branch in branches.values() for stage in branch])
+            continue
+        branches = {column: _fuse_stages(branch) for column, branch in branches.items()}
+        branches = {column: branch for column, branch in branches.items() if branch}
+        name = '|'.join(f"{column}:{stage.name}" for column, branch in branches.items() for stage in branch)
+        plan.append(Stage('columns', name=name, branches=branches))
+    return plan
+
+
+def _fuse_stages(stages: list[Stage]):
+    fused = []
+    for stage in stages:
+        previous = fused[-1] if fused else None
+        if (
+            stage.kind == 'text'
+            and previous is not None
+            and previous.kind == 'text'
+            and previous.column_name == stage.column_name
+        ):
+            previous.steps = _merge_text_steps(previous.steps + stage.steps)
+            previous.name = f"{previous.name}+{stage.name}"
+        elif (
+            stage.func is apply_numeric_rules
+            and previous is not None
+            and previous.func is apply_numeric_rules
+            and previous.column_name == stage.column_name
+            and previous.args[0] == stage.args[0]
+        ):
+            previous.args = (previous.args[0], previous.args[1] + stage.args[1])
+            previous.name = f"{previous.name}+{stage.name}"
+        elif stage.kind != 'text' or stage.steps:
+            stage.steps = _merge_text_steps(stage.steps)
+            fused.append(stage)
+    return fused
+
+
+#one step of a pipeline spec: an operation from OPERATIONS, the column it
+#runs on when it works on a column, and the rest of its arguments
+class PipelineStep(BaseModel):
+    operation: str = Field(description="Name of the operation, e.g. remove_spaces or replace_chars")
+    column_name: str | None = Field(None, description="Column to run the operation on, for column operations")
+    arguments: dict = Field(default_factory=dict, description="Other arguments of the operation")
+
+    @field_validator('operation')
+    @classmethod
+    def known_operation(cls, operation: str):
+        if operation not in OPERATIONS:
+            raise ValueError(f"unknown operation {operation!r}")
+        return operation
+
+    @model_validator(mode='after')
+    def column_when_needed(self):
+        takes_column = 'column_name' in inspect.signature(OPERATIONS[self.operation]).parameters
+        if takes_column and self.column_name is None:
+            raise ValueError(f"{self.operation} needs a column_name")
+        if not takes_column and self.column_name is not None:
+            raise ValueError(f"{self.operation} works on the whole file, not on a column")
+        return self
+
+    @classmethod
+    def from_operation(cls, name: str, kwargs: dict):
+        arguments = {key: value for key, value in kwargs.items() if key != 'column_name'}
+        return cls(operation=name, column_name=kwargs.get('column_name'), arguments=arguments)
+
+    def to_operation(self):
+        kwargs = dict(self.arguments)
+        if self.column_name is not None:
+            kwargs['column_name'] = self.column_name
+        return self.operation, kwargs
+
+
+class PipelineSpec(BaseModel):
+    steps: list[PipelineStep] = Field(description="Operations in the order they run")
+
+
+#compiled plans by the hash of their spec, so a spec is compiled once however
+#often it is sent, and the least recently used are dropped past the limit
+class PipelineStore:
+    def __init__(self, size: int = 1024):
+        self.size = size
+        self._pipelines = OrderedDict()
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def pipeline_id(spec: PipelineSpec):
+        canonical = json.dumps(spec.model_dump(), sort_keys=True, ensure_ascii=False)
+        return hashlib.sha256(canonical.encode()).hexdigest()[:16]
+
+    def add(self, spec: PipelineSpec):
+        pipeline_id = self.pipeline_id(spec)
+        with self._lock:
+            if pipeline_id in self._pipelines:
+                self._pipelines.move_to_end(pipeline_id)
+                return pipeline_id, self._pipelines[pipeline_id][1]
+        plan = compile_pipeline([step.to_operation() for step in spec.steps])
+        with self._lock:
+            self._pipelines[pipeline_id] = (spec, plan)
+            while len(self._pipelines) > self.size:
+                self._pipelines.popitem(last=False)
+        return pipeline_id, plan
+
+    def get(self, pipeline_id: str):
+        with self._lock:
+            if pipeline_id not in self._pipelines:
+                return None
+            self._pipelines.move_to_end(pipeline_id)
+            return self._pipelines[pipeline_id]
+
+
+PIPELINES = PipelineStore(int(os.environ.get("PIPELINE_CACHE_SIZE", 1024)))
+
+
+def _plan_stages(plan: list[Stage]):
+    for stage in plan:
+        if stage.kind == 'columns':
+            for branch in stage.branches.values():
+                yield from _plan_stages(branch)
+        else:
+            yield stage
+
+
+#the columns the plan reads, or None when some stage works on the whole frame
+def plan_columns(plan: list[Stage]):
+    columns = []
+    for stage in _plan_stages(plan):
+        if stage.column_name is None:
+            return None
+        if stage.column_name not in columns:
+            columns.append(stage.column_name)
+    return columns
+
+
+#builds everything the plan would otherwise build lazily on its first run:
+#character class masks, RE2 patterns, the case fallback tables when text is
+#held in Arrow by default, the spelling dictionary and the tagging model
+def prepare_plan(plan: list[Stage]):
+    for stage in _plan_stages(plan):
+        for step in stage.steps:
+            if step[0] == 'delete':
+                _deletion_mask(step[1], step[2])
+            elif step[0] == 'map':
+                _character_map(step[1])
+            elif step[0] == 'pattern' and step[3] != 're':
+                _re2_source(step[1])
+            elif step[0] == 'method' and STRING_ENGINE == 'pyarrow':
+                _case_fallback_pattern(step[1])
+        if stage.func is check_spelling:
+            SPELL_ENGINE.checker
+        elif stage.func is tag_parts_of_speech:
+            TAG_ENGINE.tagger
+        elif stage.func is remove_near_duplicate_rows:
+            _deletion_mask(('non_alphanumeric',), '')
+
+
+def _step_function(step: tuple):
+    kind = step[0]
+    if kind == 'translate':
+        return operator.methodcaller('translate', step[1])
+    if kind == 'sub':
+        return partial(step[1].sub, step[2])
+    if kind == 'pattern':
+        return partial(PATTERNS[step[1]].sub, step[2])
+    if kind == 'replace':
+        return partial(_replace_all, targets=step[1], replacement=step[2])
+    if kind == 'method':
+        return getattr(str, step[1])
+    if kind == 'call':
+        return step[1]
+    if kind == 'normalize':
+        return partial(unicodedata.normalize, step[1])
+    raise ValueError(f"unknown text step {kind!r}")
+
+
+#runs the fused steps over every value of the series in one pass, with the
+#same null handling as the .str accessor: nulls pass through untouched and
+#other non-string values become NaN
+def _run_value_steps(series: pd.Series, steps: list):
+    chain = [
+        (None, step[1]) if step[0] == 'fillna' else (_step_function(step), None)
+        for step in steps
+    ]
+    funcs = [func for func, _ in chain if func is not None]
+
+    def run_text(value):
+        for func in funcs:
+            value = func(value)
+        return value
+
+    def run(value):
+        for func, fill_value in chain:
+            if isinstance(value, str):
+                if func is not None:
+                    value = func(value)
+            elif func is None:
+                if pd.isna(value):
+                    value = fill_value
+            elif not pd.isna(value):
+                value = np.nan
+        return value
+
+    values = series.to_numpy(dtype=object)
+    if len(funcs) == len(chain):
+        #no null filling, so strings only ever see the text steps
+        values = [
+            run_text(value) if isinstance(value, str) else run(value)
+            for value in values
+        ]
+    else:
+        values = [run(value) for value in values]
+    return pd.Series(values, index=series.index, name=series.name, dtype=object)
+
+
+def _runs_column_wide(step: tuple):
+    return step[0] in ('delete', 'map') or (step[0] == 'pattern' and step[3] != 're')
+
+
+CASE_KERNELS = {'lower': 'utf8_lower', 'upper': 'utf8_upper', 'title': 'utf8_title'}
+#a character is checked alone and next to cased letters, which is all title
+#casing looks at
+_CASE_CONTEXTS = ('{}', 'a{}a', 'A{}A', '{}a', 'a{}')
+
+
+#every code point Arrow can hold, and those Python gives a case
+@lru_cache(maxsize=None)
+def _code_points():
+    chars = [chr(c) for c in range(sys.maxunicode + 1) if not 0xD800 <= c < 0xE000]
+    cased = [c for c in chars if c.lower() != c or c.upper() != c or c.isupper() or c.islower() or c.istitle()]
+    return chars, pa.array(chars), cased
+
+
+#the characters Arrow's case kernel and the str method disagree on in some
+#context: Arrow has its own Unicode tables and no special casing (ß, final
+#sigma). only characters that either side treats as cased are checked in Python
+@lru_cache(maxsize=None)
+def _case_fallback_pattern(method: str):
+    chars, array, cased = _code_points()
+    kernel = getattr(pc, CASE_KERNELS[method])
+    func = getattr(str, method)
+    candidates = set(cased)
+    for context in _CASE_CONTEXTS:
+        before, after = context.split('{}')
+        expected_before, expected_after = func(context.format('0')).split('0')
+        got = kernel(pc.binary_join_element_wise(before, array, after, ''))
+        differs = pc.not_equal(got, pc.binary_join_element_wise(expected_before, array, expected_after, ''))
+        candidates.update(itertools.compress(chars, differs.to_numpy(zero_copy_only=False)))
+    special = set()
+    for context in _CASE_CONTEXTS:
+        texts = [context.format(c) for c in candidates]
+        got = kernel(pa.array(texts, type=pa.string())).to_pylist()
+        special.update(c for c, text, result in zip(candidates, texts, got) if func(text) != result)
+    return f"[{re.escape(''.join(sorted(special)))}]"
+
+
+#the case kernel over the whole column, with rows holding a character it gets
+#wrong redone by the str method
+def _arrow_case(series: pd.Series, method: str):
+    result = getattr(series.str, method)()
+    redo = series.str.contains(_case_fallback_pattern(method), regex=True)
+    redo = redo.fillna(False).astype(bool).to_numpy()
+    if redo.any():
+        result[redo] = series[redo].map(getattr(str, method))
+    return result
+
+
+#steps Arrow has a kernel for; patterns all run on RE2 there, whatever
+#backend they were compiled for, since the backends agree. remove_spaces
+#stays a single pass per value, which beats the three RE2 substitutions.
+#character maps run on code point arrays, like on object columns
+def _has_arrow_kernel(step: tuple):
+    return step[0] in ('method', 'replace', 'fillna', 'delete', 'pattern', 'normalize', 'map')
+
+
+def _arrow_step(series: pd.Series, step: tuple):
+    kind = step[0]
+    if kind == 'method':
+        return _arrow_case(series, step[1])
+    if kind == 'replace':
+        for target in step[1]:
+            series = series.str.replace(target, step[2], regex=False)
+        return series
+    if kind == 'fillna':
+        return series.fillna(step[1])
+    if kind == 'normalize':
+        return series.str.normalize(step[1])
+    if kind == 'map':
+        return map_characters(series, step[1])
+    if kind == 'delete':
+        return delete_characters(series, step[1], step[2])
+    return replace_pattern(series, step[1], step[2], 'pyarrow')
+
+
+#arrow-backed columns stay in Arrow: steps with a kernel run column-wide, the
+#others run per value as on object columns and are turned back into Arrow
+def run_arrow_text_steps(series: pd.Series, steps: list):
+    dtype = series.dtype
+    for has_kernel, group in itertools.groupby(steps, key=_has_arrow_kernel):
+        if has_kernel:
+            for step in group:
+                series = _arrow_step(series, step)
+        else:
+            series = _run_value_steps(series, list(group)).astype(dtype)
+    return series
+
+
+#column-wide steps run one by one, every run of other steps in between is one pass
+def run_text_steps(series: pd.Series, steps: list):
+    #filling nulls works on any column, as remove_nulls always has
+    while steps and steps[0][0] == 'fillna':
+        series = series.fillna(steps[0][1])
+        steps = steps[1:]
+    if not steps or _no_text(series):
+        return series
+    series.str  # raises for non-text columns, like the unfused operations
+    if _is_arrow_string(series):
+        return run_arrow_text_steps(series, steps)
+    for column_wide, group in itertools.groupby(steps, key=_runs_column_wide):
+        if column_wide:
+            for step in group:
+                if step[0] == 'delete':
+                    series = delete_characters(series, step[1], step[2])
+                elif step[0] == 'map':
+                    series = map_characters(series, step[1])
+                else:
+                    series = replace_pattern(series, step[1], step[2], step[3])
+        else:
+            series = _run_value_steps(series, list(group))
+    return series
+
+
+#fused text passes are pure Python and hold the GIL, so on big columns they
+#go to worker processes and leave the pipeline threads free for pandas work.
+#the default keeps one core for the server itself
+TEXT_WORKERS = int(os.environ.get("TEXT_WORKERS", max((os.cpu_count() or 1) - 1, 0)))
+TEXT_PROCESS_MIN_ROWS = 100_000
+_text_pool = None
+_text_pool_lock = threading.Lock()
+
+
+#Arrow kernels release the GIL, so arrow-backed columns only go to the worker
+#processes when some step has to run per value
+def _run_text_stage(series: pd.Series, steps: list):
+    global _text_pool
+    in_arrow = _is_arrow_string(series) and all(map(_has_arrow_kernel, steps))
+    if TEXT_WORKERS < 1 or len(series) < TEXT_PROCESS_MIN_ROWS or in_arrow:
+        return run_text_steps(series, steps)
+    with _text_pool_lock:
+        if _text_pool is None:
+            _text_pool = ProcessPoolExecutor(max_workers=TEXT_WORKERS)
+    return _text_pool.submit(run_text_steps, series, steps).result()
+
+
+#each branch of a "columns" stage runs in the column pool on a frame of just
+#its column; big text columns go on from there to the text worker processes,
+#so several columns keep several cores busy
+COLUMN_WORKERS = int(os.environ.get("COLUMN_WORKERS", os.cpu_count() or 1))
+_column_pool = ThreadPoolExecutor(max_workers=COLUMN_WORKERS, thread_name_prefix="column")
+
+
+def _run_branch(df: pd.DataFrame, column_name: str, stages: list[Stage]):
+    return run_pipeline(df, stages)[column_name]
+
+
+def _run_stage(df: pd.DataFrame, stage: Stage):
+    if stage.kind == 'text':
+        df[stage.column_name] = _run_text_stage(df[stage.column_name], stage.steps)
+        return df
+    if stage.kind == 'columns':
+        futures = {
+            column: _column_pool.submit(_run_branch, df[column].to_frame(), column, branch)
+            for column, branch in stage.branches.items()
+        }
+        for column, future in futures.items():
+            df[column] = future.result()
+        return df
+    return stage.func(df, *stage.args)
+
+
+def run_pipeline(df: pd.DataFrame, plan: list[Stage], trace: 'PipelineTrace' = None):
+    for stage in plan:
+        if trace is None:
+            df = _run_stage(df, stage)
+        else:
+            df = trace.run(stage.name, len(df), _run_stage, df, stage)
+    return df
 
-    if letter in replacements:
-        pattern = re.escape(letter)
-        df[column_name] = df[column_name].str.replace(pattern, replacements[letter])
+
+#chunks are spilled to pickles in a temporary directory so a global stage can
+#read its input more than once without holding it in memory
+def _spill(chunks, directory: str):
+    for number, chunk in enumerate(chunks):
+        path = os.path.join(directory, f"chunk_{number}.pkl")
+        chunk.to_pickle(path)
+        yield path, chunk
+
+
+def _key_frame(df: pd.DataFrame, subset: list[str] = None):
+    return df if subset is None else df[subset]
+
+
+def _number_keys(values: np.ndarray):
+    whole = np.isfinite(values) & (np.trunc(values) == values) & (np.abs(values) < 2.0 ** 63)
+    keys = np.where(whole, np.where(whole, values, 0).astype(np.int64), values.view(np.int64))
+    kinds = np.where(whole, 0, np.where(np.isnan(values), 2, 1)).astype(np.uint8)
+    keys[kinds == 2] = 0
+    return keys, kinds
+
+
+#numbers are hashed by value as an integer when they are whole and by their
+#bits otherwise, so 1 and 1.0 from chunks parsed with different dtypes match
+#as they compare equal. a chunk can read a column as text that another reads
+#as numbers, or as all missing floats, so text that reads as a number is
+#hashed as that number and missing values all hash alike whatever the dtype
+def _hash_keys(column: pd.Series):
+    values = column.to_numpy()
+    if values.dtype.kind in 'biu':
+        return [values.astype(np.int64), np.zeros(len(values), dtype=np.uint8)]
+    if values.dtype.kind == 'f':
+        return list(_number_keys(values.astype(np.float64)))
+    values = values.astype(object)
+    numbers = pd.to_numeric(pd.Series(values), errors='coerce').to_numpy(dtype=np.float64, na_value=np.nan)
+    keys, kinds = _number_keys(numbers)
+    is_text = np.isnan(numbers) & pd.notna(values)
+    if is_text.any():
+        keys[is_text] = pd.util.hash_array(values[is_text]).view(np.int64)
+        kinds[is_text] = 3
+    return [keys, kinds]
+
+
+_HASH_MULTIPLIER = np.uint64(1000003)
+
+
+#one uint64 per row, combined a column at a time so a wide frame is never
+#copied whole
+def row_hashes(df: pd.DataFrame, subset: list[str] = None):
+    columns = _key_frame(df, subset)
+    hashes = np.full(len(columns), 0x345678, dtype=np.uint64)
+    for position in range(columns.shape[1]):
+        for key in _hash_keys(columns.iloc[:, position]):
+            hashes = (hashes ^ pd.util.hash_array(key)) * _HASH_MULTIPLIER
+    return hashes
+
+
+#a set of 64-bit hashes as sorted numpy runs, 8 bytes per hash. a new run is
+#merged into the previous one while it is at least as long, so there are only
+#logarithmically many runs to search
+class HashSet:
+    def __init__(self):
+        self._runs = []
+
+    def __len__(self):
+        return sum(map(len, self._runs))
+
+    def contains(self, hashes: np.ndarray):
+        found = np.zeros(len(hashes), dtype=bool)
+        for run in self._runs:
+            positions = np.minimum(np.searchsorted(run, hashes), len(run) - 1)
+            found |= run[positions] == hashes
+        return found
+
+    #hashes that are not in the set yet
+    def add(self, hashes: np.ndarray):
+        run = np.sort(hashes)
+        while self._runs and len(self._runs[-1]) <= len(run):
+            run = np.sort(np.concatenate((self._runs.pop(), run)), kind='stable')
+        if len(run):
+            self._runs.append(run)
+
+
+#one pass: a row is kept only the first time its hash is seen in any chunk,
+#so memory grows by 8 bytes per distinct row. exact keeps a set of the
+#distinct rows themselves instead, which costs as much memory as they take
+def stream_duplicate_rows(chunks, subset: list[str] = None, exact: bool = False):
+    seen = set() if exact else HashSet()
+    for chunk in chunks:
+        if exact:
+            keys = _key_frame(chunk, subset)
+            rows = keys.astype(object).where(keys.notna(), None)
+            keep = []
+            for row in rows.itertuples(index=False, name=None):
+                keep.append(row not in seen)
+                seen.add(row)
+        else:
+            hashes = row_hashes(chunk, subset)
+            repeated = pd.Series(hashes).duplicated().to_numpy() | seen.contains(hashes)
+            seen.add(hashes[~repeated])
+            keep = ~repeated
+        yield chunk.take(np.flatnonzero(keep))
+
+
+#near duplicate text: values are cut down to their lowercase letters and
+#digits without URLs and split into overlapping shingles of shingle_size
+#characters. two values are near duplicates when the Jaccard similarity of
+#their shingle sets is at least threshold, estimated from MinHash signatures
+_SHINGLE_PRIME = np.uint64(0x100000001B3)
+_MIX_MULTIPLIER = np.uint64(0xFF51AFD7ED558CCD)
+_FOLD_MULTIPLIER = np.uint64(0x9E3779B97F4A7C15)
+
+#rows hashed at once by minhash_signatures, bounds its scratch memory
+SIGNATURE_BLOCK_ROWS = 16384
+
+
+#LSH splits a signature into bands of rows values, and only rows sharing a
+#whole band are compared. this picks the most rows per band whose LSH
+#threshold (1/bands)**(1/rows) is still at most threshold, so few pairs
+#above it are missed
+def _near_duplicate_bands(threshold: float, shingle_size: int, signature_size: int):
+    if not 0 < threshold <= 1:
+        raise ValueError("threshold must be above 0 and at most 1")
+    if shingle_size < 1:
+        raise ValueError("shingle_size must be at least 1")
+    if signature_size < 2 or signature_size & (signature_size - 1):
+        raise ValueError("signature_size must be a power of two")
+    rows = 1
+    while rows < signature_size and (rows * 2 / signature_size) ** (1 / (rows * 2)) <= threshold:
+        rows *= 2
+    return signature_size // rows, rows
+
+
+def _shingle_texts(series: pd.Series):
+    if _no_text(series):
+        return _text_values(series)
+    texts = delete_characters(replace_pattern(series, 'url', ' ').str.lower(), ('non_alphanumeric',))
+    return _text_values(texts)
+
+
+#one permutation hashing: every shingle is hashed once, the top bits of its
+#hash pick one of signature_size bins and each bin keeps the smallest low
+#bits. a bin no shingle fell in takes the next filled bin to its right,
+#offset by the distance, so short values still get a full signature.
+#values shorter than a shingle are padded, and nulls get no signature
+def minhash_signatures(series: pd.Series, shingle_size: int = 5, signature_size: int = 128):
+    values, is_text = _shingle_texts(series)
+    rows = np.flatnonzero(is_text)
+    texts = [text.ljust(shingle_size, '\0') for text in values[rows]]
+    signatures = np.zeros((len(values), signature_size), dtype=np.uint32)
+    for start in range(0, len(texts), SIGNATURE_BLOCK_ROWS):
+        block = texts[start:start + SIGNATURE_BLOCK_ROWS]
+        signatures[rows[start:start + SIGNATURE_BLOCK_ROWS]] = _block_signatures(block, shingle_size, signature_size)
+    return signatures, is_text
+
+
+def _block_signatures(texts: list[str], shingle_size: int, signature_size: int):
+    lengths = np.fromiter(map(len, texts), dtype=np.int64, count=len(texts))
+    codes = np.frombuffer(''.join(texts).encode('utf-32-le', 'surrogatepass'), dtype=np.uint32).astype(np.uint64)
+    counts = lengths - shingle_size + 1
+    shifts = np.repeat((np.cumsum(lengths) - lengths) - (np.cumsum(counts) - counts), counts)
+    #every position of the joined codes is hashed with contiguous slices,
+    #then the shingles that cross into the next value are dropped
+    span = len(codes) - shingle_size + 1
+    hashes = codes[:span].copy()
+    for offset in range(1, shingle_size):
+        hashes *= _SHINGLE_PRIME
+        hashes += codes[offset:span + offset]
+    hashes = hashes[np.arange(counts.sum()) + shifts]
+    hashes ^= hashes >> np.uint64(33)
+    hashes *= _MIX_MULTIPLIER
+    hashes ^= hashes >> np.uint64(33)
+
+    bits = signature_size.bit_length() - 1
+    cells = np.repeat(np.arange(len(texts), dtype=np.int64) * signature_size, counts)
+    cells += (hashes >> np.uint64(64 - bits)).astype(np.int64)
+    bins = np.full(len(texts) * signature_size, np.iinfo(np.uint64).max, dtype=np.uint64)
+    np.minimum.at(bins, cells, hashes & np.uint64(0xFFFFFFFF))
+    bins = bins.reshape(len(texts), signature_size)
+
+    filled = bins != np.iinfo(np.uint64).max
+    columns = np.arange(2 * signature_size)
+    nearest = np.where(np.concatenate((filled, filled), axis=1), columns, 2 * signature_size)
+    nearest = np.minimum.accumulate(nearest[:, ::-1], axis=1)[:, ::-1][:, :signature_size]
+    distances = (nearest - columns[:signature_size]).astype(np.uint64)
+    values = np.take_along_axis(bins, nearest % signature_size, axis=1) + (distances << np.uint64(32))
+    return ((values * _FOLD_MULTIPLIER) >> np.uint64(32)).astype(np.uint32)
+
+
+#one 64-bit key per band of every signature, salted with the band number so
+#equal bands at different places do not collide
+def _band_keys(signatures: np.ndarray, bands: int, rows: int):
+    keys = np.repeat(np.arange(1, bands + 1, dtype=np.uint64)[None, :] * _FOLD_MULTIPLIER, len(signatures), axis=0)
+    grouped = signatures.reshape(len(signatures), bands, rows)
+    for row in range(rows):
+        keys ^= grouped[:, :, row]
+        keys *= _MIX_MULTIPLIER
+    return keys
+
+
+#64-bit hashes mapped to int64 values, kept as sorted runs merged the way
+#HashSet merges them
+class HashIndex:
+    def __init__(self):
+        self._runs = []
+
+    #the value of each hash, or -1 when it is not in the index. the hashes
+    #are searched in sorted order, which keeps the lookups in cache
+    def get(self, hashes: np.ndarray):
+        order = np.argsort(hashes)
+        hashes = hashes[order]
+        values = np.full(len(hashes), -1, dtype=np.int64)
+        for run, run_values in self._runs:
+            positions = np.minimum(np.searchsorted(run, hashes), len(run) - 1)
+            found = run[positions] == hashes
+            values[found] = run_values[positions[found]]
+        values[order] = values.copy()
+        return values
+
+    #hashes that are not in the index yet
+    def add(self, hashes: np.ndarray, values: np.ndarray):
+        run, run_values = hashes, values
+        while self._runs and len(self._runs[-1][0]) <= len(run):
+            last, last_values = self._runs.pop()
+            run, run_values = np.concatenate((last, run)), np.concatenate((last_values, run_values))
+        order = np.argsort(run, kind='stable')
+        if len(run):
+            self._runs.append((run[order], run_values[order]))
+
+
+#LSH over MinHash signatures. the first row to have a band key leads it, and
+#a later row with the same key is a duplicate when its signature agrees with
+#the leader's on at least threshold of the values. only the leaders are
+#remembered across chunks: their band keys in memory, 8 bytes each, and their
+#signatures in a file on disk, read back for the rows that match them
+class NearDuplicateIndex:
+    def __init__(self, threshold: float = 0.8, shingle_size: int = 5, signature_size: int = 128):
+        self.bands, self.rows = _near_duplicate_bands(threshold, shingle_size, signature_size)
+        self.threshold = threshold
+        self.shingle_size = shingle_size
+        self.signature_size = signature_size
+        self._keys = HashIndex()
+        self._leaders = 0
+        self._directory = tempfile.TemporaryDirectory()
+        self._path = os.path.join(self._directory.name, "leaders.bin")
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self._directory.cleanup()
+
+    def _similar(self, signatures: np.ndarray, others: np.ndarray):
+        return (signatures == others).mean(axis=1) >= self.threshold
+
+    #which rows of series repeat an earlier row, including rows of earlier
+    #calls. last skips remembering this call's leaders
+    def add(self, series: pd.Series, last: bool = False):
+        signatures, is_text = minhash_signatures(series, self.shingle_size, self.signature_size)
+        rows = np.flatnonzero(is_text)
+        keys = _band_keys(signatures[rows], self.bands, self.rows).ravel()
+        slots = self._keys.get(keys)
+        unique, first, inverse = np.unique(keys, return_index=True, return_inverse=True)
+        owners = rows[np.arange(len(keys)) // self.bands]
+        leaders = rows[first[inverse] // self.bands]
+        duplicated = np.zeros(len(series), dtype=bool)
+
+        earlier = slots >= 0
+        if earlier.any():
+            pairs = np.unique(slots[earlier] * len(series) + owners[earlier])
+            stored = np.memmap(self._path, dtype=np.uint32, mode='r', shape=(self._leaders, self.signature_size))
+            similar = self._similar(signatures[pairs % len(series)], stored[pairs // len(series)])
+            duplicated[pairs[similar] % len(series)] = True
+
+        within = ~earlier & (leaders != owners)
+        if within.any():
+            pairs = np.unique(leaders[within] * len(series) + owners[within])
+            similar = self._similar(signatures[pairs % len(series)], signatures[pairs // len(series)])
+            duplicated[pairs[similar] % len(series)] = True
+
+        if not last:
+            new = slots[first] < 0
+            new_leaders = rows[first[new] // self.bands]
+            stored_rows = np.unique(new_leaders)
+            with open(self._path, 'ab') as file:
+                file.write(signatures[stored_rows].tobytes())
+            self._keys.add(unique[new], self._leaders + np.searchsorted(stored_rows, new_leaders))
+            self._leaders += len(stored_rows)
+        return duplicated
+
+
+def _near_duplicates(df: pd.DataFrame, column_name: str, index: NearDuplicateIndex, flag: bool, last: bool = False):
+    duplicated = index.add(df[column_name], last)
+    if flag:
+        return df.assign(**{f"{column_name}_near_duplicate": duplicated})
+    return df.take(np.flatnonzero(~duplicated))
+
+
+#one pass over the chunks with a single index, so a row is checked against
+#the leaders of every chunk before it
+def stream_near_duplicate_rows(chunks, column_name: str, threshold: float = 0.8, flag: bool = False,
+                               shingle_size: int = 5, signature_size: int = 128):
+    with NearDuplicateIndex(threshold, shingle_size, signature_size) as index:
+        for chunk in chunks:
+            yield _near_duplicates(chunk, column_name, index, flag)
+
+
+#exact token counts. tokens are the pieces str.split() gives
+class Vocabulary:
+    approximate = False
+
+    def __init__(self):
+        self.counts = Counter()
+
+    @property
+    def total(self):
+        return sum(self.counts.values())
+
+    def update(self, series: pd.Series):
+        values, is_text = _text_values(series)
+        self.counts.update(token for text in values[is_text] for token in text.split())
+
+    def count(self, tokens: list[str]):
+        return np.fromiter(map(self.counts.get, tokens, itertools.repeat(0)), dtype=np.int64, count=len(tokens))
+
+    def save(self, file):
+        file.write(json.dumps(self.counts).encode())
+
+    @classmethod
+    def load(cls, file):
+        vocabulary = cls()
+        vocabulary.counts = Counter(json.loads(file.read()))
+        return vocabulary
+
+
+SKETCH_BLOCK_VALUES = 65536
+
+
+#approximate token counts in depth rows of width counters, 16 MB by default
+#whatever the number of distinct tokens. a token's count is the smallest of
+#its counters, so it can be too high when tokens share counters, never too low
+class CountMinSketch:
+    approximate = True
+
+    def __init__(self, width: int = 1 << 20, depth: int = 4):
+        self.table = np.zeros((depth, width), dtype=np.uint32)
+        self.total = 0
+
+    #one counter per row from the two halves of the token's 64-bit hash
+    def _cells(self, tokens: list[str]):
+        hashes = pd.util.hash_array(np.array(tokens, dtype=object))
+        first, second = hashes & np.uint64(0xFFFFFFFF), (hashes >> np.uint64(32)) | np.uint64(1)
+        width = np.uint64(self.table.shape[1])
+        return [((first + np.uint64(row) * second) % width).astype(np.intp) for row in range(len(self.table))]
+
+    #a block of values at a time, so the scratch memory is bounded too
+    def update(self, series: pd.Series):
+        values, is_text = _text_values(series)
+        texts = values[is_text]
+        for start in range(0, len(texts), SKETCH_BLOCK_VALUES):
+            tokens = [token for text in texts[start:start + SKETCH_BLOCK_VALUES] for token in text.split()]
+            if not tokens:
+                continue
+            for row, cells in enumerate(self._cells(tokens)):
+                self.table[row] += np.bincount(cells, minlength=self.table.shape[1]).astype(np.uint32)
+            self.total += len(tokens)
+
+    def count(self, tokens: list[str]):
+        if not tokens:
+            return np.zeros(0, dtype=np.int64)
+        return np.min([self.table[row][cells] for row, cells in enumerate(self._cells(tokens))], axis=0).astype(np.int64)
+
+    def save(self, file):
+        np.savez(file, table=self.table, total=self.total)
+
+    @classmethod
+    def load(cls, file):
+        with np.load(file, allow_pickle=False) as arrays:
+            sketch = cls(1, 1)
+            sketch.table, sketch.total = arrays['table'], int(arrays['total'])
+        return sketch
+
+
+#the counts are looked up once per distinct token of the column, then each
+#value keeps its tokens outside the rare set
+def drop_rare_words(series: pd.Series, counts: Vocabulary | CountMinSketch, min_count: int):
+    if _no_text(series):
+        return series
+    series.str  # raises for non-text columns, like the .str methods
+    if _is_arrow_string(series):
+        return drop_rare_words(series.astype(object), counts, min_count).astype(series.dtype)
+    values, is_text = _text_values(series)
+    texts = values[is_text]
+    tokens = list({token for text in texts for token in text.split()})
+    rare = {token for token, count in zip(tokens, counts.count(tokens)) if count < min_count}
+    kept = [' '.join([token for token in text.split() if token not in rare]) for text in texts]
+    return _with_texts(series, values, is_text, kept)
+
+
+#a directory only the server's user can use. one that already exists must be
+#that user's and closed to everyone else, or anything could be planted in it
+def private_directory(path: str):
+    os.makedirs(path, mode=0o700, exist_ok=True)
+    status = os.stat(path)
+    if status.st_uid != os.getuid() or status.st_mode & 0o077:
+        raise PermissionError(f"{path} must belong to the server's user and be closed to others")
+    return path
+
+
+#vocabularies are read back on later uploads, so like profiles they live in a
+#directory only the server's user can write to
+VOCABULARY_DIR = os.environ.get("VOCABULARY_DIR", os.path.join(tempfile.gettempdir(), f"preprocessing-vocabularies-{os.getuid()}"))
+_VOCABULARY_NAME = re.compile(r'[A-Za-z0-9_.-]{1,128}')
+
+
+def _check_vocabulary_name(name: str):
+    if name is not None and (not _VOCABULARY_NAME.fullmatch(name) or name.startswith('.')):
+        raise ValueError("vocabulary names are letters, digits, '_', '-' and '.', and do not start with '.'")
+
+
+#named token counts, kept in VOCABULARY_DIR so they outlive the upload and the
+#server, with the most recently used held in memory. exact and approximate
+#counts of the same name are kept apart, as JSON and as numpy arrays, never
+#pickles
+class VocabularyStore:
+    def __init__(self, directory: str, size: int = 16):
+        self.directory = directory
+        self.size = size
+        self._vocabularies = OrderedDict()
+        self._lock = threading.Lock()
+
+    def _path(self, name: str, approximate: bool):
+        _check_vocabulary_name(name)
+        return os.path.join(self.directory, f"{name}.{'sketch.npz' if approximate else 'counts.json'}")
+
+    def _remember(self, path: str, vocabulary):
+        self._vocabularies[path] = vocabulary
+        self._vocabularies.move_to_end(path)
+        while len(self._vocabularies) > self.size:
+            self._vocabularies.popitem(last=False)
+
+    def get(self, name: str, approximate: bool = False):
+        path = self._path(name, approximate)
+        with self._lock:
+            if path in self._vocabularies:
+                self._vocabularies.move_to_end(path)
+                return self._vocabularies[path]
+        private_directory(self.directory)
+        if not os.path.exists(path):
+            return None
+        with open(path, 'rb') as file:
+            vocabulary = (CountMinSketch if approximate else Vocabulary).load(file)
+        with self._lock:
+            self._remember(path, vocabulary)
+        return vocabulary
+
+    def put(self, name: str, vocabulary: Vocabulary | CountMinSketch):
+        path = self._path(name, vocabulary.approximate)
+        private_directory(self.directory)
+        temporary = f"{path}.{uuid.uuid4().hex}.part"
+        with open(temporary, 'wb') as file:
+            vocabulary.save(file)
+        os.replace(temporary, path)
+        with self._lock:
+            self._remember(path, vocabulary)
+
+
+VOCABULARIES = VocabularyStore(VOCABULARY_DIR, int(os.environ.get("VOCABULARY_CACHE_SIZE", 16)))
+
+
+#two passes: the first spills the chunks while counting their tokens, the
+#second drops the rare words from the chunks read back. a saved vocabulary
+#skips the first pass, and the chunks go through as they arrive
+def stream_rare_words(chunks, column_name: str, min_count: int = 2, approximate: bool = False,
+                      vocabulary: str = None):
+    counts = VOCABULARIES.get(vocabulary, approximate) if vocabulary is not None else None
+    if counts is not None:
+        for chunk in chunks:
+            chunk[column_name] = drop_rare_words(chunk[column_name], counts, min_count)
+            yield chunk
+        return
+    counts = CountMinSketch() if approximate else Vocabulary()
+    with tempfile.TemporaryDirectory() as directory:
+        paths = []
+        for path, chunk in _spill(chunks, directory):
+            counts.update(chunk[column_name])
+            paths.append(path)
+        if vocabulary is not None:
+            VOCABULARIES.put(vocabulary, counts)
+        for path in paths:
+            chunk = pd.read_pickle(path)
+            chunk[column_name] = drop_rare_words(chunk[column_name], counts, min_count)
+            yield chunk
+
+
+#two passes: the first spills the chunks to disk and records which columns
+#hold any value, the second reads them back without the all-empty columns
+def stream_empty_columns(chunks):
+    with tempfile.TemporaryDirectory() as directory:
+        has_values = None
+        paths = []
+        for path, chunk in _spill(chunks, directory):
+            notna = chunk.notna().any()
+            has_values = notna if has_values is None else has_values | notna
+            paths.append(path)
+        for path in paths:
+            chunk = pd.read_pickle(path)
+            yield chunk.loc[:, has_values.reindex(chunk.columns).to_numpy()]
+
+
+SORT_MEMORY_BYTES = int(os.environ.get("SORT_MEMORY_BYTES", 256 * 1024 * 1024))
+
+
+#an external merge sort. chunks are buffered up to SORT_MEMORY_BYTES, sorted
+#and spilled as a run of chunk sized blocks, so only one block per run is in
+#memory while the runs are merged. input that fits is sorted in memory. runs
+#sorted by numbers are sorted again as text when another run reads the same
+#column as text, one run at a time
+def stream_sorted_rows(chunks, by: str | list[str], ascending: bool | list[bool] = True,
+                       na_position: str = 'last', stable: bool = True):
+    by = [by] if isinstance(by, str) else list(by)
+    ascending = _sort_directions(ascending, by)
+    with tempfile.TemporaryDirectory() as directory:
+        runs, buffered, size, chunk_size, position = [], [], 0, None, 0
+        for chunk in chunks:
+            chunk_size = chunk_size or len(chunk) or 1
+            buffered.append((chunk, np.arange(position, position + len(chunk))))
+            position += len(chunk)
+            size += frame_bytes(chunk)
+            if size > SORT_MEMORY_BYTES:
+                runs.append(_spill_run(buffered, by, ascending, na_position, chunk_size, directory, len(runs)))
+                buffered, size = [], 0
+        if not runs:
+            if not buffered:
+                return
+            text_keys = _mixed_sort_keys([_key_kinds(chunk, by) for chunk, _ in buffered])
+            if text_keys:
+                df = pd.concat([chunk for chunk, _ in buffered], ignore_index=True)
+                order = _sort_order(df, np.arange(len(df)), by, ascending, na_position, text_keys)
+                df = df.take(order).reset_index(drop=True)
+            else:
+                df = sort_rows(pd.concat([chunk for chunk, _ in buffered]), by, ascending, na_position, stable)
+            for start in range(0, len(df), chunk_size):
+                yield df.iloc[start:start + chunk_size]
+            return
+        if buffered:
+            runs.append(_spill_run(buffered, by, ascending, na_position, chunk_size, directory, len(runs)))
+        text_keys = _mixed_sort_keys([kinds for _, kinds in runs])
+        for number, (paths, kinds) in enumerate(runs):
+            if any(kinds.get(column) for column in text_keys):
+                blocks = [pd.read_pickle(path) for path in paths]
+                for path in paths:
+                    os.remove(path)
+                runs[number] = _spill_run(blocks, by, ascending, na_position, chunk_size, directory,
+                                          len(runs) + number, text_keys)
+        yield from _merge_runs([paths for paths, _ in runs], by, ascending, na_position, chunk_size, text_keys)
+
+
+#whether each sort column holds numbers or text, leaving out the columns with
+#no values, which could have been read either way
+def _key_kinds(df: pd.DataFrame, by: list[str]):
+    return {column: pd.api.types.is_numeric_dtype(df[column]) for column in by if df[column].notna().any()}
+
+
+#a column read as numbers in some chunks and as text in others is compared as
+#text, as it is when the whole file is read at once
+def _mixed_sort_keys(kinds: list[dict]):
+    numbers = {column for kind in kinds for column, is_number in kind.items() if is_number}
+    texts = {column for kind in kinds for column, is_number in kind.items() if not is_number}
+    return numbers & texts
+
+
+def _sort_key(column: pd.Series, as_text: bool):
+    if as_text:
+        column = column.astype(str).where(column.notna())
+    return column.to_numpy()
+
+
+#positions that sort the rows by their keys, then by where they were in the
+#input, so no two rows tie and the merge is stable whichever run they are in
+def _sort_order(df: pd.DataFrame, positions: np.ndarray, by: list[str], ascending: list[bool], na_position: str,
+                text_keys: set = frozenset()):
+    keys = pd.DataFrame({number: _sort_key(df[column], column in text_keys) for number, column in enumerate(by)})
+    keys[len(by)] = positions
+    return keys.sort_values(list(keys.columns), ascending=ascending + [True], na_position=na_position).index.to_numpy()
+
+
+#a run comes back with the kinds of its sort columns, so the merge can tell
+#which runs read a column as numbers and which as text
+def _spill_run(buffered, by, ascending, na_position, chunk_size: int, directory: str, number: int,
+               text_keys: set = None):
+    if text_keys is None:
+        text_keys = _mixed_sort_keys([_key_kinds(chunk, by) for chunk, _ in buffered])
+    df = pd.concat([chunk for chunk, _ in buffered], ignore_index=True)
+    positions = np.concatenate([positions for _, positions in buffered])
+    order = _sort_order(df, positions, by, ascending, na_position, text_keys)
+    df, positions = df.take(order), positions[order]
+    paths = []
+    for start in range(0, len(df), chunk_size):
+        path = os.path.join(directory, f"run_{number}_{len(paths)}.pkl")
+        pd.to_pickle((df.iloc[start:start + chunk_size], positions[start:start + chunk_size]), path)
+        paths.append(path)
+    return paths, _key_kinds(df, by)
+
+
+#k-way merge a block at a time. the pending rows are sorted together, and
+#every row up to the smallest last row loaded from a run that isn't finished
+#can go out, since whatever that run holds next sorts after it. the run it
+#came from has then had all its rows written, so its next block is loaded
+def _merge_runs(runs: list[list[str]], by, ascending, na_position, chunk_size: int, text_keys: set = frozenset()):
+    runs = [iter(paths) for paths in runs]
+    pending, pending_positions = [], []
+    last = {}
+    loading = range(len(runs))
+    written = 0
+    while True:
+        for number in loading:
+            path = next(runs[number], None)
+            if path is None:
+                continue
+            block, positions = pd.read_pickle(path)
+            os.remove(path)
+            pending.append(block)
+            pending_positions.append(positions)
+            last[number] = (block.iloc[-1:], positions[-1:])
+        df = pd.concat(pending, ignore_index=True)
+        positions = np.concatenate(pending_positions)
+        order = _sort_order(df, positions, by, ascending, na_position, text_keys)
+        finished = not last
+        if not finished:
+            numbers = list(last)
+            ends = pd.concat([last[number][0] for number in numbers], ignore_index=True)
+            first = _sort_order(ends, np.concatenate([last[number][1] for number in numbers]),
+                                by, ascending, na_position, text_keys)[0]
+            boundary = last.pop(numbers[first])[1][0]
+            loading = [numbers[first]]
+            stop = np.flatnonzero(positions[order] == boundary)[0] + 1
+        else:
+            stop = len(order)
+        for start in range(0, stop, chunk_size):
+            out = df.take(order[start:min(start + chunk_size, stop)])
+            out.index = pd.RangeIndex(written, written + len(out))
+            written += len(out)
+            yield out
+        if finished:
+            return
+        pending, pending_positions = [df.take(order[stop:])], [positions[order[stop:]]]
+
+
+#the chunked counterpart of run_pipeline: row-local stages run on each chunk
+#as it arrives and global stages use their stream strategy, all lazily
+def stream_pipeline(chunks, plan: list[Stage], trace: 'PipelineTrace' = None):
+    for stage in plan:
+        if stage.stream is not None:
+            chunks = stage.stream(chunks, *stage.args)
+        else:
+            chunks = map(partial(run_pipeline, plan=[stage]), chunks)
+        if trace is not None:
+            chunks = trace.chunks(stage.name, chunks)
+    return chunks
+
+
+#'object' reads text as Python strings. 'pyarrow' keeps text columns as
+#Arrow strings, with NaN for missing values as object columns have, so the
+#text steps run on Arrow's kernels
+STRING_ENGINES = ('object', 'pyarrow')
+STRING_ENGINE = os.environ.get("STRING_ENGINE", "object")
+
+#the CSV parser: pandas' own C parser or pyarrow's, which uses several
+#threads. unset, Arrow strings are parsed with pyarrow and the rest with C.
+#chunked reads always use the C parser, which is the only one that can
+CSV_ENGINES = ('c', 'pyarrow')
+CSV_ENGINE = os.environ.get("CSV_ENGINE")
+
+
+def _string_engine(engine: str = None):
+    engine = engine or STRING_ENGINE
+    if engine not in STRING_ENGINES:
+        raise ValueError(f"unknown string engine {engine!r}")
+    if engine == 'pyarrow' and pa is None:
+        raise ImportError("the pyarrow string engine needs pyarrow installed")
+    return engine
+
+
+def _csv_engine(engine: str = None, string_engine: str = 'object'):
+    engine = engine or CSV_ENGINE or ('pyarrow' if string_engine == 'pyarrow' else 'c')
+    if engine not in CSV_ENGINES:
+        raise ValueError(f"unknown CSV engine {engine!r}")
+    if engine == 'pyarrow' and pa is None:
+        raise ImportError("the pyarrow CSV engine needs pyarrow installed")
+    return engine
+
+
+#pandas before 2.1 only has Arrow strings with pd.NA for missing values
+def _arrow_string_dtype():
+    try:
+        return pd.StringDtype('pyarrow', na_value=np.nan)
+    except TypeError:
+        return pd.StringDtype('pyarrow')
+
+
+#how an upload is parsed: the CSV parser, how text is held, the dtypes of
+#some columns and the columns to read, None for all of them
+@dataclass
+class ReadOptions:
+    engine: str = None
+    string_engine: str = None
+    dtype: dict = None
+    usecols: list = None
+
+    def __post_init__(self):
+        self.string_engine = _string_engine(self.string_engine)
+        self.engine = _csv_engine(self.engine, self.string_engine)
+        for column, dtype in (self.dtype or {}).items():
+            pd.api.types.pandas_dtype(dtype)  # raises TypeError for unknown dtypes
+
+    def key(self):
+        return json.dumps(asdict(self), sort_keys=True)
+
+
+#gzip and zstd uploads are recognised by their first bytes and decompressed
+#while they are parsed, so the decompressed file is never held whole. zstd
+#is decoded by pyarrow
+GZIP_MAGIC = b'\x1f\x8b'
+ZSTD_MAGIC = b'\x28\xb5\x2f\xfd'
+
+
+#pyarrow closes the file it reads when its reader is closed. the upload is
+#read through this instead, so it stays open to be read again from the start
+class _KeepOpen(io.RawIOBase):
+    def __init__(self, file):
+        self.file = file
+
+    def readable(self):
+        return True
+
+    def readinto(self, buffer):
+        data = self.file.read(len(buffer))
+        buffer[:len(data)] = data
+        return len(data)
+
+
+def decompressed(file):
+    start = file.tell()
+    magic = file.read(4)
+    file.seek(start)
+    if magic.startswith(GZIP_MAGIC):
+        return gzip.GzipFile(fileobj=file, mode='rb')
+    if magic == ZSTD_MAGIC:
+        if pa is None:
+            raise ImportError("zstd uploads need pyarrow installed")
+        return pa.CompressedInputStream(pa.PythonFile(_KeepOpen(file), mode='r'), 'zstd')
+    return file
+
+
+#a column in usecols that the file does not have is a KeyError like any other
+#missing column, whichever parser would have read the file
+def _check_usecols(source, usecols: list = None):
+    if usecols is None:
+        return
+    start = source.tell()
+    header = pd.read_csv(decompressed(source), nrows=0).columns
+    source.seek(start)
+    missing = [column for column in usecols if column not in header]
+    if missing:
+        raise KeyError(missing[0] if len(missing) == 1 else missing)
+
+
+#with Arrow strings and the pyarrow parser every column is read as Arrow and
+#only the ones that are not text go back to numpy, so no Python string is
+#made. columns that are all empty come back as float NaN, as with the C parser
+def read_csv_frame(source, options: ReadOptions = None):
+    options = options or ReadOptions()
+    _check_usecols(source, options.usecols)
+    source = decompressed(source)
+    if options.engine == 'c' or options.string_engine == 'object':
+        df = pd.read_csv(source, engine=options.engine, dtype=options.dtype, usecols=options.usecols)
+        return df if options.string_engine == 'object' else with_arrow_strings(df)
+    df = pd.read_csv(source, engine='pyarrow', dtype_backend='pyarrow', dtype=options.dtype, usecols=options.usecols)
+    table = pa.Table.from_pandas(df, preserve_index=False)
+    table = table.cast(pa.schema([
+        column.with_type(pa.float64()) if pa.types.is_null(column.type) else column for column in table.schema
+    ]))
+    dtype = _arrow_string_dtype()
+    return table.to_pandas(types_mapper={pa.string(): dtype, pa.large_string(): dtype}.get)
+
+
+def read_csv_chunks(file, chunk_size: int, options: ReadOptions = None):
+    options = options or ReadOptions()
+    _check_usecols(file, options.usecols)
+    return pd.read_csv(decompressed(file), chunksize=chunk_size, dtype=options.dtype, usecols=options.usecols)
+
+
+#text columns read by the C parser are converted after parsing
+def with_arrow_strings(df: pd.DataFrame):
+    dtype = _arrow_string_dtype()
+    for position in np.flatnonzero((df.dtypes == object).to_numpy()):
+        column = df.iloc[:, position]
+        if pd.api.types.infer_dtype(column, skipna=True) == 'string':
+            df.isetitem(position, column.astype(dtype))
     return df
 
 
+def read_and_run(content: bytes, plan: list[Stage], trace: 'PipelineTrace' = None, options: ReadOptions = None):
+    if trace is None:
+        df = read_csv_frame(io.BytesIO(content), options)
+    else:
+        df = trace.run('read_csv', None, read_csv_frame, io.BytesIO(content), options)
+    return run_pipeline(df, plan, trace)
+
+
+#rows per chunk when an in-memory result is written out
+OUTPUT_CHUNK_ROWS = 100_000
+
+
+def frame_chunks(df: pd.DataFrame, chunk_size: int = OUTPUT_CHUNK_ROWS):
+    for start in range(0, len(df), chunk_size):
+        yield df.iloc[start:start + chunk_size]
+    if len(df) == 0:
+        yield df
+
+
+def write_csv(chunks):
+    header = True
+    for chunk in chunks:
+        yield chunk.to_csv(index=False, header=header).encode()
+        header = False
+
+
+def write_csv_gz(chunks):
+    compressor = zlib.compressobj(wbits=31)
+    for data in write_csv(chunks):
+        yield compressor.compress(data)
+    yield compressor.flush()
+
+
+#a write-only file that hands back whatever pyarrow has written so far, so
+#each chunk can be sent as soon as it is serialised
+class _ByteSink(io.RawIOBase):
+    def __init__(self):
+        self.parts = []
+        self.position = 0
+
+    def writable(self):
+        return True
+
+    def write(self, data):
+        self.parts.append(bytes(data))
+        self.position += len(data)
+        return len(data)
+
+    def tell(self):
+        return self.position
+
+    def drain(self):
+        data = b''.join(self.parts)
+        self.parts = []
+        return data
+
+
+#one schema has to cover the whole file, but each chunk parses its own types.
+#the first chunk fixes them, with columns it has no values in as strings, and
+#every later chunk is cast to them as it comes, so nothing waits for the end
+#of the file. a chunk that can't be cast, like text in a column of numbers,
+#fails and names the column to give a type in dtypes
+def _arrow_tables(chunks):
+    schema = None
+    for chunk in chunks:
+        table = pa.Table.from_pandas(chunk, preserve_index=False)
+        if schema is None:
+            schema = pa.schema([
+                field.with_type(pa.string()) if column.null_count == len(column) else field
+                for field, column in zip(table.schema, table.columns)
+            ], metadata=table.schema.metadata)
+        yield _cast_table(table, schema)
+
+
+def _cast_table(table, schema):
+    columns = []
+    for field, column in zip(schema, table.columns):
+        try:
+            columns.append(column.cast(field.type))
+        except (pa.ArrowInvalid, pa.ArrowNotImplementedError, pa.ArrowTypeError):
+            raise ValueError(f"column {field.name!r} is {field.type} in the first chunk but {column.type} in a later one, "
+                             "set its type with dtypes")
+    return pa.Table.from_arrays(columns, schema=schema)
+
+
+def write_parquet(chunks):
+    sink = _ByteSink()
+    writer = None
+    for table in _arrow_tables(chunks):
+        if writer is None:
+            writer = pq.ParquetWriter(sink, table.schema)
+        writer.write_table(table)
+        yield sink.drain()
+    if writer is not None:
+        writer.close()
+    yield sink.drain()
+
+
+def write_arrow(chunks):
+    sink = _ByteSink()
+    writer = None
+    for table in _arrow_tables(chunks):
+        if writer is None:
+            writer = pa.ipc.new_stream(sink, table.schema)
+        writer.write_table(table)
+        yield sink.drain()
+    if writer is not None:
+        writer.close()
+    yield sink.drain()
+
+
+#output format: (writer, media type, file extension, needs pyarrow)
+OUTPUT_FORMATS = {
+    'csv': (write_csv, 'text/csv', 'csv', False),
+    'csv.gz': (write_csv_gz, 'application/gzip', 'csv.gz', False),
+    'parquet': (write_parquet, 'application/vnd.apache.parquet', 'parquet', True),
+    'arrow': (write_arrow, 'application/vnd.apache.arrow.stream', 'arrow', True),
+}
+
+
+#the chain is built straight away so a trace registers its stages in order;
+#the reader is closed once the chunks run out
+def stream_upload(file, plan: list[Stage], chunk_size: int, trace: 'PipelineTrace' = None, options: ReadOptions = None):
+    options = options or ReadOptions()
+    reader = read_csv_chunks(file, chunk_size, options)
+    chunks = reader if options.string_engine == 'object' else map(with_arrow_strings, reader)
+    chunks = chunks if trace is None else trace.chunks('read_csv', chunks)
+    return _closing(stream_pipeline(chunks, plan, trace), reader)
+
+
+def _closing(chunks, reader):
+    with reader:
+        yield from chunks
+
+
+_DONE = object()
+
+
+#a bounded set of pipeline threads with an admission limit: `workers` jobs run
+#at once, up to `queue_size` more wait for a thread and anything past that is
+#turned away with a 429 instead of piling up
+class PipelinePool:
+    def __init__(self, name: str, workers: int, queue_size: int):
+        self.executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix=name)
+        self.limit = workers + queue_size
+        self.active = 0
+
+    #admit and release are only called from the event loop, so the counter
+    #needs no lock
+    def admit(self):
+        if self.active >= self.limit:
+            raise HTTPException(
+                status_code=429,
+                detail="Too many uploads are being processed, try again later",
+                headers={"Retry-After": "1"},
+            )
+        self.active += 1
+
+    def release(self):
+        self.active -= 1
+
+    async def run(self, func, *args):
+        return await asyncio.get_running_loop().run_in_executor(self.executor, partial(func, *args))
+
+    #drives a blocking iterator from the pool; the admission slot is handed
+    #back by PooledStreamingResponse, since a body that is never started
+    #never runs its own finally
+    async def iterate(self, iterator):
+        while True:
+            item = await self.run(next, iterator, _DONE)
+            if item is _DONE:
+                break
+            yield item
+
+
+#releases the pool's admission slot, and finishes the upload's trace, however
+#the response ends: the body runs out, fails or the client goes away before
+#it is started
+class PooledStreamingResponse(StreamingResponse):
+    def __init__(self, content, pool: PipelinePool, trace: 'PipelineTrace' = None, **kwargs):
+        super().__init__(content, **kwargs)
+        self.pool = pool
+        self.trace = trace
+
+    async def __call__(self, scope, receive, send):
+        try:
+            await super().__call__(scope, receive, send)
+        finally:
+            self.pool.release()
+            if self.trace is not None:
+                self.trace.finish()
+
+
+#small uploads get their own threads so they are not stuck behind big jobs
+SMALL_UPLOAD_BYTES = 1024 * 1024
+SMALL_UPLOADS = PipelinePool("small-upload", 2, 32)
+LARGE_UPLOADS = PipelinePool(
+    "large-upload",
+    int(os.environ.get("PIPELINE_WORKERS", 2)),
+    int(os.environ.get("PIPELINE_QUEUE", 4)),
+)
+
+
+#deep memory_usage walks every string, so the size of a big frame is
+#estimated from evenly spaced rows
+FRAME_SIZE_SAMPLE_ROWS = 1000
+
+
+def frame_bytes(df: pd.DataFrame):
+    if len(df) <= FRAME_SIZE_SAMPLE_ROWS:
+        return int(df.memory_usage(deep=True).sum())
+    sample = df.iloc[::len(df) // FRAME_SIZE_SAMPLE_ROWS]
+    size = sample.memory_usage(deep=True, index=False).sum() * len(df) / len(sample)
+    return int(size + df.index.memory_usage())
+
+
+#profiles are kept out of the shared temp directory, readable by the server's
+#user only
+PROFILE_DIR = os.environ.get("PROFILE_DIR", os.path.join(tempfile.gettempdir(), f"preprocessing-profiles-{os.getuid()}"))
+#tracemalloc is process wide, so one debug upload at a time traces memory and
+#the others leave allocated_bytes out
+_TRACE_LOCK = threading.Lock()
+_SERVER_TIMING_INVALID = re.compile(r"[^!#$%&'*+\-.^_`|~0-9A-Za-z]")
+
+
+#seconds, rows in and out, and bytes out of every stage of one upload. bytes
+#are the estimated frame size, or what a writer produced. with debug the
+#stages also record the peak bytes tracemalloc saw them allocate, which slows
+#text stages down several times, and the run is profiled with cProfile into
+#a .prof file in PROFILE_DIR. responses name the file, not where it is
+class PipelineTrace:
+    def __init__(self, debug: bool = False):
+        self.debug = debug
+        self._entries = []
+        self._finished = False
+        self._started_tracing = False
+        self._traces_memory = None
+        self.profiler = cProfile.Profile() if debug else None
+        self.profile_name = f"upload-{uuid.uuid4().hex}.prof" if debug else None
+
+    def _start_allocations(self):
+        if not self.debug:
+            return None
+        if self._traces_memory is None:
+            self._traces_memory = _TRACE_LOCK.acquire(blocking=False)
+            if self._traces_memory and not tracemalloc.is_tracing():
+                tracemalloc.start()
+                self._started_tracing = True
+        if not self._traces_memory:
+            return None
+        tracemalloc.reset_peak()
+        return tracemalloc.get_traced_memory()[0]
+
+    def _allocated(self, before):
+        if before is None:
+            return None
+        return max(tracemalloc.get_traced_memory()[1] - before, 0)
+
+    def _add(self, name: str, rows_in, **values):
+        entry = {'stage': name, 'seconds': 0.0, 'rows_in': rows_in, 'rows_out': 0, 'bytes': 0, **values}
+        if self.debug:
+            entry.setdefault('allocated_bytes', 0)
+        self._entries.append(entry)
+        return entry
+
+    #times func(*args) as one stage that turns rows_in rows into a frame
+    def run(self, name: str, rows_in, func, *args):
+        before = self._start_allocations()
+        start = time.perf_counter()
+        df = func(*args)
+        self._add(
+            name, rows_in,
+            seconds=time.perf_counter() - start,
+            rows_out=len(df),
+            bytes=frame_bytes(df),
+            **({'allocated_bytes': self._allocated(before)} if self.debug else {}),
+        )
+        return df
+
+    #a streamed stage only sees the time spent producing its chunks, which
+    #includes every stage upstream, so its own time is worked out in stages
+    def chunks(self, name: str, chunks):
+        #registered here rather than on the first chunk, which reaches the
+        #outermost stage first
+        return self._timed_chunks(self._add(name, None, cumulative=True), chunks)
+
+    def _timed_chunks(self, entry: dict, chunks):
+        iterator = iter(chunks)
+        while True:
+            before = self._start_allocations()
+            start = time.perf_counter()
+            chunk = next(iterator, _DONE)
+            entry['seconds'] += time.perf_counter() - start
+            if before is not None:
+                entry['allocated_bytes'] = max(entry['allocated_bytes'], self._allocated(before))
+            if chunk is _DONE:
+                return
+            if isinstance(chunk, pd.DataFrame):
+                entry['rows_out'] += len(chunk)
+                entry['bytes'] += frame_bytes(chunk)
+            else:
+                entry['rows_out'] = None
+                entry['bytes'] += len(chunk)
+            yield chunk
+
+    @property
+    def stages(self):
+        stages = []
+        upstream_seconds = 0.0
+        for entry in self._entries:
+            stage = dict(entry)
+            if stage.pop('cumulative', False):
+                stage['seconds'], upstream_seconds = stage['seconds'] - upstream_seconds, stage['seconds']
+            if stage['rows_in'] is None and stages:
+                stage['rows_in'] = stages[-1]['rows_out']
+            if stage['rows_out'] is None:
+                stage['rows_out'] = stage['rows_in']
+            stage['seconds'] = round(max(stage['seconds'], 0.0), 6)
+            if self.debug and not self._traces_memory:
+                stage['allocated_bytes'] = None
+            stages.append(stage)
+        return stages
+
+    #Server-Timing shows up in browser devtools; the JSON has the rest.
+    #metric names there are HTTP tokens, column names need not be
+    def headers(self):
+        stages = self.stages
+        headers = {
+            "Server-Timing": ", ".join(
+                f"{_SERVER_TIMING_INVALID.sub('_', s['stage'])};dur={s['seconds'] * 1000:.1f}" for s in stages
+            ),
+            "X-Pipeline-Metrics": json.dumps(stages),
+        }
+        if self.debug:
+            headers["X-Pipeline-Profile"] = self.profile_name
+        return headers
+
+    def profiled(self, func):
+        if self.profiler is None:
+            return func
+
+        def run(*args):
+            self.profiler.enable()
+            try:
+                return func(*args)
+            finally:
+                self.profiler.disable()
+        return run
+
+    #chunks are produced from whichever pool thread picks them up, and the
+    #profiler only sees the thread it was enabled in, so it is enabled per chunk
+    def profiled_chunks(self, chunks):
+        if self.profiler is None:
+            yield from chunks
+            return
+        iterator = iter(chunks)
+        while True:
+            chunk = self.profiled(next)(iterator, _DONE)
+            if chunk is _DONE:
+                return
+            yield chunk
+
+    def finish_after(self, chunks):
+        try:
+            yield from chunks
+        finally:
+            self.finish()
+
+    #adds the stages to the /metrics histograms, once
+    def finish(self):
+        if self._finished:
+            return
+        self._finished = True
+        if self._started_tracing:
+            tracemalloc.stop()
+        if self._traces_memory:
+            _TRACE_LOCK.release()
+        if self.profiler is not None:
+            self.profiler.dump_stats(os.path.join(private_directory(PROFILE_DIR), self.profile_name))
+        for stage in self.stages:
+            STAGE_METRICS.observe(stage)
+
+
+#the operations a stage name is made of, in a fixed order and once each:
+#"title:to_lower+remove_spaces|city:to_lower" is "remove_spaces+to_lower"
+def stage_label(name: str):
+    known = set(OPERATIONS) | {'read_csv'} | {f"write_{output_format}" for output_format in OUTPUT_FORMATS}
+    operations = sorted(set(re.findall(r"[a-z_.]+", name)) & known)
+    return '+'.join(operations) or 'other'
+
+
+#a Prometheus histogram with one series per stage
+class Histogram:
+    def __init__(self, name: str, description: str, buckets: list):
+        self.name = name
+        self.description = description
+        self.buckets = buckets
+        self._series = {}
+        self._lock = threading.Lock()
+
+    def observe(self, stage: str, value: float):
+        with self._lock:
+            counts, total = self._series.get(stage, ([0] * (len(self.buckets) + 1), 0))
+            counts[bisect.bisect_left(self.buckets, value)] += 1
+            self._series[stage] = (counts, total + value)
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.description}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            series = sorted((stage, list(counts), total) for stage, (counts, total) in self._series.items())
+        for stage, counts, total in series:
+            label = stage.replace('\\', '\\\\').replace('"', '\\"')
+            cumulative = 0
+            for bound, count in zip(self.buckets + ['+Inf'], counts):
+                cumulative += count
+                lines.append(f'{self.name}_bucket{{stage="{label}",le="{bound}"}} {cumulative}')
+            lines.append(f'{self.name}_sum{{stage="{label}"}} {total}')
+            lines.append(f'{self.name}_count{{stage="{label}"}} {cumulative}')
+        return "\n".join(lines) + "\n"
+
+
+class StageMetrics:
+    def __init__(self):
+        self.histograms = {
+            'seconds': Histogram(
+                "preprocessing_stage_seconds", "Time spent in each pipeline stage.",
+                [0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1, 5, 10, 30, 60, 300],
+            ),
+            'rows_out': Histogram(
+                "preprocessing_stage_rows", "Rows coming out of each pipeline stage.",
+                [10 ** power for power in range(8)],
+            ),
+            'bytes': Histogram(
+                "preprocessing_stage_bytes", "Estimated frame size, or bytes written, after each pipeline stage.",
+                [4 ** power * 1024 for power in range(13)],
+            ),
+        }
+
+    #stage names can hold column names, which would make a series per column,
+    #so a stage is labelled by the operations in it alone
+    def observe(self, stage: dict):
+        label = stage_label(stage['stage'])
+        for key, histogram in self.histograms.items():
+            if stage[key] is not None:
+                histogram.observe(label, stage[key])
+
+    def render(self):
+        return "".join(histogram.render() for histogram in self.histograms.values())
+
+
+STAGE_METRICS = StageMetrics()
+
+
+def _download_headers(output_format: str, filename: str):
+    extension = OUTPUT_FORMATS[output_format][2]
+    name = os.path.splitext(os.path.basename(filename or 'output'))[0]
+    return {"Content-Disposition": f'attachment; filename="{name}.{extension}"'}
+
+
+async def output_response(
+        chunks, output_format: str, filename: str, pool: PipelinePool,
+        trace: PipelineTrace = None, headers: dict = None, cache_key: str = None
+):
+    writer, media_type, extension, needs_pyarrow = OUTPUT_FORMATS[output_format]
+    body = writer(chunks)
+    if trace is not None:
+        body = trace.finish_after(trace.profiled_chunks(trace.chunks(f"write_{output_format}", body)))
+    if cache_key is not None:
+        body = RESULT_CACHE.tee(cache_key, body)
+    #the first piece is made before the status goes out, so a column missing
+    #from a streamed file is still answered with a 400
+    try:
+        first = await pool.run(next, body, _DONE)
+    except KeyError as error:
+        raise _missing_column(error)
+    if first is not _DONE:
+        body = itertools.chain([first], body)
+    return PooledStreamingResponse(
+        pool.iterate(body),
+        pool,
+        trace,
+        media_type=media_type,
+        headers={**(headers or {}), **_download_headers(output_format, filename)},
+    )
+
+
+def _missing_column(error: KeyError):
+    return HTTPException(status_code=400, detail=f"column {error} is not in the file")
+
+
+#finished responses by upload and pipeline. the memory tier keeps the most
+#recently used bodies up to memory_bytes in total; the optional disk tier
+#keeps them as files in directory up to disk_bytes, dropping the least
+#recently used first. a hit is sent back as stored, nothing is parsed again
+class ResultCache:
+    def __init__(self, memory_bytes: int, directory: str = None, disk_bytes: int = 0):
+        self.memory_bytes = memory_bytes
+        self.directory = directory
+        self.disk_bytes = disk_bytes
+        self.hits = {'memory': 0, 'disk': 0}
+        self.misses = 0
+        self._memory = OrderedDict()
+        self._memory_size = 0
+        self._lock = threading.Lock()
+        if directory:
+            private_directory(directory)
+
+    @staticmethod
+    def key(content_hash: str, pipeline_id: str, *params):
+        return hashlib.sha256(':'.join(map(str, (content_hash, pipeline_id, *params))).encode()).hexdigest()
+
+    def _path(self, key: str):
+        return os.path.join(self.directory, key)
+
+    #the body as bytes from memory, the path of its file on disk, or None
+    def get(self, key: str):
+        with self._lock:
+            if key in self._memory:
+                self._memory.move_to_end(key)
+                self.hits['memory'] += 1
+                return self._memory[key]
+        if self.directory:
+            try:
+                os.utime(self._path(key))
+                with self._lock:
+                    self.hits['disk'] += 1
+                return self._path(key)
+            except FileNotFoundError:
+                pass
+        with self._lock:
+            self.misses += 1
+        return None
+
+    def put(self, key: str, body: bytes):
+        if len(body) <= self.memory_bytes:
+            with self._lock:
+                if key in self._memory:
+                    self._memory_size -= len(self._memory.pop(key))
+                self._memory[key] = body
+                self._memory_size += len(body)
+                while self._memory_size > self.memory_bytes:
+                    self._memory_size -= len(self._memory.popitem(last=False)[1])
+        if self.directory:
+            with tempfile.NamedTemporaryFile(dir=self.directory, suffix='.part', delete=False) as file:
+                file.write(body)
+            self._store_file(key, file.name)
+
+    #passes the body through while keeping a copy, which is stored only once
+    #the body is complete. bodies too big for memory are written straight to
+    #a file when there is a disk tier, and not cached otherwise. a body that
+    #fails or is left by the client takes its part file with it
+    def tee(self, key: str, chunks):
+        kept = []
+        kept_size = 0
+        file = None
+        try:
+            for chunk in chunks:
+                if kept is not None:
+                    kept.append(chunk)
+                    kept_size += len(chunk)
+                    if kept_size > self.memory_bytes:
+                        if self.directory:
+                            file = tempfile.NamedTemporaryFile(dir=self.directory, suffix='.part', delete=False)
+                            file.writelines(kept)
+                        kept = None
+                elif file is not None:
+                    file.write(chunk)
+                yield chunk
+            if kept is not None:
+                self.put(key, b''.join(kept))
+            elif file is not None:
+                file.close()
+                self._store_file(key, file.name)
+                file = None
+        finally:
+            if file is not None:
+                file.close()
+                with contextlib.suppress(FileNotFoundError):
+                    os.remove(file.name)
+
+    def _store_file(self, key: str, part_path: str):
+        os.replace(part_path, self._path(key))
+        files = []
+        for entry in os.scandir(self.directory):
+            if entry.is_file() and not entry.name.endswith('.part'):
+                stat = entry.stat()
+                files.append((stat.st_mtime, stat.st_size, entry.path))
+        total = sum(size for _, size, _ in files)
+        for _, size, path in sorted(files):
+            if total <= self.disk_bytes:
+                break
+            with contextlib.suppress(FileNotFoundError):
+                os.remove(path)
+            total -= size
+
+    def render(self):
+        lines = [
+            "# HELP preprocessing_result_cache_hits_total Uploads answered from the result cache.",
+            "# TYPE preprocessing_result_cache_hits_total counter",
+        ]
+        with self._lock:
+            lines += [f'preprocessing_result_cache_hits_total{{tier="{tier}"}} {count}' for tier, count in self.hits.items()]
+            lines += [
+                "# HELP preprocessing_result_cache_misses_total Uploads that had to be processed.",
+                "# TYPE preprocessing_result_cache_misses_total counter",
+                f"preprocessing_result_cache_misses_total {self.misses}",
+                "# HELP preprocessing_result_cache_memory_bytes Bytes held by the memory tier.",
+                "# TYPE preprocessing_result_cache_memory_bytes gauge",
+                f"preprocessing_result_cache_memory_bytes {self._memory_size}",
+            ]
+        return "\n".join(lines) + "\n"
+
+
+RESULT_CACHE = ResultCache(
+    int(os.environ.get("RESULT_CACHE_BYTES", 256 * 1024 * 1024)),
+    os.environ.get("RESULT_CACHE_DIR"),
+    int(os.environ.get("RESULT_CACHE_DISK_BYTES", 10 * 1024 ** 3)),
+)
+
+
+def _hash_file(file, block_size: int = 1 << 20):
+    digest = hashlib.sha256()
+    file.seek(0)
+    for block in iter(partial(file.read, block_size), b''):
+        digest.update(block)
+    file.seek(0)
+    return digest.hexdigest()
+
+
+def cached_response(key: str, output_format: str, filename: str):
+    cached = RESULT_CACHE.get(key)
+    if cached is None:
+        return None
+    headers = {"X-Cache": "hit"}
+    if output_format is None:
+        return JSONResponse({"success": True}, headers=headers)
+    headers.update(_download_headers(output_format, filename))
+    media_type = OUTPUT_FORMATS[output_format][1]
+    if isinstance(cached, bytes):
+        return Response(cached, media_type=media_type, headers=headers)
+    return FileResponse(cached, media_type=media_type, headers=headers)
+
+
+
+#uploads too big to hold a connection open for are run as jobs: the file is
+#spooled to JOB_DIR, streamed through the plan in chunks by a background
+#thread and the output written next to it for GET /jobs/{id}/result. uploads
+#and results are private to the server's user
+JOB_DIR = os.environ.get("JOB_DIR", os.path.join(tempfile.gettempdir(), f"preprocessing-jobs-{os.getuid()}"))
+JOB_CHUNK_ROWS = 100_000
+
+
+class Job:
+    def __init__(self, plan: list[Stage], chunk_size: int, output_format: str, filename: str, options: ReadOptions = None):
+        self.id = uuid.uuid4().hex
+        self.plan = plan
+        self.chunk_size = chunk_size
+        self.output_format = output_format
+        self.filename = filename
+        self.options = options or ReadOptions()
+        self.total_bytes = 0
+        self.status = 'queued'
+        self.error = None
+        self.chunks_done = 0
+        self.rows_processed = 0
+        self.bytes_read = 0
+        self.started = None
+        self.finished = None
+        self.directory = os.path.join(JOB_DIR, self.id)
+        self.input_path = os.path.join(self.directory, 'input.csv')
+        self.result_path = os.path.join(self.directory, f"result.{OUTPUT_FORMATS[output_format][2]}")
+
+    #chunks are pulled through the whole plan one at a time, so a chunk is
+    #counted once the one before it has been processed and written
+    def _counted(self, chunks, file):
+        for chunk in chunks:
+            self.chunks_done += 1
+            self.rows_processed += len(chunk)
+            self.bytes_read = file.tell()
+            yield chunk
+
+    def run(self):
+        self.status = 'running'
+        self.started = time.time()
+        trace = PipelineTrace()
+        part_path = self.result_path + '.part'
+        try:
+            with open(self.input_path, 'rb') as file, read_csv_chunks(file, self.chunk_size, self.options) as reader:
+                chunks = self._counted(reader, file)
+                if self.options.string_engine == 'pyarrow':
+                    chunks = map(with_arrow_strings, chunks)
+                chunks = trace.chunks('read_csv', chunks)
+                body = OUTPUT_FORMATS[self.output_format][0](stream_pipeline(chunks, self.plan, trace))
+                with open(part_path, 'wb') as output:
+                    output.writelines(body)
+            os.replace(part_path, self.result_path)
+            self.bytes_read = self.total_bytes
+            self.status = 'done'
+        except Exception as error:
+            self.status = 'failed'
+            self.error = str(error)
+            with contextlib.suppress(FileNotFoundError):
+                os.remove(part_path)
+        finally:
+            self.finished = time.time()
+            with contextlib.suppress(FileNotFoundError):
+                os.remove(self.input_path)
+            trace.finish()
+
+    def progress(self):
+        elapsed = 0.0
+        if self.started is not None:
+            elapsed = (self.finished or time.time()) - self.started
+        return {
+            "job_id": self.id,
+            "status": self.status,
+            "error": self.error,
+            "chunks_done": self.chunks_done,
+            "rows_processed": self.rows_processed,
+            "bytes_read": self.bytes_read,
+            "total_bytes": self.total_bytes,
+            "progress": round(self.bytes_read / self.total_bytes, 4) if self.total_bytes else None,
+            "seconds": round(elapsed, 3),
+            "rows_per_second": round(self.rows_processed / elapsed, 1) if elapsed else None,
+        }
+
+
+#jobs run `workers` at a time; past `queue_size` waiting jobs new ones are
+#turned away with a 429. the `history` most recent finished jobs are kept,
+#older ones are dropped with their output
+class JobQueue:
+    def __init__(self, workers: int, queue_size: int, history: int):
+        self.executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="job")
+        self.queue_size = queue_size
+        self.history = history
+        self._jobs = OrderedDict()
+        self._lock = threading.Lock()
+
+    #turns a job away before its upload is copied to disk
+    def check_capacity(self):
+        with self._lock:
+            self._check_capacity()
+
+    def _check_capacity(self):
+        if sum(queued.status == 'queued' for queued in self._jobs.values()) >= self.queue_size:
+            raise HTTPException(
+                status_code=429,
+                detail="Too many jobs are waiting, try again later",
+                headers={"Retry-After": "10"},
+            )
+
+    #the queue can fill up while the upload is copied, the copy is then removed
+    def submit(self, job: Job):
+        with self._lock:
+            try:
+                self._check_capacity()
+            except HTTPException:
+                shutil.rmtree(job.directory, ignore_errors=True)
+                raise
+            self._jobs[job.id] = job
+            finished = [old for old in self._jobs.values() if old.finished is not None]
+            for old in finished[:max(len(finished) - self.history, 0)]:
+                del self._jobs[old.id]
+                shutil.rmtree(old.directory, ignore_errors=True)
+        self.executor.submit(job.run)
+
+    def get(self, job_id: str):
+        with self._lock:
+            return self._jobs.get(job_id)
+
+
+JOBS = JobQueue(
+    int(os.environ.get("JOB_WORKERS", 1)),
+    int(os.environ.get("JOB_QUEUE", 16)),
+    int(os.environ.get("JOB_HISTORY", 100)),
+)
+
+
+def _spool(file, path: str):
+    file.seek(0)
+    with open(path, 'wb') as output:
+        shutil.copyfileobj(file, output, 1 << 20)
+
+
+#the flags name the whole column_name list, each of their operations runs on
+#every listed column
+def _expand_columns(operations: list[tuple[str, dict]]):
+    expanded = []
+    for name, kwargs in operations:
+        columns = kwargs.get('column_name')
+        if isinstance(columns, list):
+            expanded += [(name, {**kwargs, 'column_name': column}) for column in columns]
+        else:
+            expanded.append((name, kwargs))
+    return expanded
+
+
+#column_operations maps columns to lists of operations, each an operation name
+#or an object with "operation" and its arguments:
+#  {"title": ["remove_spaces", {"operation": "replace_chars", "chars_to_be_replaced": ["-"], "char_to_replace": " "}]}
+def parse_column_operations(spec: str):
+    try:
+        columns = json.loads(spec)
+    except json.JSONDecodeError as error:
+        raise HTTPException(status_code=400, detail=f"column_operations is not valid JSON: {error}")
+    if not isinstance(columns, dict) or not all(isinstance(entries, list) for entries in columns.values()):
+        raise HTTPException(status_code=400, detail="column_operations must map column names to lists of operations")
+
+    steps = []
+    for column, entries in columns.items():
+        for entry in entries:
+            if isinstance(entry, str):
+                entry = {'operation': entry}
+            if not isinstance(entry, dict):
+                raise HTTPException(status_code=400, detail=f"unknown operation {entry!r} for column {column!r}")
+            arguments = {key: value for key, value in entry.items() if key != 'operation'}
+            try:
+                steps.append(PipelineStep(operation=entry.get('operation'), column_name=column, arguments=arguments))
+            except ValidationError as error:
+                raise HTTPException(status_code=400, detail=_validation_message(error))
+    return steps
+
+
+#dtypes maps column names to dtype names: {"id": "int32", "title": "string"}
+def parse_read_options(csv_engine: str = None, string_engine: str = None, dtypes: str = None, usecols: list = None):
+    dtype = None
+    if dtypes is not None:
+        try:
+            dtype = json.loads(dtypes)
+        except json.JSONDecodeError as error:
+            raise HTTPException(status_code=400, detail=f"dtypes is not valid JSON: {error}")
+        if not isinstance(dtype, dict) or not all(isinstance(name, str) for name in dtype.values()):
+            raise HTTPException(status_code=400, detail="dtypes must map column names to dtype names")
+    try:
+        return ReadOptions(csv_engine, string_engine, dtype, usecols)
+    except (TypeError, ValueError, ImportError) as error:
+        raise HTTPException(status_code=400, detail=str(error))
+
+
+def _validation_message(error: ValidationError):
+    return "; ".join(detail['msg'] for detail in error.errors())
+
 
 @app.get("/")
 def index():
     return {"Home page": "Welcome"}
 
 
+@app.get("/metrics")
+def metrics():
+    return PlainTextResponse(STAGE_METRICS.render() + RESULT_CACHE.render(), media_type="text/plain; version=0.0.4")
+
+
+#compiles the steps once and keeps the plan, ready to run with its id
+@app.post("/pipelines")
+async def create_pipeline(spec: PipelineSpec):
+    try:
+        pipeline_id, plan = PIPELINES.add(spec)
+    except ModelUnavailable as error:
+        raise HTTPException(status_code=503, detail=str(error))
+    except (TypeError, ValueError, ImportError) as error:
+        raise HTTPException(status_code=422, detail=str(error))
+    await asyncio.get_running_loop().run_in_executor(None, prepare_plan, plan)
+    return {"pipeline_id": pipeline_id, "stages": [stage.name for stage in plan]}
+
+
+@app.get("/pipelines/{pipeline_id}")
+def get_pipeline(pipeline_id: str):
+    pipeline = PIPELINES.get(pipeline_id)
+    if pipeline is None:
+        raise HTTPException(status_code=404, detail="Unknown pipeline, create it with POST /pipelines")
+    return pipeline[0]
+
+
+@app.post("/pipelines/{pipeline_id}/run")
+async def run_saved_pipeline(
+    pipeline_id: str,
+    file: UploadFile,
+    chunk_size: Annotated[int | None, Query(gt = 0, description = "Enter the number of rows per chunk to stream the file through the pipeline")] = None,
+    output_format: Annotated[Literal['csv', 'csv.gz', 'parquet', 'arrow'] | None, Query(description = "Enter csv, csv.gz, parquet or arrow to download the processed file")] = None,
+    debug: Annotated[bool | None, Query(description = "Enter true or false for tracing allocations and profiling the upload")] = None,
+    string_engine: Annotated[Literal['object', 'pyarrow'] | None, Query(description = "Enter object or pyarrow as the way text columns are held and processed")] = None,
+    csv_engine: Annotated[Literal['c', 'pyarrow'] | None, Query(description = "Enter c or pyarrow as the CSV parser")] = None,
+    dtypes: Annotated[str | None, Form(description = "JSON map of column names to the dtypes to read them as")] = None,
+    usecols: Annotated[list[str] | None, Query(description = "Enter the columns to read, the others are left out")] = None,
+    ):
+    pipeline = PIPELINES.get(pipeline_id)
+    if pipeline is None:
+        raise HTTPException(status_code=404, detail="Unknown pipeline, create it with POST /pipelines")
+    options = parse_read_options(csv_engine, string_engine, dtypes, usecols)
+    return await process_upload(file, pipeline[1], chunk_size, output_format, debug, pipeline_id, options)
+
+
+#takes the pipeline as a saved pipeline_id or as a JSON list of steps, and
+#returns the job id as soon as the file is on disk
+@app.post("/jobs", status_code=202)
+async def create_job(
+    file: UploadFile,
+    pipeline_id: Annotated[str | None, Form(description = "Id of a pipeline created with POST /pipelines")] = None,
+    steps: Annotated[str | None, Form(description = "JSON list of pipeline steps, as in POST /pipelines")] = None,
+    chunk_size: Annotated[int, Query(gt = 0, description = "Enter the number of rows per chunk to stream the file through the pipeline")] = JOB_CHUNK_ROWS,
+    output_format: Annotated[Literal['csv', 'csv.gz', 'parquet', 'arrow'], Query(description = "Enter csv, csv.gz, parquet or arrow as the format of the result")] = 'csv',
+    string_engine: Annotated[Literal['object', 'pyarrow'] | None, Query(description = "Enter object or pyarrow as the way text columns are held and processed")] = None,
+    csv_engine: Annotated[Literal['c', 'pyarrow'] | None, Query(description = "Enter c or pyarrow as the CSV parser")] = None,
+    dtypes: Annotated[str | None, Form(description = "JSON map of column names to the dtypes to read them as")] = None,
+    usecols: Annotated[list[str] | None, Query(description = "Enter the columns to read, the others are left out")] = None,
+    ):
+    if (pipeline_id is None) == (steps is None):
+        raise HTTPException(status_code=400, detail="give either pipeline_id or steps")
+    if OUTPUT_FORMATS[output_format][3] and pa is None:
+        raise HTTPException(status_code=400, detail=f"{output_format} output needs pyarrow installed")
+    options = parse_read_options(csv_engine, string_engine, dtypes, usecols)
+    if pipeline_id is not None:
+        pipeline = PIPELINES.get(pipeline_id)
+        if pipeline is None:
+            raise HTTPException(status_code=404, detail="Unknown pipeline, create it with POST /pipelines")
+        plan = pipeline[1]
+    else:
+        try:
+            spec = PipelineSpec(steps=json.loads(steps))
+        except json.JSONDecodeError as error:
+            raise HTTPException(status_code=400, detail=f"steps is not valid JSON: {error}")
+        except ValidationError as error:
+            raise HTTPException(status_code=422, detail=_validation_message(error))
+        try:
+            plan = PIPELINES.add(spec)[1]
+        except ModelUnavailable as error:
+            raise HTTPException(status_code=503, detail=str(error))
+        except (TypeError, ValueError, ImportError) as error:
+            raise HTTPException(status_code=422, detail=str(error))
+
+    JOBS.check_capacity()
+    job = Job(plan, chunk_size, output_format, file.filename, options)
+    private_directory(JOB_DIR)
+    os.makedirs(job.directory, mode=0o700)
+    await asyncio.get_running_loop().run_in_executor(None, _spool, file.file, job.input_path)
+    job.total_bytes = os.path.getsize(job.input_path)
+    JOBS.submit(job)
+    return job.progress()
+
+
+def _job(job_id: str):
+    job = JOBS.get(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Unknown job")
+    return job
+
+
+@app.get("/jobs/{job_id}")
+def get_job(job_id: str):
+    return _job(job_id).progress()
+
+
+@app.get("/jobs/{job_id}/result")
+def get_job_result(job_id: str):
+    job = _job(job_id)
+    if job.status == 'failed':
+        raise HTTPException(status_code=500, detail=f"the job failed: {job.error}")
+    if job.status != 'done':
+        raise HTTPException(status_code=409, detail=f"the job is {job.status}", headers={"Retry-After": "5"})
+    return FileResponse(
+        job.result_path,
+        media_type=OUTPUT_FORMATS[job.output_format][1],
+        headers=_download_headers(job.output_format, job.filename),
+    )
+
+
+#the size of a saved vocabulary and, for exact counts, its most common words
+@app.get("/vocabularies/{name}")
+def get_vocabulary(name: str, approximate: bool = False, top: Annotated[int, Query(ge=0, le=10_000)] = 20):
+    try:
+        vocabulary = VOCABULARIES.get(name, approximate)
+    except ValueError as error:
+        raise HTTPException(status_code=400, detail=str(error))
+    if vocabulary is None:
+        raise HTTPException(status_code=404, detail="Unknown vocabulary, upload with remove_rare_words and vocabulary to save one")
+    body = {"name": name, "approximate": approximate, "tokens": int(vocabulary.total)}
+    if not approximate:
+        body.update(distinct=len(vocabulary.counts), most_common=vocabulary.counts.most_common(top))
+    return body
+
+
 @app.post("/upload/")
 async def upload_file(
     file: UploadFile,
-    column_name: str = Form("filename"),
+    column_name: Annotated[list[str], Form(description = "Name of the column to process, repeat the field for several columns")] = ["filename"],
+    column_operations: Annotated[str | None, Form(description = "JSON map of column names to the operations to run on them")] = None,
     string_to_replace_with: Annotated[str | None, Query(description = "Enter the string to replace with")] = None,
     to_remove_spaces: Annotated[bool | None, Query(description = "Enter true or false for removing spaces")] = None,
     to_remove_nulls: Annotated[bool | None, Query(description = "Enter true or false for removing nulls")] = None,
@@ -230,120 +3480,191 @@ async def upload_file(
     to_lowercase: Annotated[bool | None, Query(description = "Enter true or false for changing to lowercase")] = None,
     to_title_format: Annotated[bool | None, Query(description = "Enter true or false for changing to title format")] = None,
     to_remove_duplicate_rows: Annotated[bool | None, Query(description = "Enter true or false for removing duplicate rows in the specified coloumn")] = None,
+    duplicate_subset: Annotated[list[str] | None, Query(description = "Enter the columns that decide whether rows are duplicates")] = None,
+    to_verify_duplicates: Annotated[bool | None, Query(description = "Enter true or false for comparing rows with the same hash before removing them")] = None,
+    to_remove_near_duplicates: Annotated[bool | None, Query(description = "Enter true or false for removing rows whose text in a specified coloumn nearly repeats an earlier row's")] = None,
+    to_flag_near_duplicates: Annotated[bool | None, Query(description = "Enter true or false for marking near duplicate rows in a new coloumn instead of removing them")] = None,
+    near_duplicate_threshold: Annotated[float | None, Query(gt = 0, le = 1, description = "Enter the share of shingles two texts must have in common to be near duplicates, 0.8 by default")] = None,
     to_remove_duplicate_columns: Annotated[bool | None, Query(description = "Enter true or false for removing duplicate coloumns in the specified coloumn")] = None,
     to_remove_empty_row: Annotated[bool | None, Query(description = "Enter true or false for removing empty rows in the specified coloumn")] = None,
     to_remove_empty_column: Annotated[bool | None, Query(description = "Enter true or false for removing empty coloums in the specified coloumn")] = None,
     to_remove_negative_values: Annotated[bool | None, Query(description = "Enter true or false for removing negative values in the specified coloumn")] = None,
+    to_clip_values: Annotated[bool | None, Query(description = "Enter true or false for setting values outside the clip range to its nearest end in the specified coloumn")] = None,
+    clip_min_value: Annotated[float | None, Query(description = "Enter the lowest value to clip to")] = None,
+    clip_max_value: Annotated[float | None, Query(description = "Enter the highest value to clip to")] = None,
+    to_downcast_numbers: Annotated[bool | None, Query(description = "Enter true or false for storing the numbers of the specified coloumn in the smallest type that holds them")] = None,
     to_arrange_column_ascending: Annotated[bool | None, Query(description = "Enter true or false for arranging elements in ascending order of a specified coloumn")] = None,
     to_arrange_column_descending: Annotated[bool | None, Query(description = "Enter true or false for arranging elements in descending order of a specified coloumn")] = None,
+    na_position: Annotated[Literal['first', 'last'] | None, Query(description = "Enter first or last for where empty values go when sorting, last by default")] = None,
+    unstable_sort: Annotated[bool | None, Query(description = "Enter true or false for letting rows with equal values change order when sorting, which is faster")] = None,
     to_remove_punctuation: Annotated[bool | None, Query(description = "Enter true or false for removing punctuations in the specified coloumn")] = None,
     to_remove_numerical_characters: Annotated[bool | None, Query(description = "Enter true or false for removing numerical charecters in the specified coloumn")] = None,
     to_remove_alphabetical_characters: Annotated[bool | None, Query(description = "Enter true or false for removing alphabetical charecters in the specified coloumn")] = None,
     to_remove_non_alphanumeric: Annotated[bool | None, Query(description = "Enter true or false for removing alpha-numeric charecters in the specified coloumn")] = None,
+    to_remove_emojis: Annotated[bool | None, Query(description = "Enter true or false for removing emojis in the specified coloumn")] = None,
     to_remove_html_tags: Annotated[bool | None, Query(description = "Enter true or false for removing HTML tags in the specified coloumn")] = None,
     to_remove_urls: Annotated[bool | None, Query(description = "Enter true or false for removing URL's in the specified coloumn")] = None,
     to_check_spelling: Annotated[bool | None, Query(description = "Enter true or false for checking spellings in the specified coloumn")] = None,
+    to_tag_pos: Annotated[bool | None, Query(description = "Enter true or false for tagging the parts of speech of the specified coloumn in a new coloumn")] = None,
+    to_chunk_text: Annotated[bool | None, Query(description = "Enter true or false for grouping the words of the specified coloumn into phrases in a new coloumn")] = None,
     to_remove_out_of_range_values: Annotated[bool | None, Query(description = "Enter true or false for removing out of range values in the specified coloumn")] = None,
     min_value_of_range: Annotated[float | None, Query(description = "Enter the minimum value of the range")] = None,
     max_value_of_range: Annotated[float | None, Query(description = "Enter the maximum value of the range")] = None,
     to_shorten_hindi_long_vowel: Annotated[bool | None, Query(description = "Enter true or false for shortening the long vowels in hindi in the specified coloumn")] = None,
     letter_to_shorten: Annotated[str | None, Query(description = "Enter the letter to shorten its vowel sound")] = None,
+    to_remove_rare_words: Annotated[bool | None, Query(description = "Enter true or false for removing words that occur rarely in the specified coloumn")] = None,
+    min_word_count: Annotated[int | None, Query(ge = 1, description = "Enter how many times a word must occur to be kept, 2 by default")] = None,
+    to_count_words_approximately: Annotated[bool | None, Query(description = "Enter true or false for counting words in fixed memory, which can keep a few rare words")] = None,
+    vocabulary: Annotated[str | None, Query(description = "Enter a name to save the word counts under, or to reuse the counts saved under it")] = None,
+    to_normalize_indic: Annotated[bool | None, Query(description = "Enter true or false for shortening every long vowel in the specified coloumn in one pass")] = None,
+    indic_script: Annotated[Literal['devanagari', 'bengali', 'gurmukhi', 'gujarati', 'oriya', 'tamil', 'telugu', 'kannada', 'malayalam'] | None, Query(description = "Enter the script of the text to normalize, devanagari by default")] = None,
+    unicode_form: Annotated[Literal['NFC', 'NFKC'] | None, Query(description = "Enter NFC or NFKC for normalizing the Unicode of the text first")] = None,
+    to_fold_nukta: Annotated[bool | None, Query(description = "Enter true or false for turning letters with a nukta into their base letters")] = None,
+    chunk_size: Annotated[int | None, Query(gt = 0, description = "Enter the number of rows per chunk to stream the file through the pipeline")] = None,
+    output_format: Annotated[Literal['csv', 'csv.gz', 'parquet', 'arrow'] | None, Query(description = "Enter csv, csv.gz, parquet or arrow to download the processed file")] = None,
+    regex_backend: Annotated[Literal['re', 'pyarrow'] | None, Query(description = "Enter re or pyarrow as the regex engine for removing spaces, HTML tags and URL's")] = None,
+    debug: Annotated[bool | None, Query(description = "Enter true or false for tracing allocations and profiling the upload")] = None,
+    string_engine: Annotated[Literal['object', 'pyarrow'] | None, Query(description = "Enter object or pyarrow as the way text columns are held and processed")] = None,
+    csv_engine: Annotated[Literal['c', 'pyarrow'] | None, Query(description = "Enter c or pyarrow as the CSV parser")] = None,
+    dtypes: Annotated[str | None, Form(description = "JSON map of column names to the dtypes to read them as")] = None,
+    usecols: Annotated[list[str] | None, Query(description = "Enter the columns to read, the others are left out")] = None,
     ):
-    content = await file.read()
-    df = pd.read_csv(io.BytesIO(content))
-    print(
-        file.filename,
-        column_name,
-        string_to_replace_with,
-        to_remove_spaces,
-        to_remove_nulls,
-        to_replace_chars,
-        to_remove_chars,
-        to_lowercase,
-        to_uppercase
-    )
+    if regex_backend == 'pyarrow' and pa is None:
+        raise HTTPException(status_code=400, detail="the pyarrow regex backend needs pyarrow installed")
+    options = parse_read_options(csv_engine, string_engine, dtypes, usecols)
+
+    operations = []
+    if to_remove_spaces:
+        operations.append(('remove_spaces', {'column_name': column_name, 'regex_backend': regex_backend}))
 
-    if to_remove_spaces:  
-        df = remove_spaces(df, column_name)
-    
     if to_remove_nulls:
-        df = remove_nulls(df, column_name)
-    
+        operations.append(('remove_nulls', {'column_name': column_name}))
+
     if to_replace_chars is not None:
-        df = replace_chars(df, column_name, to_replace_chars, string_to_replace_with)
-    
+        operations.append(('replace_chars', {
+            'column_name': column_name,
+            'chars_to_be_replaced': to_replace_chars,
+            'char_to_replace': string_to_replace_with,
+        }))
+
     if to_remove_chars is not None:
-        df = remove_chars(df, column_name, to_remove_chars)
-    
+        operations.append(('remove_chars', {'column_name': column_name, 'chars_to_be_removed': to_remove_chars}))
+
     if to_lowercase and not to_uppercase:
-        df = to_lower(df, column_name)
+        operations.append(('to_lower', {'column_name': column_name}))
     elif to_uppercase and not to_lowercase:
-        df = to_upper(df, column_name)
+        operations.append(('to_upper', {'column_name': column_name}))
 
     if to_title_format:
-        df = to_title(df, column_name)
-    
+        operations.append(('to_title', {'column_name': column_name}))
+
     if to_remove_duplicate_rows:
-        df = remove_duplicate_rows(df)
-    
+        kwargs = {'subset': duplicate_subset} if duplicate_subset is not None else {}
+        if to_verify_duplicates:
+            kwargs['exact'] = True
+        operations.append(('remove_duplicate_rows', kwargs))
+
+    if to_remove_near_duplicates or to_flag_near_duplicates:
+        kwargs = {'column_name': column_name}
+        if near_duplicate_threshold is not None:
+            kwargs['threshold'] = near_duplicate_threshold
+        if to_flag_near_duplicates:
+            kwargs['flag'] = True
+        operations.append(('remove_near_duplicate_rows', kwargs))
+
     if to_remove_duplicate_columns:
-        df  = remove_duplicate_columns(df)
-    
+        operations.append(('remove_duplicate_columns', {}))
+
     if to_remove_empty_row:
-        df = remove_empty_rows(df)
-    
+        operations.append(('remove_empty_rows', {}))
+
     if to_remove_empty_column:
-        df = remove_empty_columns(df)
-    
+        operations.append(('remove_empty_columns', {}))
+
+    #the numeric flags run together as one pass over the column
+    numeric_kwargs = {}
     if to_remove_negative_values:
-        df = remove_negative_values(df, column_name)
-    
+        numeric_kwargs['remove_negative'] = True
+    if to_remove_out_of_range_values:
+        numeric_kwargs.update(min_value=min_value_of_range, max_value=max_value_of_range)
+    if to_clip_values:
+        numeric_kwargs.update(clip_min=clip_min_value, clip_max=clip_max_value)
+    if to_downcast_numbers:
+        numeric_kwargs['downcast'] = True
+    if numeric_kwargs:
+        operations.append(('clean_numeric_values', {'column_name': column_name, **numeric_kwargs}))
+
+    #every listed column is a sort key, in order, rather than a sort of its own
+    sort_kwargs = {'na_position': na_position} if na_position is not None else {}
+    if unstable_sort:
+        sort_kwargs['stable'] = False
+
     if to_arrange_column_ascending:
-        df = arrange_column_ascending(df, column_name)
-    
+        operations.append(('sort_rows', {'by': column_name, **sort_kwargs}))
+
     if to_arrange_column_descending:
-        df = arrange_column_descending(df, column_name)
+        operations.append(('sort_rows', {'by': column_name, 'ascending': False, **sort_kwargs}))
 
     if to_remove_punctuation:
-        df = remove_punctuation(df, column_name)
+        operations.append(('remove_punctuation', {'column_name': column_name}))
 
     if to_remove_numerical_characters:
-        df = remove_numerical_characters(df, column_name)
-    
+        operations.append(('remove_numerical_characters', {'column_name': column_name}))
+
     if to_remove_alphabetical_characters:
-        df = remove_alphabetical_characters(df, column_name)
-    
+        operations.append(('remove_alphabetical_characters', {'column_name': column_name}))
+
     if to_remove_non_alphanumeric:
-        df = remove_non_alphanumeric(df, column_name)
-    
+        operations.append(('remove_non_alphanumeric', {'column_name': column_name}))
+
+    if to_remove_emojis:
+        operations.append(('remove_emojis', {'column_name': column_name}))
+
     if to_remove_html_tags:
-        df = remove_html_tags(df, column_name)
-    
+        operations.append(('remove_html_tags', {'column_name': column_name, 'regex_backend': regex_backend}))
+
     if to_remove_urls:
-        df = remove_urls(df, column_name)
+        operations.append(('remove_urls', {'column_name': column_name, 'regex_backend': regex_backend}))
 
     if to_check_spelling:
-        df = check_spelling(df, column_name)
-    
-    if to_remove_out_of_range_values:
-        df = remove_out_of_range_values(df, column_name, min_value_of_range, max_value_of_range)
+        operations.append(('check_spelling', {'column_name': column_name}))
+
+    if to_tag_pos or to_chunk_text:
+        operations.append(('tag_parts_of_speech', {'column_name': column_name, 'chunks': bool(to_chunk_text)}))
 
     if to_shorten_hindi_long_vowel:
-        df = replace_long_vowel(df, column_name, letter_to_shorten)
-
-    value = df.to_dict()
-    print(value)
-    print(
-        type(df),
-        type(column_name),
-        type(to_replace_chars),
-        type(string_to_replace_with),
-        type(to_remove_chars)
-        )
-    
-    print(to_replace_chars)
-    
-    return {"success": True}
+        operations.append(('replace_long_vowel', {'column_name': column_name, 'letter': letter_to_shorten}))
+
+    if to_remove_rare_words:
+        kwargs = {'column_name': column_name}
+        if min_word_count is not None:
+            kwargs['min_count'] = min_word_count
+        if to_count_words_approximately:
+            kwargs['approximate'] = True
+        if vocabulary is not None:
+            kwargs['vocabulary'] = vocabulary
+        operations.append(('remove_rare_words', kwargs))
+
+    if to_normalize_indic:
+        kwargs = {'column_name': column_name}
+        if indic_script is not None:
+            kwargs['script'] = indic_script
+        if unicode_form is not None:
+            kwargs['form'] = unicode_form
+        if to_fold_nukta:
+            kwargs['fold_nukta'] = True
+        operations.append(('normalize_indic', kwargs))
+
+    steps = [PipelineStep.from_operation(name, kwargs) for name, kwargs in _expand_columns(operations)]
+    if column_operations is not None:
+        steps += parse_column_operations(column_operations)
+    try:
+        pipeline_id, plan = PIPELINES.add(PipelineSpec(steps=steps))
+    except ModelUnavailable as error:
+        raise HTTPException(status_code=503, detail=str(error))
+    except (TypeError, ValueError, ImportError) as error:
+        raise HTTPException(status_code=400, detail=str(error))
+    return await process_upload(file, plan, chunk_size, output_format, debug, pipeline_id, options)
 
     
     '''
@@ -360,9 +3681,70 @@ async def upload_file(
     '''
 
 
-
-#POS Tagging
-#text chunking
-#unchunking if possible
-#removing emojis
-#remove rare words to reduce noise and dimentionality
\ No newline at end of file
+#reads the upload, runs the plan on it in one of the upload pools and sends
+#back either the success response or the processed file
+#the same file through the same pipeline is answered from RESULT_CACHE;
+#debug runs always process the file so there is something to profile
+async def process_upload(
+        file: UploadFile, plan: list[Stage], chunk_size: int = None, output_format: str = None,
+        debug: bool = None, pipeline_id: str = None, options: ReadOptions = None
+):
+    if output_format is None and chunk_size is not None:
+        output_format = 'csv'
+    if output_format is not None and OUTPUT_FORMATS[output_format][3] and pa is None:
+        raise HTTPException(status_code=400, detail=f"{output_format} output needs pyarrow installed")
+    options = options or ReadOptions()
+    #without a download only the plan's own columns have to be read
+    if output_format is None and options.usecols is None and plan_columns(plan):
+        options = replace(options, usecols=plan_columns(plan))
+
+    cache_key = None
+    if pipeline_id is not None and not debug:
+        content_hash = await asyncio.get_running_loop().run_in_executor(None, _hash_file, file.file)
+        cache_key = RESULT_CACHE.key(content_hash, pipeline_id, output_format, chunk_size, options.key())
+        cached = cached_response(cache_key, output_format, file.filename)
+        if cached is not None:
+            return cached
+    trace = PipelineTrace(bool(debug))
+
+    pool = SMALL_UPLOADS if file.size is not None and file.size <= SMALL_UPLOAD_BYTES else LARGE_UPLOADS
+    pool.admit()
+    streaming = False
+    try:
+        if chunk_size is not None:
+            #the headers go out once the first piece of the download is made,
+            #so streamed uploads only report to /metrics
+            try:
+                chunks = stream_upload(file.file, plan, chunk_size, trace, options)
+            except KeyError as error:
+                raise _missing_column(error)
+            headers = {"X-Pipeline-Profile": trace.profile_name} if debug else {}
+        else:
+            content = await file.read()
+            try:
+                df = await pool.run(trace.profiled(read_and_run), content, plan, trace, options)
+            except KeyError as error:
+                raise _missing_column(error)
+            headers = trace.headers()
+            if output_format is None:
+                body = {"success": True}
+                if debug:
+                    body.update(metrics=trace.stages, profile=trace.profile_name)
+                if cache_key is not None:
+                    RESULT_CACHE.put(cache_key, b'')
+                    headers["X-Cache"] = "miss"
+                return JSONResponse(body, headers=headers)
+            chunks = frame_chunks(df)
+        if cache_key is not None:
+            headers["X-Cache"] = "miss"
+        response = await output_response(chunks, output_format, file.filename, pool, trace, headers, cache_key)
+        streaming = True
+        return response
+    finally:
+        if not streaming:
+            pool.release()
+            trace.finish()
+
+
+
+#unchunking if possible
\ No newline at end of file
@@ -1,193 +1,67 @@
 import pytest
 import pandas as pd
-from fastapi import FastAPI, File, UploadFile, Query
 from fastapi.testclient import TestClient
-from fastapi.responses import HTMLResponse
-from typing import List, Optional, Union, Annotated
-from pydantic import BaseModel
-from spellchecker import SpellChecker
-import string
+import gzip
 import os
-import csv
 import io
-import re
-from main import app
+import json
+import asyncio
+import time
+from main import (
+    app,
+    remove_spaces,
+    remove_nulls,
+    replace_chars,
+    remove_chars,
+    to_lower,
+    to_upper,
+    to_title,
+    remove_duplicate_rows,
+    remove_duplicate_columns,
+    remove_near_duplicate_rows,
+    stream_near_duplicate_rows,
+    remove_empty_rows,
+    remove_empty_columns,
+    remove_negative_values,
+    clean_numeric_values,
+    stream_numeric_rules,
+    arrange_column_ascending,
+    remove_emojis,
+    delete_characters,
+    replace_pattern,
+    normalize_indic,
+    remove_rare_words,
+    stream_rare_words,
+    Vocabulary,
+    CountMinSketch,
+    VocabularyStore,
+    compile_pipeline,
+    run_pipeline,
+    stream_pipeline,
+    stream_duplicate_rows,
+    stream_sorted_rows,
+    sort_rows,
+    SpellEngine,
+    TagEngine,
+    tag_parts_of_speech,
+    PipelinePool,
+    JobQueue,
+    PipelineTrace,
+    stage_label,
+    PooledStreamingResponse,
+    SMALL_UPLOADS,
+    RESULT_CACHE,
+    ResultCache,
+    read_csv_frame,
+    write_parquet,
+    ReadOptions,
+    plan_columns,
+)
+from fastapi import HTTPException
 
 client = TestClient(app)
 
 
-#remove multiple spaces and unnecessary spaces
-def remove_spaces(df: pd.DataFrame = None, column_name: str = None):
-    #removing multiple spaces in a string
-    df[column_name] = df[column_name].str.replace(r'\s+', ' ', regex = True)
-    #removing single space before a full stop
-    df[column_name] = df[column_name].str.replace(r'(\s+)\.', '.', regex = True)
-    #removing mulltiple spaces at the end of the string
-    df[column_name] = df[column_name].str.replace(r'\s+$', '', regex = True)
-    return df
-
-
-#remove null values
-def remove_nulls(df: pd.DataFrame = None, column_name: str = None):
-    df[column_name].fillna('', inplace=True)
-    return df
-
-
-#replace certain charecters
-def replace_chars(
-        df: pd.DataFrame = None,
-        column_name: str = None,
-        chars_to_be_replaced: Annotated[list[str] | None, Query()] = None,
-        char_to_replace: str = None
-):
-    print("df:", df)
-    print("column_name:", column_name)
-    print("chars_to_be_replaced:", chars_to_be_replaced)
-    print("char_to_replace:", char_to_replace)
-
-    for char in chars_to_be_replaced:
-        df[column_name] = df[column_name].str.replace(char, char_to_replace)
-    return df
-
-
-#remove certain charecters
-def remove_chars(
-        df: pd.DataFrame = None,
-        column_name: str = None,
-        chars_to_be_removed: Annotated[list[str] | None, Query()] = None
-):
-    for char in chars_to_be_removed:
-        df[column_name] = df[column_name].str.replace(char, '')
-    return df
-
-
-#change the text to lowercase
-def to_lower(df: pd.DataFrame = None, column_name: str = None):
-    df[column_name] = df[column_name].str.lower()
-    return df
-
-
-#change the text to uppercase
-def to_upper(df: pd.DataFrame = None, column_name: str = None):
-    df[column_name] = df[column_name].str.upper()
-    return df
-
-
-#change the text to title format
-def to_title(df: pd.DataFrame = None, column_name: str = None):
-    df[column_name] = df[column_name].str.title()
-    return df
-
-
-#remove duplicate rows
-def remove_duplicate_rows(df: pd.DataFrame = None):
-    df.drop_duplicates(inplace=True)
-    return df
-
-
-#remove duplicate coloumns
-def remove_duplicate_columns(df: pd.DataFrame = None):
-    df = df.loc[:, ~df.columns.duplicated()]
-    return df
-
-
-#removing empty rows
-def remove_empty_rows(df: pd.DataFrame = None):
-    df.dropna(axis=0, how='all', inplace=True)
-    return df
-
-
-#removing empty coloumns
-def remove_empty_columns(df: pd.DataFrame = None):
-    df.dropna(axis=1, how='all', inplace=True)
-    return df
-
-
-#remove negative values
-def remove_negative_values(df: pd.DataFrame = None, column_name: str = None):
-    df[column_name] = df[column_name].apply(lambda x: x if x >= 0 else None)
-    return df
-
-
-#sort in ascending order of coloumn name
-def arrange_column_ascending(df: pd.DataFrame = None, column_name: str = None):
-    df[column_name] = df[column_name].sort_values(ascending = True)
-    return df
-
-
-#sort in decending order of coloumn name
-def arrange_column_descending(df: pd.DataFrame = None, column_name: str = None):
-    df[column_name] = df[column_name].sort_values(ascending = False)
-    return df
-
-
-#remove out of range values
-def remove_out_of_range_values(df: pd.DataFrame = None, column_name: str = None, min_value: float = None, max_value: float = None):
-    df.loc[(df[column_name] < min_value) | (df[column_name] > max_value), column_name] = None
-    return df
-
-
-#remove punctuations
-def remove_punctuation(df: pd.DataFrame = None, column_name: str = None):
-    df[column_name] = df[column_name].apply(lambda x: ''.join([c for c in x if c not in string.punctuation]))
-    return df
-
-
-#remove numerical charecters
-def remove_numerical_characters(df: pd.DataFrame = None, column_name: str = None):
-    df[column_name] = df[column_name].apply(lambda x: ''.join([c for c in x if not c.isdigit()]))
-    return df
-
-
-#remove alphabetical charecters
-def remove_alphabetical_characters(df: pd.DataFrame = None, column_name: str = None):
-    df[column_name] = df[column_name].apply(lambda x: ''.join([c for c in x if not c.isalpha()]))
-    return df
-
-
-#removing non-alphanumeric characters
-def remove_non_alphanumeric(df: pd.DataFrame, column_name: str):
-    df[column_name] = df[column_name].apply(lambda x: ''.join(c for c in x if c.isalnum()))
-    return df
-
-
-#remove HTML tags
-def remove_html_tags(df: pd.DataFrame, column_name: str):
-    df[column_name] = df[column_name].apply(lambda x: re.sub(r'<.*?>', '', x))
-    return df
-
-
-#remove URL's
-def remove_urls(df: pd.DataFrame, column_name: str):
-    df[column_name] = df[column_name].apply(lambda x: re.sub(r'http\S+|www\S+', '', x))
-    return df
-
-
-#checking pellings and correcting them
-def check_spelling(df: pd.DataFrame, column_name: str):
-    spell = SpellChecker()
-    df[column_name] = df[column_name].apply(lambda x: ' '.join(spell.correction(word) for word in x.split()))
-    return df
-
-
-def replace_long_vowel(df: pd.DataFrame, column_name: str, letter: str):
-    replacements = {
-        'ा': '',  # 'aa' sound
-        'ी': 'ि',  # 'ii' sound
-        'ू': 'ु',  # 'uu' sound
-        'ॅ': 'े',  # 'ei' sound
-        'े': 'े',  # 'ee' sound
-        'ै': 'े',  # 'ai' sound
-        'ो': 'ो',  # 'oo' sound
-        'ौ': 'ो',  # 'au' sound
-    }
-
-    if letter in replacements:
-        pattern = re.escape(letter)
-        df[column_name] = df[column_name].str.replace(pattern, replacements[letter])
-    return df
-
-
 @pytest.fixture
 def csv_file():
     csv_data = "id,name\n1,'John Doe'\n2,'Jane Smith'\n3,'Michael Brown'"
@@ -262,6 +136,18 @@ def test_remove_nulls():
     assert processed_df.equals(expected_df)
 
 
+def test_upload_file_remove_nulls_numeric_column():
+    csv_data = "id,score\n1,\n2,3.5\n3,\n"
+    response = client.post(
+        "/upload/",
+        params={"to_remove_nulls": True, "output_format": "csv"},
+        files={"file": ("scores.csv", csv_data)},
+        data={"column_name": "score"}
+    )
+    assert response.status_code == 200
+    assert response.text.splitlines() == ["id,score", "1,", "2,3.5", "3,"]
+
+
 def test_replace_chars():
     sample_data = {
         "id": [1, 2, 3],
@@ -366,6 +252,76 @@ def test_remove_duplicate_rows():
     assert processed_df.equals(expected_df)
 
 
+def test_remove_duplicate_rows_by_subset():
+    sample_data = {
+        "id": [1, 2, 3, 4],
+        "name": ["John Doe", "Jane Smith", "John Doe", None],
+        "score": [1.0, 2.0, 1.0, None]
+    }
+    expected_data = {
+        "id": [1, 2, 4],
+        "name": ["John Doe", "Jane Smith", None],
+        "score": [1.0, 2.0, None]
+    }
+
+    df = pd.DataFrame(sample_data)
+    expected_df = pd.DataFrame(expected_data, index=[0, 1, 3])
+
+    assert remove_duplicate_rows(df.copy(), ["name", "score"]).equals(expected_df)
+    assert remove_duplicate_rows(df.copy(), ["name", "score"], exact=True).equals(expected_df)
+
+
+def test_stream_duplicate_rows_across_chunks():
+    chunks = [
+        pd.DataFrame({"id": [1, 2], "name": ["a", "b"]}),
+        pd.DataFrame({"id": [1.0, None], "name": ["a", "b"]}),
+    ]
+
+    for exact in (False, True):
+        kept = [len(chunk) for chunk in stream_duplicate_rows(iter(chunks), exact=exact)]
+        assert kept == [2, 1]
+
+
+def test_stream_duplicate_rows_matches_in_memory():
+    for content, subset in (("id,name\n1,a\n2,\n2,\n", None), ("id,code\n1,7\n2,8\n3,x\n4,7\n", ["code"])):
+        expected_df = remove_duplicate_rows(pd.read_csv(io.StringIO(content)), subset)
+        chunks = pd.read_csv(io.StringIO(content), chunksize=2)
+        processed_df = pd.concat(stream_duplicate_rows(chunks, subset))
+
+        assert processed_df["id"].tolist() == expected_df["id"].tolist()
+
+
+def test_remove_near_duplicate_rows():
+    sample_data = {
+        "id": [1, 2, 3, 4, 5],
+        "text": [
+            "The quick brown fox jumps over the lazy dog http://example.com/a",
+            "the quick  brown fox, jumps over the lazy dog!",
+            "Completely different sentence about cats",
+            None,
+            "completely different sentence about cats.",
+        ]
+    }
+    expected_data = {
+        "id": [1, 3, 4],
+        "text": [
+            "The quick brown fox jumps over the lazy dog http://example.com/a",
+            "Completely different sentence about cats",
+            None,
+        ]
+    }
+
+    df = pd.DataFrame(sample_data)
+    expected_df = pd.DataFrame(expected_data, index=[0, 2, 3])
+    processed_df = remove_near_duplicate_rows(df, "text")
+
+    assert processed_df.equals(expected_df)
+
+    chunks = [df.iloc[start:start + 2] for start in range(0, len(df), 2)]
+    flagged = pd.concat(stream_near_duplicate_rows(iter(chunks), "text", flag=True))
+    assert flagged["text_near_duplicate"].tolist() == [False, True, False, False, True]
+
+
 def test_remove_duplicate_columns():
     sample_data = {
         "id": [1, 2, 3],
@@ -439,6 +395,48 @@ def test_remove_negative_values():
     assert processed_df.equals(expected_df)
 
 
+def test_clean_numeric_values():
+    sample_data = {
+        "id": [1, 2, 3, 4],
+        "value": [10, -5, 300, 70],
+        "price": [1.5, -2.0, None, 250.0]
+    }
+    expected_data = {
+        "id": [1, 2, 3, 4],
+        "value": pd.array([10, None, None, 50], dtype="Int8"),
+        "price": pd.array([1.5, None, None, 100.0], dtype="float32")
+    }
+
+    df = pd.DataFrame(sample_data)
+    expected_df = pd.DataFrame(expected_data)
+    processed_df = clean_numeric_values(df, "value", remove_negative=True, max_value=100, clip_max=50, downcast=True)
+    processed_df = clean_numeric_values(processed_df, "price", remove_negative=True, clip_max=100, downcast=True)
+
+    assert processed_df.equals(expected_df)
+
+
+def test_stream_numeric_rules_downcasts_to_the_bounds():
+    chunks = [pd.DataFrame({"value": [5, -1]}), pd.DataFrame({"value": [1000, 7]})]
+    rules = [("clip", 0, 1000), ("downcast",)]
+
+    processed = list(stream_numeric_rules(iter(chunks), "value", rules))
+
+    assert [chunk["value"].dtype for chunk in processed] == ["int16", "int16"]
+    assert pd.concat(processed)["value"].tolist() == [5, 0, 1000, 7]
+
+
+def test_numeric_operations_share_one_stage():
+    plan = compile_pipeline([
+        ("remove_negative_values", {"column_name": "value"}),
+        ("remove_out_of_range_values", {"column_name": "value", "min_value": None, "max_value": 100}),
+    ])
+    df = pd.DataFrame({"value": [10, -5, 300]})
+    expected_df = pd.DataFrame({"value": [10, None, None]})
+
+    assert [stage.name for stage in plan] == ["remove_negative_values+remove_out_of_range_values"]
+    assert run_pipeline(df, plan).equals(expected_df)
+
+
 def test_arrange_column_ascending():
     sample_data = {
         "id": [3, 1, 2],
@@ -457,7 +455,829 @@ def test_arrange_column_ascending():
     assert processed_df.equals(expected_df)
 
 
+def test_sort_rows_by_several_columns():
+    sample_data = {
+        "group": ["b", None, "a", "b", "a"],
+        "score": [1, 2, 3, 1, 5],
+        "id": [1, 2, 3, 4, 5]
+    }
+    expected_data = {
+        "group": [None, "a", "a", "b", "b"],
+        "score": [2, 5, 3, 1, 1],
+        "id": [2, 5, 3, 1, 4]
+    }
+
+    df = pd.DataFrame(sample_data)
+    expected_df = pd.DataFrame(expected_data)
+    processed_df = sort_rows(df, ["group", "score"], [True, False], na_position="first")
+
+    assert processed_df.equals(expected_df)
+
+
+def test_stream_sorted_rows_merges_spilled_runs(monkeypatch):
+    monkeypatch.setattr("main.SORT_MEMORY_BYTES", 0)
+    df = pd.DataFrame({
+        "score": [3, None, 1, 3, 2, 1, None, 2, 3],
+        "id": range(9)
+    })
+    chunks = [df.iloc[start:start + 2] for start in range(0, len(df), 2)]
+
+    for ascending in (True, False):
+        expected_df = sort_rows(df, "score", ascending)
+        processed_df = pd.concat(stream_sorted_rows(iter(chunks), "score", ascending))
+        assert processed_df.equals(expected_df)
+
+
+def test_stream_sorted_rows_with_numbers_and_text(monkeypatch):
+    content = "id,code\n1,20\n2,3\n3,x\n4,b\n5,\n6,\n7,100\n8,9\n"
+    df = pd.read_csv(io.StringIO(content))
+
+    for memory in (256 * 1024 * 1024, 0):
+        monkeypatch.setattr("main.SORT_MEMORY_BYTES", memory)
+        for ascending in (True, False):
+            expected_df = sort_rows(df.copy(), "code", ascending)
+            processed_df = pd.concat(stream_sorted_rows(pd.read_csv(io.StringIO(content), chunksize=2), "code", ascending))
+            assert processed_df["id"].tolist() == expected_df["id"].tolist()
+
+
+def test_remove_emojis():
+    sample_data = {
+        "id": [1, 2, 3, 4],
+        "text": ["great 👍🏽", "family 👨\u200d👩\u200d👧 #️⃣ 🇮🇳", "क्\u200dष", None]
+    }
+    expected_data = {
+        "id": [1, 2, 3, 4],
+        "text": ["great ", "family   ", "क्\u200dष", None]
+    }
+
+    df = pd.DataFrame(sample_data)
+    expected_df = pd.DataFrame(expected_data)
+    processed_df = remove_emojis(df, "text")
+
+    assert processed_df.equals(expected_df)
+
+
+def test_remove_emojis_keeps_text_symbols():
+    sample_data = {
+        "id": [1, 2, 3],
+        "text": ["done ✓ ✔ ✅", "★ rated ☆ ⭐ ☀", "□ ◽ ◾ ■"]
+    }
+    expected_data = {
+        "id": [1, 2, 3],
+        "text": ["done ✓  ", "★ rated ☆  ", "□   ■"]
+    }
+
+    df = pd.DataFrame(sample_data)
+    expected_df = pd.DataFrame(expected_data)
+    processed_df = remove_emojis(df, "text")
 
+    assert processed_df.equals(expected_df)
+
+
+def test_normalize_indic():
+    sample_data = {
+        "id": [1, 2, 3],
+        "text": ["मौसम रेलगाड़ी", "फ़ूल", None]
+    }
+    expected_data = {
+        "id": [1, 2, 3],
+        "text": ["मोसम रेलगडि", "फुल", None]
+    }
+
+    df = pd.DataFrame(sample_data)
+    expected_df = pd.DataFrame(expected_data)
+    processed_df = normalize_indic(df, "text", form="NFC", fold_nukta=True)
+
+    assert processed_df.equals(expected_df)
+
+
+def test_remove_rare_words():
+    sample_data = {
+        "id": [1, 2, 3, 4],
+        "text": ["the cat sat", "the dog  sat", None, "a cat ran"]
+    }
+    expected_data = {
+        "id": [1, 2, 3, 4],
+        "text": ["the cat sat", "the sat", None, "cat"]
+    }
+
+    for approximate in (False, True):
+        df = pd.DataFrame(sample_data)
+        expected_df = pd.DataFrame(expected_data)
+        processed_df = remove_rare_words(df, "text", approximate=approximate)
+
+        assert processed_df.equals(expected_df)
+
+
+def test_stream_rare_words_reuses_vocabulary(monkeypatch, tmp_path):
+    monkeypatch.setattr("main.VOCABULARIES", VocabularyStore(str(tmp_path)))
+    df = pd.DataFrame({"text": ["the cat sat", "the dog sat", "a cat ran"]})
+    chunks = [df.iloc[[0]].copy(), df.iloc[[1, 2]].copy()]
+
+    first = pd.concat(stream_rare_words(iter(chunks), "text", vocabulary="pets"))
+    assert first["text"].tolist() == ["the cat sat", "the sat", "cat"]
+
+    other = pd.DataFrame({"text": ["the bird sat", "a cat"]})
+    second = pd.concat(stream_rare_words(iter([other]), "text", vocabulary="pets"))
+    assert second["text"].tolist() == ["the sat", "cat"]
+
+
+def test_vocabulary_store_saves_without_pickle(tmp_path):
+    series = pd.Series(["the cat sat", "the dog sat", None])
+    exact, sketch = Vocabulary(), CountMinSketch(width=64, depth=2)
+    exact.update(series)
+    sketch.update(series)
+    VocabularyStore(str(tmp_path)).put("pets", exact)
+    VocabularyStore(str(tmp_path)).put("pets", sketch)
+
+    store = VocabularyStore(str(tmp_path))
+    loaded_exact, loaded_sketch = store.get("pets"), store.get("pets", approximate=True)
+
+    assert sorted(os.listdir(tmp_path)) == ["pets.counts.json", "pets.sketch.npz"]
+    assert loaded_exact.counts == exact.counts
+    assert loaded_sketch.total == sketch.total
+    assert (loaded_sketch.table == sketch.table).all()
+
+
+def test_compiled_pipeline_matches_sequential():
+    sample_data = {
+        "id": [1, 2, 3],
+        "name": ["  <b>Mike</b>  Tyson .", "John,   Clinton www.site.com ", None]
+    }
+    operations = [
+        ("remove_spaces", {"column_name": "name"}),
+        ("replace_chars", {"column_name": "name", "chars_to_be_replaced": ["o", "e"], "char_to_replace": "yes"}),
+        ("remove_chars", {"column_name": "name", "chars_to_be_removed": ["J"]}),
+        ("to_lower", {"column_name": "name"}),
+        ("remove_html_tags", {"column_name": "name"}),
+        ("remove_urls", {"column_name": "name"}),
+    ]
+    expected_data = {
+        "id": [1, 2, 3],
+        "name": [" mikyes tysyyessn.", "yyesshn, clintyyessn ", None]
+    }
+
+    df = pd.DataFrame(sample_data)
+    expected_df = pd.DataFrame(expected_data)
+    processed_df = run_pipeline(df, compile_pipeline(operations))
+
+    assert processed_df.equals(expected_df)
+
+
+def test_compile_pipeline_fuses_text_steps():
+    operations = [
+        ("remove_chars", {"column_name": "name", "chars_to_be_removed": ["a", "b"]}),
+        ("remove_punctuation", {"column_name": "name"}),
+        ("remove_duplicate_rows", {}),
+        ("to_upper", {"column_name": "name"}),
+    ]
+
+    plan = compile_pipeline(operations)
+
+    assert [stage.kind for stage in plan] == ["text", "frame", "text"]
+    assert plan[0].steps == [("delete", ("punctuation",), "ab")]
+
+
+def test_fused_deletions_keep_joiners_like_sequential_steps():
+    sample_data = {
+        "id": [1, 2, 3, 4],
+        "text": ["👍!\u200dx", "क्\u200d1ष", "a1\u200db 👨\u200d👩", None]
+    }
+    operations = [
+        ("remove_punctuation", {"column_name": "text"}),
+        ("remove_numerical_characters", {"column_name": "text"}),
+        ("remove_emojis", {"column_name": "text"}),
+        ("remove_chars", {"column_name": "text", "chars_to_be_removed": ["x"]}),
+    ]
+
+    for order in (operations, operations[::-1]):
+        expected_df = pd.DataFrame(sample_data)
+        for operation in order:
+            expected_df = run_pipeline(expected_df, compile_pipeline([operation]))
+        processed_df = run_pipeline(pd.DataFrame(sample_data), compile_pipeline(order))
+
+        assert processed_df.equals(expected_df)
+
+
+def test_replace_long_vowel_steps_fuse_into_one_map():
+    sample_data = {
+        "id": [1, 2],
+        "text": ["मौसम पीला", None]
+    }
+    expected_data = {
+        "id": [1, 2],
+        "text": ["मोसम पिला", None]
+    }
+    operations = [
+        ("replace_long_vowel", {"column_name": "text", "letter": "ौ"}),
+        ("replace_long_vowel", {"column_name": "text", "letter": "ी"}),
+    ]
+
+    df = pd.DataFrame(sample_data)
+    expected_df = pd.DataFrame(expected_data)
+    plan = compile_pipeline(operations)
+
+    assert [step[0] for step in plan[0].steps] == ["map"]
+    assert run_pipeline(df, plan).equals(expected_df)
+
+
+def test_stream_pipeline_matches_in_memory():
+    sample_data = {
+        "id": [1, 2, 1, 3, 2],
+        "name": ["John  Doe ", "Jane", "John  Doe ", "Mike", "Jane"],
+        "empty": [None, None, None, None, None]
+    }
+    operations = [
+        ("remove_spaces", {"column_name": "name"}),
+        ("remove_duplicate_rows", {}),
+        ("remove_empty_columns", {}),
+        ("to_upper", {"column_name": "name"}),
+    ]
+
+    df = pd.DataFrame(sample_data)
+    expected_df = run_pipeline(df.copy(), compile_pipeline(operations))
+    chunks = [df.iloc[start:start + 2] for start in range(0, len(df), 2)]
+    processed_df = pd.concat(stream_pipeline(chunks, compile_pipeline(operations)))
+
+    assert processed_df.equals(expected_df)
+
+
+def test_upload_file_in_chunks(csv_file):
+    with open(csv_file, "rb") as test_file:
+        response = client.post(
+            "/upload/",
+            params={"chunk_size": 2, "to_uppercase": True},
+            files={"file": test_file},
+            data={"column_name": "name"}
+        )
+    assert response.status_code == 200
+    assert response.headers["content-type"].startswith("text/csv")
+    assert response.text.splitlines() == ["id,name", "1,'JOHN DOE'", "2,'JANE SMITH'", "3,'MICHAEL BROWN'"]
+
+
+def test_upload_file_in_chunks_missing_column(csv_file):
+    for params in ({"chunk_size": 2}, {"chunk_size": 2, "output_format": "csv"}):
+        with open(csv_file, "rb") as test_file:
+            response = client.post(
+                "/upload/",
+                params={"to_uppercase": True, **params},
+                files={"file": test_file},
+                data={"column_name": "title"}
+            )
+        assert response.status_code == 400
+        assert response.json() == {"detail": "column 'title' is not in the file"}
+
+
+def test_upload_file_in_chunks_with_an_empty_chunk():
+    content = "id,name\n1,Ab\n2,Cd\n3,\n4,\n5,E f\n"
+    flags = ["to_lowercase", "to_remove_punctuation", "to_remove_spaces", "to_check_spelling",
+             "to_remove_rare_words", "to_remove_near_duplicates", "to_remove_emojis"]
+
+    for flag in flags:
+        responses = [
+            client.post(
+                "/upload/",
+                params={flag: True, "output_format": "csv", **params},
+                files={"file": ("empty_chunk.csv", content)},
+                data={"column_name": "name"}
+            )
+            for params in ({}, {"chunk_size": 2})
+        ]
+        assert responses[1].status_code == 200
+        assert responses[1].text == responses[0].text
+
+
+def test_upload_file_output_formats(csv_file):
+    with open(csv_file, "rb") as test_file:
+        response = client.post(
+            "/upload/",
+            params={"output_format": "csv.gz", "to_lowercase": True},
+            files={"file": test_file},
+            data={"column_name": "name"}
+        )
+    assert response.status_code == 200
+    assert response.headers["content-disposition"] == 'attachment; filename="sample_data.csv.gz"'
+    processed_df = pd.read_csv(io.BytesIO(gzip.decompress(response.content)))
+    assert processed_df["name"].tolist() == ["'john doe'", "'jane smith'", "'michael brown'"]
+
+
+def test_upload_file_parquet_output(csv_file):
+    pytest.importorskip("pyarrow")
+    with open(csv_file, "rb") as test_file:
+        response = client.post(
+            "/upload/",
+            params={"output_format": "parquet", "chunk_size": 2},
+            files={"file": test_file},
+            data={"column_name": "name"}
+        )
+    assert response.status_code == 200
+    processed_df = pd.read_parquet(io.BytesIO(response.content))
+    assert processed_df["id"].tolist() == [1, 2, 3]
+
+
+def test_upload_file_parquet_output_casts_later_chunks():
+    pytest.importorskip("pyarrow")
+    csv_data = "id,score\n1,\n2,\n3,4.5\n4,text\n"
+    response = client.post(
+        "/upload/",
+        params={"output_format": "parquet", "chunk_size": 2, "to_remove_nulls": True},
+        files={"file": ("scores.csv", csv_data)},
+        data={"column_name": "id"}
+    )
+    assert response.status_code == 200
+    processed_df = pd.read_parquet(io.BytesIO(response.content))
+    assert processed_df["id"].tolist() == [1, 2, 3, 4]
+    assert processed_df["score"].tolist() == [None, None, "4.5", "text"]
+
+
+def test_write_parquet_sends_each_chunk_as_it_arrives():
+    pytest.importorskip("pyarrow")
+    pulled = []
+
+    def chunks():
+        for frame in (pd.DataFrame({"id": [1, 2]}), pd.DataFrame({"id": [3.0, None]}), pd.DataFrame({"id": ["x"]})):
+            pulled.append(len(frame))
+            yield frame
+
+    body = write_parquet(chunks())
+    assert next(body) and pulled == [2]
+    assert next(body) and pulled == [2, 2]
+    with pytest.raises(ValueError, match="'id' is int64 in the first chunk"):
+        next(body)
+
+
+def test_spell_engine_corrects_each_word_once():
+    engine = SpellEngine(cache_size=10)
+
+    corrections = engine.correct_words(["helo", "world", "wrld"])
+    calls = engine.correction_calls
+    engine.correct_words(["helo", "wrld", "world"])
+
+    assert corrections == {"helo": "help", "world": "world", "wrld": "world"}
+    assert calls == 2
+    assert engine.correction_calls == 2
+
+
+def test_spell_engine_worker_pool():
+    engine = SpellEngine(workers=2, shard_size=1)
+
+    corrections = engine.correct_words(["helo", "wrld", "speling", "world"])
+    engine.close()
+
+    assert corrections == {"helo": "help", "wrld": "world", "speling": "spelling", "world": "world"}
+
+
+
+#a small tagger trained on the spot, laid out the way the bundled model is
+@pytest.fixture
+def tagger_model(tmp_path):
+    tagger = pytest.importorskip("nltk.tag.perceptron").PerceptronTagger(load=False)
+    sentences = [
+        [("The", "DT"), ("cat", "NN"), ("sat", "VBD"), ("on", "IN"), ("the", "DT"), ("mat", "NN"), (".", ".")],
+        [("A", "DT"), ("big", "JJ"), ("dog", "NN"), ("will", "MD"), ("run", "VB"), ("quickly", "RB")],
+    ]
+    tagger.train(sentences * 5, nr_iter=5)
+    tagger.save_to_json(lang="eng", loc=str(tmp_path / "taggers" / "averaged_perceptron_tagger_eng"))
+    return str(tmp_path)
+
+
+def test_tag_parts_of_speech(monkeypatch, tagger_model):
+    monkeypatch.setattr("main.TAG_ENGINE", TagEngine(tagger_model))
+    sample_data = {
+        "id": [1, 2, 3],
+        "text": ["The cat sat on the mat.", "A big dog will run quickly", None]
+    }
+    expected_data = {
+        "id": [1, 2, 3],
+        "text": ["The cat sat on the mat.", "A big dog will run quickly", None],
+        "text_pos": ["The/DT cat/NN sat/VBD on/IN the/DT mat/NN ./.", "A/DT big/JJ dog/NN will/MD run/VB quickly/RB", None],
+        "text_chunks": ["[NP The cat] [VP sat] [PP on] [NP the mat] .", "[NP A big dog] [VP will run quickly]", None]
+    }
+
+    df = pd.DataFrame(sample_data)
+    expected_df = pd.DataFrame(expected_data)
+    processed_df = tag_parts_of_speech(df, "text", chunks=True)
+
+    assert processed_df.equals(expected_df)
+
+
+def test_tag_engine_worker_pool(tagger_model):
+    engine = TagEngine(tagger_model, workers=2, batch_size=1)
+
+    tagged = engine.tag_texts(["The cat sat", "A big dog", "the mat"])
+    engine.tag_texts(["A big dog", "The cat sat"])
+    engine.close()
+
+    assert tagged["A big dog"] == ("A/DT big/JJ dog/NN", None)
+    assert len(tagged) == 3
+    assert engine.tagged_texts == 3
+
+
+def test_upload_file_tag_pos_without_model(monkeypatch, tmp_path):
+    monkeypatch.setattr("main.TAG_ENGINE", TagEngine(str(tmp_path)))
+    response = client.post(
+        "/upload/",
+        params={"to_tag_pos": True},
+        files={"file": ("tags.csv", "id,text\n1,the cat\n")},
+        data={"column_name": "text"}
+    )
+    assert response.status_code == 503
+    assert "download_models.py" in response.json()["detail"]
+
+    spec = {"steps": [{"operation": "tag_parts_of_speech", "column_name": "text"}]}
+    assert client.post("/pipelines", json=spec).status_code == 503
+
+
+def test_upload_file_check_spelling():
+    csv_data = "id,text\n1,helo wrld\n2,helo\n"
+    response = client.post(
+        "/upload/",
+        params={"to_check_spelling": True, "output_format": "csv"},
+        files={"file": ("spelling.csv", csv_data)},
+        data={"column_name": "text"}
+    )
+    assert response.status_code == 200
+    assert response.text.splitlines() == ["id,text", "1,help world", "2,help"]
+
+
+def test_pipeline_pool_rejects_past_limit():
+    pool = PipelinePool("test", workers=1, queue_size=1)
+    pool.admit()
+    pool.admit()
+
+    with pytest.raises(HTTPException) as error:
+        pool.admit()
+    pool.release()
+    pool.admit()
+
+    assert error.value.status_code == 429
+
+
+def test_upload_file_releases_pool(csv_file):
+    for params in ({}, {"output_format": "csv"}, {"chunk_size": 1}):
+        with open(csv_file, "rb") as test_file:
+            response = client.post("/upload/", params=params, files={"file": test_file}, data={"column_name": "name"})
+        assert response.status_code == 200
+        assert SMALL_UPLOADS.active == 0
+
+
+def test_streaming_response_releases_pool_when_client_leaves():
+    pool = PipelinePool("test", workers=1, queue_size=0)
+    pool.admit()
+    response = PooledStreamingResponse(pool.iterate(iter([b"id,name\n"])), pool)
+
+    async def receive():
+        return {"type": "http.disconnect"}
+
+    async def send(message):
+        raise OSError("client went away")
+
+    with pytest.raises(Exception):
+        asyncio.run(response({"type": "http", "asgi": {"spec_version": "2.4"}}, receive, send))
+
+    assert pool.active == 0
+
+
+def test_delete_characters_keeps_unicode_semantics():
+    sample = pd.Series(["a1²½٣ é!", None, "", "x_y-z"])
+
+    digits = delete_characters(sample, ("digit",))
+    alphabets = delete_characters(sample, ("alpha",))
+    non_alphanumeric = delete_characters(sample, ("non_alphanumeric",))
+
+    assert digits.tolist() == ["a½ é!", None, "", "x_y-z"]
+    assert alphabets.tolist() == ["1²½٣ !", None, "", "_-"]
+    assert non_alphanumeric.tolist() == ["a1²½٣é", None, "", "xyz"]
+
+
+def test_replace_chars_single_pass_matches_one_by_one():
+    sample_data = {
+        "id": [1, 2, 3],
+        "name": ["John Clinton", "Michael Jackson", "Mike"]
+    }
+    expected_data = {
+        "id": [1, 2, 3],
+        "name": ["yyesshn Clintyyessn", "Michayesl Jacksyyessn", "Mikyes"]
+    }
+
+    df = pd.DataFrame(sample_data)
+    expected_df = pd.DataFrame(expected_data)
+    processed_df = replace_chars(df, "name", ["Jo", "o", "e"], "yes")
+
+    assert processed_df.equals(expected_df)
+
+
+def test_replace_pattern_backends_agree():
+    pytest.importorskip("pyarrow")
+    sample = pd.Series(["<b>see</b> http://x.io\u00a0now", None, 7, "www.a.b\u3000c <br/>"], dtype=object)
+
+    for name, expected in (
+        ("html_tag", ["see http://x.io\u00a0now", None, None, "www.a.b\u3000c "]),
+        ("url", ["<b>see</b> \u00a0now", None, None, "\u3000c <br/>"]),
+    ):
+        for backend in ("re", "pyarrow"):
+            processed = replace_pattern(sample, name, "", backend)
+            assert processed.where(processed.notna(), None).tolist() == expected
+
+
+def test_upload_file_reports_stage_metrics(csv_file):
+    with open(csv_file, "rb") as test_file:
+        response = client.post(
+            "/upload/",
+            params={"to_remove_spaces": True, "to_lowercase": True, "to_remove_duplicate_rows": True},
+            files={"file": test_file},
+            data={"column_name": "name"},
+        )
+    stages = json.loads(response.headers["x-pipeline-metrics"])
+
+    assert response.json() == {"success": True}
+    assert [stage["stage"] for stage in stages] == ["read_csv", "remove_spaces+to_lower", "remove_duplicate_rows"]
+    assert [(stage["rows_in"], stage["rows_out"]) for stage in stages] == [(None, 3), (3, 3), (3, 3)]
+    assert response.headers["server-timing"].startswith("read_csv;dur=")
+
+    metrics = client.get("/metrics").text
+    assert 'preprocessing_stage_seconds_bucket{stage="remove_duplicate_rows",le="+Inf"}' in metrics
+
+
+def test_stage_labels_leave_out_column_names():
+    assert stage_label("title:to_lower+remove_spaces|secret_column:to_lower") == "remove_spaces+to_lower"
+    assert stage_label("write_csv.gz") == "write_csv.gz"
+
+
+def test_one_debug_trace_measures_memory_at_a_time():
+    first = PipelineTrace(debug=True)
+    second = PipelineTrace(debug=True)
+
+    first.run("read_csv", None, pd.DataFrame, {"a": [1]})
+    second.run("read_csv", None, pd.DataFrame, {"a": [1]})
+    first.finish()
+    second.finish()
+
+    assert first.stages[0]["allocated_bytes"] is not None
+    assert second.stages[0]["allocated_bytes"] is None
+
+
+def test_upload_file_several_columns():
+    sample_data = {
+        "id": [1, 2, 3],
+        "first": ["  John   Doe ", "<b>Jane</b>", "Mike"],
+        "last": ["CLINTON  .", "Jackson", None],
+    }
+    expected_data = {
+        "id": [1, 2, 3],
+        "first": [" john doe", "jane", "mike"],
+        "last": ["clinton.", "jackson", None],
+    }
+    content = pd.DataFrame(sample_data).to_csv(index=False)
+
+    response = client.post(
+        "/upload/",
+        params={"to_remove_spaces": True, "to_lowercase": True, "to_remove_html_tags": True, "output_format": "csv"},
+        files={"file": ("sample.csv", content)},
+        data={"column_name": ["first", "last"]},
+    )
+    processed_df = pd.read_csv(io.StringIO(response.text), keep_default_na=False, na_values=[""])
+    expected_df = pd.DataFrame(expected_data)
+
+    assert processed_df.equals(expected_df)
+
+
+def test_upload_file_column_operations():
+    content = "id,first,amount\n1,  John   Doe ,-4\n2,Jane-Ann,7\n"
+    column_operations = {
+        "first": ["remove_spaces", {"operation": "replace_chars", "chars_to_be_replaced": ["-"], "char_to_replace": " "}],
+        "amount": ["remove_negative_values"],
+    }
+
+    response = client.post(
+        "/upload/",
+        params={"output_format": "csv"},
+        files={"file": ("sample.csv", content)},
+        data={"column_operations": json.dumps(column_operations)},
+    )
+    bad_response = client.post(
+        "/upload/",
+        files={"file": ("sample.csv", content)},
+        data={"column_operations": json.dumps({"first": ["remove_duplicate_rows"]})},
+    )
+
+    assert response.text.splitlines() == ["id,first,amount", "1, John Doe,", "2,Jane Ann,7.0"]
+    assert bad_response.status_code == 400
+
+
+def test_saved_pipeline_runs_like_upload(csv_file):
+    spec = {"steps": [
+        {"operation": "remove_chars", "column_name": "name", "arguments": {"chars_to_be_removed": ["'"]}},
+        {"operation": "to_upper", "column_name": "name"},
+        {"operation": "remove_duplicate_rows"},
+    ]}
+    created = client.post("/pipelines", json=spec)
+    pipeline_id = created.json()["pipeline_id"]
+
+    with open(csv_file, "rb") as test_file:
+        response = client.post(f"/pipelines/{pipeline_id}/run", params={"output_format": "csv"}, files={"file": test_file})
+    with open(csv_file, "rb") as test_file:
+        upload_response = client.post(
+            "/upload/",
+            params={"to_remove_chars": ["'"], "to_uppercase": True, "to_remove_duplicate_rows": True, "output_format": "csv"},
+            files={"file": test_file},
+            data={"column_name": "name"},
+        )
+
+    assert created.json()["stages"] == ["remove_chars+to_upper", "remove_duplicate_rows"]
+    assert client.post("/pipelines", json=spec).json()["pipeline_id"] == pipeline_id
+    assert response.text == upload_response.text
+    assert response.text.splitlines() == ["id,name", "1,JOHN DOE", "2,JANE SMITH", "3,MICHAEL BROWN"]
+
+
+def test_pipeline_spec_is_validated():
+    assert client.post("/pipelines", json={"steps": [{"operation": "to_lower"}]}).status_code == 422
+    assert client.post("/pipelines", json={"steps": [{"operation": "unknown", "column_name": "name"}]}).status_code == 422
+    assert client.post("/pipelines/unknown/run", files={"file": ("sample.csv", "id\n1\n")}).status_code == 404
+
+
+def test_pipeline_sort_arguments_are_validated():
+    bad_arguments = [
+        {"by": ["name"], "ascending": "yes"},
+        {"by": ["name", "id"], "ascending": [True]},
+        {"by": ["name"], "na_position": "middle"},
+        {"by": [1, 2]},
+        {"by": "name", "stable": "no"},
+    ]
+
+    for arguments in bad_arguments:
+        spec = {"steps": [{"operation": "sort_rows", "arguments": arguments}]}
+        assert client.post("/pipelines", json=spec).status_code == 422
+    spec = {"steps": [{"operation": "sort_rows", "arguments": {"by": ["name", "id"], "ascending": [True, False]}}]}
+    assert client.post("/pipelines", json=spec).status_code == 200
+
+
+def test_upload_file_reuses_cached_result(csv_file):
+    params = {"to_remove_chars": [","], "to_title_format": True, "output_format": "csv"}
+    hits = sum(RESULT_CACHE.hits.values())
+
+    responses = []
+    for _ in range(2):
+        with open(csv_file, "rb") as test_file:
+            responses.append(client.post("/upload/", params=params, files={"file": test_file}, data={"column_name": "name"}))
+
+    assert responses[0].headers["X-Cache"] == "miss"
+    assert responses[1].headers["X-Cache"] == "hit"
+    assert responses[1].text == responses[0].text
+    assert sum(RESULT_CACHE.hits.values()) == hits + 1
+    assert "preprocessing_result_cache_hits_total" in client.get("/metrics").text
+
+
+def test_result_cache_evicts_from_both_tiers(tmp_path):
+    cache = ResultCache(10, str(tmp_path), 12)
+    cache.put("first", b"123456")
+    cache.put("second", b"abcdef")
+    cache.put("third", b"ABCDEF")
+
+    assert cache.get("first") is None
+    assert cache.get("third") == b"ABCDEF"
+    with open(cache.get("second"), "rb") as file:
+        assert file.read() == b"abcdef"
+    assert cache.hits == {"memory": 1, "disk": 1}
+    assert sorted(os.listdir(tmp_path)) == ["second", "third"]
+
+
+def test_result_cache_drops_part_file_of_aborted_body(tmp_path):
+    def failing_body():
+        yield b"abcdef" * 4
+        raise ValueError("chunk failed")
+
+    cache = ResultCache(10, str(tmp_path), 1024)
+    left = cache.tee("left", iter([b"abcdef"] * 4))
+    assert next(left) == b"abcdef"
+    assert next(left) == b"abcdef"
+    left.close()
+
+    failed = cache.tee("failed", failing_body())
+    next(failed)
+    with pytest.raises(ValueError):
+        next(failed)
+
+    assert os.listdir(tmp_path) == []
+    assert cache.get("left") is None and cache.get("failed") is None
+
+
+def test_job_processes_file_in_background(csv_file):
+    steps = [
+        {"operation": "remove_chars", "column_name": "name", "arguments": {"chars_to_be_removed": ["'"]}},
+        {"operation": "to_upper", "column_name": "name"},
+    ]
+    with open(csv_file, "rb") as test_file:
+        created = client.post("/jobs", params={"chunk_size": 2}, files={"file": test_file}, data={"steps": json.dumps(steps)})
+    job_id = created.json()["job_id"]
+
+    for _ in range(100):
+        job = client.get(f"/jobs/{job_id}").json()
+        if job["status"] in ("done", "failed"):
+            break
+        time.sleep(0.05)
+    result = client.get(f"/jobs/{job_id}/result")
+
+    assert created.status_code == 202
+    assert job["status"] == "done"
+    assert job["chunks_done"] == 2
+    assert job["rows_processed"] == 3
+    assert job["progress"] == 1
+    assert result.text.splitlines() == ["id,name", "1,JOHN DOE", "2,JANE SMITH", "3,MICHAEL BROWN"]
+    assert client.get("/jobs/unknown").status_code == 404
+    assert client.post("/jobs", files={"file": ("sample.csv", "id\n1\n")}).status_code == 400
+
+
+def test_full_job_queue_leaves_no_files(monkeypatch, tmp_path):
+    monkeypatch.setattr("main.JOB_DIR", str(tmp_path))
+    monkeypatch.setattr("main.JOBS", JobQueue(workers=1, queue_size=0, history=1))
+    steps = [{"operation": "to_upper", "column_name": "name"}]
+
+    response = client.post("/jobs", files={"file": ("sample.csv", "id,name\n1,a\n")}, data={"steps": json.dumps(steps)})
+
+    assert response.status_code == 429
+    assert os.listdir(tmp_path) == []
+
+
+def test_job_files_are_private(monkeypatch, tmp_path):
+    monkeypatch.setattr("main.JOB_DIR", str(tmp_path / "jobs"))
+    steps = [{"operation": "to_upper", "column_name": "name"}]
+
+    response = client.post("/jobs", files={"file": ("sample.csv", "id,name\n1,a\n")}, data={"steps": json.dumps(steps)})
+    job_directory = tmp_path / "jobs" / response.json()["job_id"]
+
+    assert response.status_code == 202
+    assert os.stat(tmp_path / "jobs").st_mode & 0o777 == 0o700
+    assert os.stat(job_directory).st_mode & 0o777 == 0o700
+
+
+def test_string_engines_agree():
+    pytest.importorskip("pyarrow")
+    content = "id,text,empty\n1,'Straße  ΟΔΟΣ' .,\n2,,\n3,<b>dž</b>   www.x.io,\n4,Ünïcode-ǅ 42 ,\n"
+    params = {
+        "to_remove_spaces": True, "to_title_format": True, "to_remove_html_tags": True,
+        "to_remove_numerical_characters": True, "to_replace_chars": ["e", "-"],
+        "string_to_replace_with": "_", "output_format": "csv",
+    }
+
+    responses = {
+        engine: client.post(
+            "/upload/", params={**params, "string_engine": engine}, files={"file": ("sample.csv", content)},
+            data={"column_name": "text"},
+        )
+        for engine in ("object", "pyarrow")
+    }
+
+    assert responses["pyarrow"].status_code == 200
+    assert responses["pyarrow"].text == responses["object"].text
+    assert read_csv_frame(io.BytesIO(content.encode()), ReadOptions(string_engine="pyarrow")).dtypes.astype(str).tolist() == ["int64", "str", "float64"]
+
+
+def test_upload_file_reads_compressed_and_pruned_files():
+    content = b"id,name,score\n1, John ,1.5\n2,Jane,\n"
+    expected = "id,name\n1, JOHN\n2,JANE\n"
+
+    for body in (content, gzip.compress(content)):
+        response = client.post(
+            "/upload/",
+            params={"to_remove_spaces": True, "to_uppercase": True, "usecols": ["id", "name"], "output_format": "csv"},
+            files={"file": ("sample.csv.gz", body)},
+            data={"column_name": "name", "dtypes": json.dumps({"id": "int32"})},
+        )
+        assert response.text == expected
+
+    bad_dtype = client.post(
+        "/upload/", params={"to_uppercase": True}, files={"file": ("sample.csv", content)},
+        data={"column_name": "name", "dtypes": json.dumps({"id": "number"})},
+    )
+    assert bad_dtype.status_code == 400
+    assert plan_columns(compile_pipeline([("to_upper", {"column_name": "name"})])) == ["name"]
+    assert plan_columns(compile_pipeline([("remove_duplicate_rows", {})])) is None
+
+
+def test_upload_file_reads_zstd_with_usecols():
+    pa = pytest.importorskip("pyarrow")
+    sink = pa.BufferOutputStream()
+    with pa.CompressedOutputStream(sink, "zstd") as stream:
+        stream.write(b"id,name,score\n1, John ,1.5\n2,Jane,\n")
+    body = sink.getvalue().to_pybytes()
+
+    for params in ({"usecols": ["id", "name"], "output_format": "csv"},
+                   {"usecols": ["id", "name"], "output_format": "csv", "chunk_size": 1}):
+        response = client.post(
+            "/upload/",
+            params={"to_uppercase": True, **params},
+            files={"file": ("sample.csv.zst", body)},
+            data={"column_name": "name"},
+        )
+        assert response.text == "id,name\n1, JOHN \n2,JANE\n"
+
+    response = client.post(
+        "/upload/", params={"to_lowercase": True}, files={"file": ("sample.csv.zst", body)},
+        data={"column_name": "name"},
+    )
+    assert response.status_code == 200
+    assert response.json() == {"success": True}
 
 
 if __name__ == "__main__":